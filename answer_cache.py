@@ -0,0 +1,213 @@
+# answer_cache.py
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, FrozenSet, Optional, Set
+
+from handbook_cache import normalize_query
+from handbook_tokenizer import get_tokenizer
+
+logger = logging.getLogger(__name__)
+
+# 近似查找时每次最多比较的候选条目数
+NEAR_DUPLICATE_CANDIDATES = 200
+# 键格式的版本，归一化方式变化后旧条目不再命中
+KEY_VERSION = '3'
+# 代码和运算符：数字和除问号外的ASCII标点。含有这些字符的问题只做精确匹配，
+# 一个字符之差（如 1/0 与 1*0、a[0] 与 a(0)）就是不同的问题
+CODE_CHARS = re.compile(r'[0-9!"#$%&\'()*+,\-./:;<=>@\[\\\]^_`{|}~]')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    question TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    model TEXT NOT NULL,
+    context_hash TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS answers_scope ON answers (prompt_version, model, context_hash);
+CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used_at);
+"""
+
+
+def contains_code(text: str) -> bool:
+    return CODE_CHARS.search(text) is not None
+
+
+def normalize_question(question: str) -> str:
+    """问题归一化：含代码或运算符的问题只去掉首尾空白，大小写和缩进都保留；
+    其余问题做小写和空白合并"""
+    if contains_code(question):
+        return question.strip()
+    return normalize_query(question)
+
+
+def content_terms(text: str) -> FrozenSet[str]:
+    """问题的检索词集合（去掉停用词），近似匹配要求两个问题的检索词完全相同"""
+    return frozenset(get_tokenizer().tokenize(text))
+
+
+def content_hash(text: Optional[str]) -> str:
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()[:16]
+
+
+def shingles(text: str, size: int = 2) -> Set[str]:
+    """字符n-gram集合（忽略空白和标点），中文问题不分词也能比较相似度"""
+    text = ''.join(ch for ch in text if ch.isalnum())
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def similarity(a: Set[str], b: Set[str]) -> float:
+    """两个n-gram集合的Jaccard相似度"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class AnswerCache:
+    """LLM回答的磁盘缓存（SQLite）。
+
+    键由归一化问题、系统提示词版本、模型和手册上下文的哈希组成，提示词、模型或检索到的手册内容
+    变化后不会命中旧回答。可选的近似查找（默认关闭）只用于不含代码和运算符的问题，在键的其余部分
+    相同的条目中寻找检索词完全相同、字符n-gram相似度不低于阈值的问题，例如"什么是装饰器"与
+    "装饰器是什么"；"升序"与"降序"这类只差一个词的问题检索词不同，不会匹配。
+    条目超过有效期后失效；总大小超过上限时按最久未使用淘汰；每个条目记录命中次数。
+    """
+
+    def __init__(self, path, ttl: float = 7 * 24 * 3600, max_bytes: int = 64 * 1024 * 1024,
+                 near_duplicate: bool = False, threshold: float = 0.9):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.near_duplicate = near_duplicate
+        self.threshold = threshold
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(question: str, prompt_version: str, model: str, context_hash: str) -> str:
+        return content_hash('\x1f'.join((KEY_VERSION, question, prompt_version, model, context_hash)))
+
+    def get(self, question: str, prompt_version: str, model: str, context: Optional[str]) -> Optional[str]:
+        """查找缓存的回答：先精确匹配，未命中且开启近似查找时匹配相似问题"""
+        normalized = normalize_question(question)
+        context_key = content_hash(context)
+        now = time.time()
+        expired_before = now - self.ttl
+        with self._lock:
+            key = self.make_key(normalized, prompt_version, model, context_key)
+            row = self._conn.execute(
+                "SELECT answer FROM answers WHERE key = ? AND created_at >= ?", (key, expired_before)
+            ).fetchone()
+            if row is None and self.near_duplicate and not contains_code(normalized):
+                key, row = self._nearest(normalized, prompt_version, model, context_key, expired_before)
+                if row is not None:
+                    self.near_hits += 1
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE answers SET hits = hits + 1, last_used_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def _nearest(self, normalized: str, prompt_version: str, model: str, context_key: str,
+                 expired_before: float):
+        """同一提示词、模型和上下文下检索词相同且最相似的条目，没有时返回(None, None)"""
+        target = shingles(normalized)
+        terms = content_terms(normalized)
+        if not terms:
+            return None, None
+        candidates = self._conn.execute(
+            "SELECT key, question, answer FROM answers "
+            "WHERE prompt_version = ? AND model = ? AND context_hash = ? AND created_at >= ? "
+            "ORDER BY hits DESC, last_used_at DESC LIMIT ?",
+            (prompt_version, model, context_key, expired_before, NEAR_DUPLICATE_CANDIDATES)
+        ).fetchall()
+        best, best_score = (None, None), self.threshold
+        for key, question, answer in candidates:
+            if contains_code(question) or content_terms(question) != terms:
+                continue
+            score = similarity(target, shingles(question))
+            if score >= best_score:
+                best, best_score = (key, (answer,)), score
+        return best
+
+    def put(self, question: str, prompt_version: str, model: str, context: Optional[str], answer: str):
+        """写入（或覆盖）回答，写入后超出大小上限时淘汰"""
+        normalized = normalize_question(question)
+        context_key = content_hash(context)
+        key = self.make_key(normalized, prompt_version, model, context_key)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers "
+                "(key, question, prompt_version, model, context_hash, answer, size, created_at, last_used_at, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, normalized, prompt_version, model, context_key, answer,
+                 len(answer.encode('utf-8')), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        """删除过期条目；总大小仍超过上限时从最久未使用的条目开始删除"""
+        cursor = self._conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+        self.evictions += cursor.rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        victims, freed = [], 0
+        for key, size in self._conn.execute("SELECT key, size FROM answers ORDER BY last_used_at"):
+            if freed >= excess:
+                break
+            victims.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM answers WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        """条目数、总大小和命中统计，以及命中次数最多的问题"""
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+            top = self._conn.execute(
+                "SELECT question, hits FROM answers ORDER BY hits DESC LIMIT 10").fetchall()
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'bytes': total,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'near_duplicate_hits': self.near_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'top_questions': [{'question': question, 'hits': hits} for question, hits in top]
+            }
@@ -1,8 +1,10 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, session, Response, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, Response, redirect, url_for, stream_with_context
 from datetime import datetime
 import json
 from python_agent import PythonProgrammingAgent
+from handbook_corpora import get_shared_corpora
+from handbook_watcher import watch_handbook
 import markdown
 import html
 import time
@@ -11,6 +13,7 @@ import subprocess
 import re
 import base64
 from io import BytesIO
+import queue
 import threading
 import hashlib
 from urllib.parse import urlencode
@@ -20,6 +23,9 @@ import pymysql
 from functools import wraps
 import uuid
 from werkzeug.utils import secure_filename
+from werkzeug.http import dump_cookie
+from flask.sessions import SecureCookieSession
+from itsdangerous import BadSignature
 import fitz  # PyMuPDF
 from PIL import Image
 import numpy as np
@@ -48,6 +54,14 @@ MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_IMAGE_SIZE
 
+# 文档搜索分页：默认每页条数、每页上限，以及流式搜索最多输出的条数
+MARKDOWN_SEARCH_PAGE_SIZE = 50
+MARKDOWN_SEARCH_MAX_PAGE_SIZE = 200
+MARKDOWN_SEARCH_STREAM_LIMIT = 500
+
+# 流式回答等待LLM输出时的心跳间隔（秒）
+ASK_STREAM_HEARTBEAT = 10
+
 # 创建上传目录
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs('static/images/handbook', exist_ok=True)
@@ -75,16 +89,17 @@ DB_CONFIG = {
     'cursorclass': pymysql.cursors.DictCursor
 }
 
-# 数据库连接池
-db_connection = None
+# 数据库连接：pymysql连接不能跨线程使用，每个线程各自持有一个连接
+# （包括ASGI入口中专门执行数据库操作的线程）
+_db_local = threading.local()
 
 def get_db_connection():
-    """获取数据库连接"""
-    global db_connection
+    """获取当前线程的数据库连接"""
+    db_connection = getattr(_db_local, 'connection', None)
     try:
         # 检查连接是否存在且有效
         if db_connection is None:
-            db_connection = pymysql.connect(**DB_CONFIG)
+            db_connection = _db_local.connection = pymysql.connect(**DB_CONFIG)
         else:
             # 尝试ping来检查连接是否有效
             try:
@@ -92,13 +107,13 @@ def get_db_connection():
             except:
                 # 如果ping失败，重新连接
                 db_connection.close()
-                db_connection = pymysql.connect(**DB_CONFIG)
+                db_connection = _db_local.connection = pymysql.connect(**DB_CONFIG)
         return db_connection
     except Exception as e:
         logger.error(f"数据库连接失败: {e}")
         # 尝试重新连接一次
         try:
-            db_connection = pymysql.connect(**DB_CONFIG)
+            db_connection = _db_local.connection = pymysql.connect(**DB_CONFIG)
             return db_connection
         except:
             raise
@@ -155,12 +170,43 @@ def init_database():
         logger.error(f"数据库初始化失败: {e}")
         raise
 
+LOGIN_REQUIRED_ERROR = '请先登录'
+
+def is_logged_in(user_session) -> bool:
+    """会话中是否已登录（WSGI和ASGI入口共用）"""
+    return 'user_id' in user_session
+
+def decode_session_cookie(value):
+    """按Flask会话接口的方式校验并解码会话Cookie，无效或过期时返回空会话（供ASGI入口使用）"""
+    serializer = app.session_interface.get_signing_serializer(app)
+    if serializer is None or not value:
+        return SecureCookieSession()
+    try:
+        data = serializer.loads(value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return SecureCookieSession()
+    return SecureCookieSession(data)
+
+def session_cookie_header(user_session) -> str:
+    """把会话编码为Set-Cookie响应头的值，Cookie属性与Flask会话接口一致"""
+    interface = app.session_interface
+    return dump_cookie(
+        app.config['SESSION_COOKIE_NAME'],
+        interface.get_signing_serializer(app).dumps(dict(user_session)),
+        expires=interface.get_expiration_time(app, user_session),
+        path=interface.get_cookie_path(app),
+        domain=interface.get_cookie_domain(app),
+        secure=interface.get_cookie_secure(app),
+        httponly=interface.get_cookie_httponly(app),
+        samesite=interface.get_cookie_samesite(app)
+    )
+
 def require_login(f):
     """登录装饰器"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return jsonify({'error': '请先登录'}), 401
+        if not is_logged_in(session):
+            return jsonify({'error': LOGIN_REQUIRED_ERROR}), 401
         return f(*args, **kwargs)
     return decorated_function
 
@@ -183,9 +229,22 @@ def initialize_agent():
                 self.name = "Python编程助手（基础模式）"
                 self.enhanced_handbook = None
 
-            def ask_question(self, question: str) -> str:
+            def ask_question(self, question: str, use_cache: bool = True) -> str:
                 return f"⚠️ 系统初始化失败，当前运行在基础模式。\n\n您的问题是：{question}\n\n请检查：\n1. API密钥配置\n2. 网络连接\n3. 依赖包安装"
 
+            def stream_question(self, question: str, use_cache: bool = True):
+                answer = self.ask_question(question)
+                yield answer
+                return answer
+
+            async def aask_question(self, question: str, use_cache: bool = True) -> str:
+                return self.ask_question(question)
+
+            async def astream_question(self, question: str, use_cache: bool = True):
+                answer = self.ask_question(question)
+                yield 'delta', answer
+                yield 'answer', answer
+
             def syntax_checker(self, code: str) -> str:
                 return "语法检查功能在当前模式下不可用，请检查系统初始化状态"
 
@@ -201,429 +260,40 @@ def initialize_agent():
         python_agent = FallbackAgent()
         return False
 
-# Markdown处理器类
-class MarkdownHandbook:
-    """Markdown文档处理器，支持搜索Python-100-Days文件夹中的Markdown文件"""
-    
-    def __init__(self, base_path: str):
-        self.base_path = Path(base_path)
-        self.md_files = []  # 所有Markdown文件路径
-        self.content_index = {}  # 关键词到位置的索引
-        self.image_index = {}    # 图片到内容的映射
-        self.sections = {}       # 文件章节结构
-        self.text_cache = {}     # 文件文本缓存
-        self.images_cache = {}   # 图片缓存（本地图片）
-        self.load_markdown_files()
-        
-    def load_markdown_files(self):
-        """加载所有Markdown文件"""
-        try:
-            # 遍历文件夹，找到所有.md文件
-            for md_file in self.base_path.rglob("*.md"):
-                self.md_files.append(md_file)
-                self._index_file(md_file)
-            
-            logger.info(f"加载了 {len(self.md_files)} 个Markdown文件")
-            self._build_global_index()
-            
-        except Exception as e:
-            logger.error(f"加载Markdown文件失败: {e}")
-    
-    def _index_file(self, md_path: Path):
-        """索引单个Markdown文件"""
-        try:
-            # 读取Markdown文件内容
-            content = md_path.read_text(encoding='utf-8', errors='ignore')
-            
-            # 相对路径作为键
-            rel_path = str(md_path.relative_to(self.base_path))
-            file_key = rel_path.replace('\\', '/')
-            
-            # 缓存文本内容
-            self.text_cache[file_key] = content
-            
-            # 提取章节结构
-            self._parse_sections(file_key, content)
-            
-            # 提取图片信息
-            self._extract_images(file_key, content, md_path)
-            
-            # 提取关键词
-            keywords = self._extract_keywords(content)
-            for keyword in keywords:
-                if keyword not in self.content_index:
-                    self.content_index[keyword] = []
-                self.content_index[keyword].append({
-                    'file': file_key,
-                    'content': content[:500],  # 截取前500字符
-                    'relevance': 'high'
-                })
-                
-        except Exception as e:
-            logger.error(f"索引文件 {md_path} 失败: {e}")
-    
-    def _parse_sections(self, file_key: str, content: str):
-        """解析Markdown文件的章节结构"""
-        lines = content.split('\n')
-        current_section = "简介"
-        section_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            
-            # 检测Markdown标题（# 到 ######）
-            if line.startswith('#'):
-                # 保存上一个章节
-                if section_lines:
-                    section_key = f"{file_key}#{current_section}"
-                    self.sections[section_key] = '\n'.join(section_lines)
-                
-                # 提取新章节标题
-                # 移除#号和空格
-                current_section = line.lstrip('#').strip()
-                section_lines = []
-            else:
-                section_lines.append(line)
-        
-        # 保存最后一个章节
-        if section_lines:
-            section_key = f"{file_key}#{current_section}"
-            self.sections[section_key] = '\n'.join(section_lines)
-    
-    def _extract_images(self, file_key: str, content: str, md_path: Path):
-        """提取Markdown中的图片信息"""
-        try:
-            # 使用正则表达式匹配Markdown图片语法
-            # ![alt text](image_url "title")
-            img_pattern = r'!\[(.*?)\]\((.*?)(?:\s+"(.*?)")?\)'
-            
-            for match in re.finditer(img_pattern, content, re.IGNORECASE):
-                alt_text = match.group(1) or "图片"
-                img_url = match.group(2)
-                title = match.group(3) or alt_text
-                
-                # 处理图片路径
-                if img_url.startswith('http'):
-                    # 网络图片，直接使用URL
-                    img_key = f"web_{hashlib.md5(img_url.encode()).hexdigest()[:8]}"
-                    self.images_cache[img_key] = {
-                        'type': 'web',
-                        'url': img_url,
-                        'alt': alt_text,
-                        'title': title,
-                        'file': file_key,
-                        'base64': None  # 网络图片不转换为base64
-                    }
-                else:
-                    # 本地图片，需要处理相对路径
-                    img_path = self._resolve_image_path(img_url, md_path)
-                    if img_path and img_path.exists():
-                        # 转换为base64
-                        try:
-                            img_bytes = img_path.read_bytes()
-                            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-                            
-                            # 确定MIME类型
-                            ext = img_path.suffix.lower()
-                            mime_types = {
-                                '.png': 'image/png',
-                                '.jpg': 'image/jpeg',
-                                '.jpeg': 'image/jpeg',
-                                '.gif': 'image/gif',
-                                '.bmp': 'image/bmp',
-                                '.webp': 'image/webp'
-                            }
-                            mime_type = mime_types.get(ext, 'image/jpeg')
-                            
-                            img_key = f"local_{hashlib.md5(img_path.read_bytes()).hexdigest()[:8]}"
-                            self.images_cache[img_key] = {
-                                'type': 'local',
-                                'path': str(img_path),
-                                'url': img_url,
-                                'alt': alt_text,
-                                'title': title,
-                                'file': file_key,
-                                'base64': f'data:{mime_type};base64,{img_base64}'
-                            }
-                            
-                            # 建立图片索引
-                            keywords = self._extract_keywords(alt_text + ' ' + title)
-                            for keyword in keywords:
-                                if keyword not in self.image_index:
-                                    self.image_index[keyword] = []
-                                self.image_index[keyword].append(img_key)
-                                
-                        except Exception as e:
-                            logger.warning(f"无法读取图片 {img_path}: {e}")
-                    
-        except Exception as e:
-            logger.error(f"提取图片失败: {e}")
-    
-    def _resolve_image_path(self, img_url: str, md_path: Path):
-        """解析图片相对路径"""
-        try:
-            # 解码URL编码
-            import urllib.parse
-            img_url = urllib.parse.unquote(img_url)
-            
-            # 移除可能的查询参数
-            img_url = img_url.split('?')[0]
-            
-            # 处理不同的路径格式
-            if img_url.startswith('/'):
-                # 相对于项目根目录
-                return self.base_path / img_url.lstrip('/')
-            elif img_url.startswith('./'):
-                # 相对于当前文件
-                return md_path.parent / img_url[2:]
-            elif img_url.startswith('../'):
-                # 相对于上级目录
-                return md_path.parent / img_url
-            else:
-                # 假设相对于当前文件
-                return md_path.parent / img_url
-                
-        except Exception as e:
-            logger.error(f"解析图片路径失败 {img_url}: {e}")
-            return None
-    
-    def _extract_keywords(self, text: str, max_keywords: int = 10):
-        """从文本中提取关键词"""
-        # 移除停用词
-        stop_words = {'的', '了', '和', '是', '在', '有', '就', '都', '而', '及', '与', '或', '等'}
-        
-        # 提取中英文单词
-        words = re.findall(r'[\u4e00-\u9fff]{2,5}', text) + re.findall(r'\b[a-zA-Z]{3,}\b', text)
-        
-        # 统计词频
-        word_freq = {}
-        for word in words:
-            if word not in stop_words:
-                word_freq[word] = word_freq.get(word, 0) + 1
-        
-        # 按频率排序
-        sorted_words = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)
-        return [word for word, freq in sorted_words[:max_keywords]]
-    
-    def _build_global_index(self):
-        """构建全局索引"""
-        python_keywords = {
-            'python', '语法', '函数', '类', '对象', '模块', '包', '异常', '装饰器',
-            '生成器', '迭代器', '列表', '字典', '集合', '元组', '字符串',
-            '文件', '输入输出', '多线程', '异步', '网络', '数据库',
-            '测试', '调试', '性能', '优化', '算法', '数据结构', '爬虫',
-            '数据分析', '机器学习', '深度学习', 'web开发', 'gui'
-        }
-        
-        for file_key, content in self.text_cache.items():
-            # 为每个关键词建立索引
-            for keyword in python_keywords:
-                if keyword.lower() in content.lower():
-                    if keyword not in self.content_index:
-                        self.content_index[keyword] = []
-                    
-                    # 提取上下文
-                    context = self._get_context(content, keyword, 200)
-                    self.content_index[keyword].append({
-                        'file': file_key,
-                        'context': context,
-                        'type': 'keyword_match'
-                    })
-    
-    def _get_context(self, text: str, keyword: str, context_size: int = 200):
-        """获取关键词上下文"""
-        # 不区分大小写搜索
-        pattern = re.compile(re.escape(keyword), re.IGNORECASE)
-        match = pattern.search(text)
-        if not match:
-            return ""
-        
-        pos = match.start()
-        start = max(0, pos - context_size // 2)
-        end = min(len(text), pos + len(keyword) + context_size // 2)
-        return text[start:end]
-    
-    def search_with_images(self, query: str, max_results: int = 5):
-        """搜索内容并返回相关图片"""
-        results = {
-            'text_results': [],
-            'image_results': [],
-            'sections': []
-        }
-        
-        query_lower = query.lower()
-        
-        # 1. 搜索章节
-        for section_key, content in self.sections.items():
-            if query_lower in section_key.lower() or query_lower in content.lower():
-                # 提取文件名和章节名
-                if '#' in section_key:
-                    file_part, section_part = section_key.split('#', 1)
-                    # 提取相关段落
-                    paragraphs = content.split('\n')
-                    relevant_content = []
-                    
-                    for para in paragraphs:
-                        if query_lower in para.lower():
-                            clean_para = re.sub(r'\s+', ' ', para).strip()
-                            if len(clean_para) > 30:
-                                relevant_content.append(clean_para)
-                    
-                    if relevant_content:
-                        results['sections'].append({
-                            'file': file_part,
-                            'title': section_part,
-                            'content': ' '.join(relevant_content[:2]),
-                            'full_content': content[:1000]
-                        })
-        
-        # 2. 搜索关键词索引
-        for keyword in query_lower.split():
-            if keyword in self.content_index:
-                for item in self.content_index[keyword][:max_results]:
-                    results['text_results'].append({
-                        'type': 'keyword',
-                        'keyword': keyword,
-                        'content': item.get('context', item.get('content', '')),
-                        'file': item.get('file', ''),
-                        'relevance': item.get('relevance', 'medium')
-                    })
-        
-        # 3. 搜索相关图片
-        for keyword in query_lower.split():
-            if keyword in self.image_index:
-                for image_key in self.image_index[keyword][:3]:
-                    if image_key in self.images_cache:
-                        image_info = self.images_cache[image_key]
-                        results['image_results'].append({
-                            'key': image_key,
-                            'caption': image_info['title'],
-                            'base64': image_info.get('base64'),
-                            'url': image_info.get('url'),
-                            'file': image_info['file'],
-                            'related_keyword': keyword,
-                            'type': image_info['type']
-                        })
-        
-        # 如果没有直接结果，尝试模糊匹配
-        if not results['text_results'] and not results['image_results']:
-            results = self._fuzzy_search(query)
-        
-        return results
-    
-    def _fuzzy_search(self, query: str):
-        """模糊搜索"""
-        results = {
-            'text_results': [],
-            'image_results': [],
-            'sections': []
-        }
-        
-        # 在所有文本中搜索
-        for file_key, text in self.text_cache.items():
-            if query.lower() in text.lower():
-                context = self._get_context(text, query, 300)
-                results['text_results'].append({
-                    'type': 'full_text',
-                    'content': context,
-                    'file': file_key,
-                    'relevance': 'medium'
-                })
-        
-        return results
-    
-    def get_relevant_images(self, topic: str, limit: int = 3):
-        """获取特定主题的相关图片"""
-        images = []
-        
-        # 从图片索引中查找
-        for keyword in topic.lower().split():
-            if keyword in self.image_index:
-                for image_key in self.image_index[keyword][:limit]:
-                    if image_key in self.images_cache:
-                        images.append(self.images_cache[image_key])
-        
-        # 如果没有找到，返回README文件中的图片
-        if not images:
-            for key, img in self.images_cache.items():
-                if 'README' in img['file']:
-                    images.append(img)
-                    if len(images) >= limit:
-                        break
-        
-        return images
-    
-    def get_page_images(self, page_num: int):
-        """获取指定页面的所有图片（为兼容性保留）"""
-        images = []
-        return images
-    
-    def search_exact_content(self, exact_phrase: str):
-        """精确短语搜索"""
-        results = []
-        
-        for file_key, text in self.text_cache.items():
-            positions = [m.start() for m in re.finditer(re.escape(exact_phrase), text, re.IGNORECASE)]
-            
-            for pos in positions[:3]:  # 最多3个匹配
-                start = max(0, pos - 100)
-                end = min(len(text), pos + len(exact_phrase) + 100)
-                context = text[start:end]
-                
-                results.append({
-                    'file': file_key,
-                    'position': pos,
-                    'context': context,
-                    'exact_match': exact_phrase
-                })
-        
-        return results
-    
-    def generate_citation(self, content: str, max_length: int = 500):
-        """生成引用格式的内容"""
-        if not content:
-            return ""
-        
-        # 在所有文件中查找
-        for file_key, text in self.text_cache.items():
-            if content[:100] in text:
-                start_pos = text.find(content[:100])
-                if start_pos != -1:
-                    return f"《Python-100-Days》{file_key}: {content[:max_length]}..."
-        
-        # 如果没找到，返回原始内容
-        return content[:max_length] + "..."
-    
-    def get_file_content(self, file_path: str):
-        """获取指定文件的内容"""
-        try:
-            full_path = self.base_path / file_path
-            if full_path.exists():
-                return full_path.read_text(encoding='utf-8', errors='ignore')
-        except:
-            pass
-        return None
-
 # 初始化Markdown处理器
-enhanced_handbook = None
+handbook_corpora = None   # 全部命名文档库（每个文档库一个索引分片）
+enhanced_handbook = None  # 默认文档库
 
-def initialize_markdown_handbook():
-    """初始化Markdown文档处理器"""
-    global enhanced_handbook
+def initialize_markdown_handbook(reload: bool = False, corpus: str = None):
+    """初始化Markdown文档处理器；reload时重新加载指定文档库（默认全部）"""
+    global handbook_corpora, enhanced_handbook
     try:
-        base_path = os.path.join(os.path.dirname(__file__), 'static', 'Python-100-Days-master')
-        enhanced_handbook = MarkdownHandbook(base_path)
+        # 与智能体共用同一组手册分片，避免重复建立索引
+        handbook_corpora = get_shared_corpora(reload=reload, corpus=corpus)
+        enhanced_handbook = handbook_corpora.get()
         print("✅ Markdown文档处理器初始化成功")
-        print(f"   加载了 {len(enhanced_handbook.md_files)} 个Markdown文件")
-        print(f"   索引了 {len(enhanced_handbook.images_cache)} 张图片")
-        return True
+        for name, handbook in handbook_corpora.select(corpus):
+            # 后台监视各文档库目录，文件变化时只重新索引该文件
+            watcher = watch_handbook(handbook, name)
+            print(f"   文档库 {name}: 加载了 {len(handbook.md_files)} 个Markdown文件，"
+                  f"索引了 {len(handbook.images_cache)} 张图片")
+            print(f"   索引耗时 {handbook.load_seconds:.2f}s"
+                  f"（复用快照 {handbook.reused_files} 个文件，重新索引 {handbook.indexed_files} 个）")
+            if watcher:
+                print(f"   文档目录监视: {watcher.mode}")
+        return enhanced_handbook is not None
     except Exception as e:
         print(f"❌ Markdown文档处理器初始化失败: {e}")
+        handbook_corpora = None
         enhanced_handbook = None
         return False
 
+def _unknown_corpus(corpus):
+    """请求指定了未配置的文档库时返回错误响应"""
+    if corpus and corpus not in handbook_corpora.paths:
+        return jsonify({'error': f'未知的文档库: {corpus}'})
+    return None
+
 def save_uploaded_image(file):
     """保存上传的图片并返回路径和base64"""
     try:
@@ -668,15 +338,17 @@ def save_uploaded_image(file):
             'error': str(e)
         }
 
-# 启动时初始化
-try:
-    init_database()
-    logger.info("✅ 数据库连接成功")
-except Exception as e:
-    logger.error(f"❌ 数据库初始化失败: {e}")
+# 启动时初始化。手册索引进程池（forkserver/spawn）的子进程以 __mp_main__ 重新导入本模块，
+# 不在其中连接数据库或初始化
+if __name__ != '__mp_main__':
+    try:
+        init_database()
+        logger.info("✅ 数据库连接成功")
+    except Exception as e:
+        logger.error(f"❌ 数据库初始化失败: {e}")
 
-initialize_agent()
-initialize_markdown_handbook()
+    initialize_agent()
+    initialize_markdown_handbook()
 
 # 工具函数：删除空白对话
 def delete_empty_conversations(user_id: int):
@@ -696,28 +368,33 @@ def delete_empty_conversations(user_id: int):
         logger.error(f"删除空白对话失败: {e}")
 
 # 存储对话历史（数据库版本）
+def create_conversation(user_id):
+    """为用户创建新对话，返回对话ID，失败时返回None"""
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO conversations (user_id, title) VALUES (%s, %s)",
+                (user_id, '新对话')
+            )
+            conn.commit()
+            return cursor.lastrowid
+    except Exception as e:
+        logger.error(f"创建对话失败: {e}")
+        return None
+
 def get_current_conversation_id():
     """获取当前对话ID，如果不存在则创建新对话"""
-    if 'user_id' not in session:
+    if not is_logged_in(session):
         return None
 
     if 'conversation_id' not in session:
         # 创建新对话
-        try:
-            conn = get_db_connection()
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "INSERT INTO conversations (user_id, title) VALUES (%s, %s)",
-                    (session['user_id'], '新对话')
-                )
-                conn.commit()
-                conversation_id = cursor.lastrowid
-                session['conversation_id'] = conversation_id
-                session.modified = True
-                return conversation_id
-        except Exception as e:
-            logger.error(f"创建对话失败: {e}")
-            return None
+        conversation_id = create_conversation(session['user_id'])
+        if conversation_id:
+            session['conversation_id'] = conversation_id
+            session.modified = True
+        return conversation_id
 
     return session.get('conversation_id')
 
@@ -754,7 +431,10 @@ def add_to_chat_history(role, message, message_type="text"):
     conversation_id = get_current_conversation_id()
     if not conversation_id:
         return
+    save_message(conversation_id, role, message, message_type)
 
+def save_message(conversation_id, role, message, message_type="text"):
+    """把消息写入指定对话，第一条用户消息同时作为对话标题"""
     try:
         conn = get_db_connection()
         with conn.cursor() as cursor:
@@ -780,6 +460,21 @@ def add_to_chat_history(role, message, message_type="text"):
     except Exception as e:
         logger.error(f"保存消息失败: {e}")
 
+def render_answer_html(answer):
+    """处理图像标记并转换为HTML，处理失败时回退到基本Markdown转换"""
+    try:
+        return process_ai_response(answer)
+    except Exception as e:
+        print(f"响应处理错误: {e}")
+        try:
+            escaped_answer = html.escape(answer)
+            return markdown.markdown(
+                escaped_answer,
+                extensions=['fenced_code', 'codehilite', 'tables']
+            )
+        except:
+            return f"<pre>{html.escape(answer)}</pre>"
+
 def process_ai_response(response_text):
     """
     处理AI响应，提取并显示图像
@@ -808,11 +503,16 @@ def process_ai_response(response_text):
     for img_name, img_data in images:
         # 清理图像数据（移除可能的换行符和空格）
         img_data_clean = img_data.strip().replace('\n', '').replace('\r', '')
+        # 标记内可以是图片URL或data URI，否则按裸base64处理
+        if img_data_clean.startswith(('/', 'http://', 'https://', 'data:')):
+            img_src = html.escape(img_data_clean)
+        else:
+            img_src = f"data:image/png;base64,{img_data_clean}"
 
         html_content += f'''
         <div class="result-image">
             <div class="image-title">{img_name.replace("_", " ").title()}</div>
-            <img src="data:image/png;base64,{img_data_clean}" alt="{img_name}" />
+            <img src="{img_src}" alt="{img_name}" />
         </div>
         '''
 
@@ -1302,7 +1002,7 @@ def home():
 @app.route('/pyassistant')
 def index():
     # 检查是否已登录
-    if 'user_id' not in session:
+    if not is_logged_in(session):
         return render_template('index.html', chat_history=[], logged_in=False)
 
     # 获取当前对话的历史记录
@@ -1424,7 +1124,7 @@ def logout():
 @app.route('/check_login', methods=['GET'])
 def check_login():
     """检查登录状态"""
-    if 'user_id' in session:
+    if is_logged_in(session):
         return jsonify({
             'logged_in': True,
             'user_id': session.get('user_id'),
@@ -1470,26 +1170,37 @@ def enhanced_search():
     try:
         data = request.get_json()
         query = data.get('query', '').strip()
+        # 默认只返回图片URL，需要内联时才生成base64
+        inline_images = bool(data.get('inline_images', False))
+        # 只在指定文档库中搜索，默认搜索全部文档库
+        corpus = data.get('corpus') or None
         
         if not query:
             return jsonify({'error': '搜索查询不能为空'})
         
-        if enhanced_handbook is None:
+        if handbook_corpora is None:
             return jsonify({'error': 'Markdown文档处理器未初始化'})
+        error = _unknown_corpus(corpus)
+        if error:
+            return error
         
-        # 执行增强搜索
-        results = enhanced_handbook.search_with_images(query)
+        # 执行增强搜索（并发查询各文档库并合并结果）
+        results = handbook_corpora.search_with_images(query, corpus=corpus)
         
         # 格式化结果
         formatted_results = []
         
         # 处理文本结果
         for result in results.get('text_results', []):
-            citation = enhanced_handbook.generate_citation(result['content'])
+            citation = handbook_corpora.shard(result).generate_citation(result['content'], hit=result)
             formatted_results.append({
                 'type': 'text',
                 'content': citation,
+                'corpus': result['corpus'],
                 'file': result.get('file', ''),
+                'section': result.get('section', ''),
+                'line': result.get('line'),
+                'anchor': handbook_corpora.shard(result).citation_anchor(result),
                 'relevance': result.get('relevance', 'medium')
             })
         
@@ -1498,9 +1209,12 @@ def enhanced_search():
             formatted_results.append({
                 'type': 'section',
                 'title': section['title'],
+                'corpus': section['corpus'],
                 'file': section['file'],
                 'content': section['content'],
-                'full_content': section.get('full_content', '')
+                'full_content': section.get('full_content', ''),
+                'line': section.get('line'),
+                'anchor': handbook_corpora.shard(section).citation_anchor(section)
             })
         
         # 处理图片结果
@@ -1508,16 +1222,18 @@ def enhanced_search():
         for img in results.get('image_results', []):
             image_info = {
                 'caption': img['caption'],
+                'corpus': img['corpus'],
                 'file': img['file'],
                 'type': img['type']
             }
             
             # 根据图片类型返回不同的数据
-            if img['type'] == 'local' and img.get('base64'):
-                image_info['base64'] = img['base64']
-                image_info['url'] = img.get('url', '')
-            elif img['type'] == 'web':
-                image_info['url'] = img.get('url', '')
+            image_info['url'] = img.get('url', '')
+            if img['type'] == 'local':
+                image_info['width'] = img.get('width')
+                image_info['height'] = img.get('height')
+                if inline_images:
+                    image_info['base64'] = handbook_corpora.shard(img).get_image_base64(img['key'])
             
             image_results.append(image_info)
         
@@ -1525,7 +1241,8 @@ def enhanced_search():
             'success': True,
             'text_results': formatted_results,
             'image_results': image_results,
-            'total_found': len(formatted_results) + len(image_results)
+            'total_found': len(formatted_results) + len(image_results),
+            'did_you_mean': results.get('did_you_mean')
         })
         
     except Exception as e:
@@ -1560,6 +1277,43 @@ def upload_image():
         logger.error(f"上传图片失败: {e}")
         return jsonify({'success': False, 'error': f'上传图片失败: {str(e)}'})
 
+def cache_bypassed(value):
+    """请求中的no_cache参数：为真时不使用缓存的回答（JSON布尔值或查询参数"1"/"true"）"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+def build_image_question(question, has_image):
+    """带图片提问的完整问题：附加手册中的相关内容和图片提示"""
+    # 如果有图片，先搜索相关的手册内容
+    related_content = ""
+    if question and handbook_corpora:
+        results = handbook_corpora.search_with_images(question)
+        if results['text_results'] or results['sections']:
+            # 构建相关内容的提示
+            related_content = "\n\n根据《Python-100-Days》相关内容：\n"
+            for result in results.get('text_results', [])[:3]:
+                related_content += f"- {result.get('content', '')[:200]}...\n"
+    
+    # 构建完整的提问
+    full_question = question
+    if related_content:
+        full_question = question + related_content
+    
+    # 如果有上传的图片，添加到提示中
+    if has_image:
+        full_question += "\n\n用户上传了相关图片，请结合图片内容进行回答。"
+    return full_question
+
+def attach_handbook_images(answer, question):
+    """把手册中与问题相关的图片以图像标记追加到回答，返回(回答, 图片列表)"""
+    images = []
+    if enhanced_handbook and question:
+        images = enhanced_handbook.get_relevant_images(question, limit=2)
+        for img in images:
+            answer += f"\n\n[IMAGE:{img['title']}]\n{img['url']}\n[/IMAGE]"
+    return answer, images
+
 @app.route('/ask_with_image', methods=['POST'])
 @require_login
 def ask_with_image():
@@ -1572,34 +1326,12 @@ def ask_with_image():
         if not question and not image_base64:
             return jsonify({'error': '问题和图片不能同时为空'})
         
-        # 如果有图片，先搜索相关的手册内容
-        related_content = ""
-        if question and enhanced_handbook:
-            results = enhanced_handbook.search_with_images(question)
-            if results['text_results'] or results['sections']:
-                # 构建相关内容的提示
-                related_content = "\n\n根据《Python-100-Days》相关内容：\n"
-                for result in results.get('text_results', [])[:3]:
-                    related_content += f"- {result.get('content', '')[:200]}...\n"
-        
-        # 构建完整的提问
-        full_question = question
-        if related_content:
-            full_question = question + related_content
-        
-        # 如果有上传的图片，添加到提示中
-        if image_base64:
-            full_question += "\n\n用户上传了相关图片，请结合图片内容进行回答。"
-        
         # 调用智能体
-        answer = python_agent.ask_question(full_question)
+        full_question = build_image_question(question, bool(image_base64))
+        answer = python_agent.ask_question(full_question, use_cache=not cache_bypassed(data.get('no_cache')))
         
         # 如果有相关图片，添加到回答中
-        if enhanced_handbook and question:
-            images = enhanced_handbook.get_relevant_images(question, limit=2)
-            if images:
-                for img in images:
-                    answer += f"\n\n[IMAGE:{img['caption']}]\n{img['base64']}\n[/IMAGE]"
+        answer, images = attach_handbook_images(answer, question)
         
         # 处理回答
         answer_html = process_ai_response(answer)
@@ -1611,7 +1343,7 @@ def ask_with_image():
         return jsonify({
             'success': True,
             'answer': answer_html,
-            'has_images': len(images) > 0 if 'images' in locals() else False,
+            'has_images': len(images) > 0,
             'timestamp': datetime.now().strftime("%H:%M:%S")
         })
         
@@ -1782,26 +1514,14 @@ def ask_question():
 
         # 获取智能体回答
         try:
-            answer = python_agent.ask_question(question)
+            answer = python_agent.ask_question(question, use_cache=not cache_bypassed(data.get('no_cache')))
         except Exception as e:
             error_msg = f"获取回答时出错: {str(e)}"
             add_to_chat_history('assistant', error_msg, "text")
             return jsonify({'error': error_msg})
 
         # 处理图像标记并转换为HTML
-        try:
-            answer_html = process_ai_response(answer)
-        except Exception as e:
-            print(f"响应处理错误: {e}")
-            # 如果处理失败，回退到基本Markdown转换
-            try:
-                escaped_answer = html.escape(answer)
-                answer_html = markdown.markdown(
-                    escaped_answer,
-                    extensions=['fenced_code', 'codehilite', 'tables']
-                )
-            except:
-                answer_html = f"<pre>{html.escape(answer)}</pre>"
+        answer_html = render_answer_html(answer)
 
         # 添加智能体回答到历史
         add_to_chat_history('assistant', answer_html, "html")
@@ -1817,68 +1537,83 @@ def ask_question():
         add_to_chat_history('system', error_msg, "text")
         return jsonify({'error': error_msg})
 
-@app.route('/ask_stream', methods=['POST'])
+@app.route('/ask_stream', methods=['GET', 'POST'])
+@require_login
 def ask_question_stream():
-    """流式输出回答"""
+    """流式输出回答（SSE）：LLM生成的文本增量到达即转发，等待期间发送心跳；
+    客户端断开时停止接收LLM输出，正常结束后把完整回答写入对话历史。
+    EventSource使用GET（?question=），也接受POST JSON"""
+    data = (request.get_json() or {}) if request.method == 'POST' else request.args
+    question = data.get('question', '').strip()
+    use_cache = not cache_bypassed(data.get('no_cache'))
+
+    def sse(payload: dict) -> str:
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    if not question:
+        return Response(sse({'error': '问题不能为空'}), mimetype='text/event-stream')
+
+    # 检查智能体是否正常初始化
+    if python_agent is None:
+        error_msg = "智能体未正确初始化，请刷新页面重试"
+        return Response(sse({'error': error_msg}), mimetype='text/event-stream')
+
+    # 在响应开始前写入用户问题：新建对话会修改session，响应头发出后无法再保存
+    add_to_chat_history('user', question)
+
+    agent = python_agent
+    events = queue.Queue()
+    cancelled = threading.Event()
+
+    def produce():
+        """在后台线程中消费LLM的流，增量放入队列；取消后关闭流，停止接收后续输出"""
+        stream = agent.stream_question(question, use_cache=use_cache)
+        try:
+            while not cancelled.is_set():
+                try:
+                    delta = next(stream)
+                except StopIteration as stop:
+                    events.put(('done', stop.value or ''))
+                    return
+                events.put(('delta', delta))
+        except Exception as e:
+            events.put(('error', f"获取回答时出错: {str(e)}"))
+        finally:
+            stream.close()
 
     def generate():
+        worker = threading.Thread(target=produce, name='ask-stream', daemon=True)
+        worker.start()
         try:
-            data = request.get_json()
-            question = data.get('question', '').strip()
-
-            if not question:
-                yield f"data: {json.dumps({'error': '问题不能为空'})}\n\n"
-                return
-
-            # 检查智能体是否正常初始化
-            if python_agent is None:
-                error_msg = "智能体未正确初始化，请刷新页面重试"
-                yield f"data: {json.dumps({'error': error_msg})}\n\n"
-                return
-
-            # 获取智能体回答
-            try:
-                answer = python_agent.ask_question(question)
-            except Exception as e:
-                error_msg = f"获取回答时出错: {str(e)}"
-                yield f"data: {json.dumps({'error': error_msg})}\n\n"
-                return
-
-            # 处理图像标记
-            processed_answer = process_ai_response(answer)
-
-            # 模拟逐行输出
-            lines = processed_answer.split('\n')
-            full_answer = ""
-
-            for i, line in enumerate(lines):
-                if line.strip():  # 跳过空行
-                    full_answer += line + '\n'
-
-                    # 发送当前进度
-                    chunk_data = json.dumps({
-                        'chunk': full_answer,
-                        'finished': False
+            while True:
+                try:
+                    kind, value = events.get(timeout=ASK_STREAM_HEARTBEAT)
+                except queue.Empty:
+                    # SSE注释行作为心跳，保持连接，并让服务端及时发现客户端断开
+                    yield ": heartbeat\n\n"
+                    continue
+
+                if kind == 'delta':
+                    yield sse({'delta': value, 'finished': False})
+                elif kind == 'error':
+                    add_to_chat_history('assistant', value, "text")
+                    yield sse({'error': value})
+                    return
+                else:
+                    answer_html = render_answer_html(value)
+                    add_to_chat_history('assistant', answer_html, "html")
+                    yield sse({
+                        'finished': True,
+                        'full_answer': answer_html,
+                        'timestamp': datetime.now().strftime("%H:%M:%S")
                     })
-                    yield f"data: {chunk_data}\n\n"
-
-                    # 模拟打字延迟
-                    time.sleep(0.05)
-
-            # 发送完成信号
-            finish_data = json.dumps({
-                'chunk': '',
-                'finished': True,
-                'full_answer': full_answer,
-                'timestamp': datetime.now().strftime("%H:%M:%S")
-            })
-            yield f"data: {finish_data}\n\n"
-
-        except Exception as e:
-            error_data = json.dumps({'error': f'处理问题时出现错误: {str(e)}'})
-            yield f"data: {error_data}\n\n"
+                    return
+        finally:
+            # 客户端断开（GeneratorExit）或正常结束时通知后台线程停止
+            cancelled.set()
 
-    return Response(generate(), mimetype='text/event-stream')
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/clear', methods=['POST'])
 @require_login
@@ -1992,36 +1727,46 @@ def analyze_code():
 @app.route('/get_markdown_files', methods=['GET'])
 @require_login
 def get_markdown_files():
-    """获取所有Markdown文件列表"""
+    """获取文档库（默认文档库或?corpus=指定）的Markdown文件列表"""
     try:
-        if enhanced_handbook is None:
+        if handbook_corpora is None:
             return jsonify({'error': '文档处理器未初始化'})
-        
-        # 获取所有Markdown文件的相对路径和基本信息
-        files = []
-        for md_file in enhanced_handbook.md_files:
-            rel_path = str(md_file.relative_to(enhanced_handbook.base_path))
-            file_key = rel_path.replace('\\', '/')
-            
-            # 获取文件大小和修改时间
-            stat = md_file.stat()
-            files.append({
-                'path': file_key,
-                'name': md_file.name,
-                'size': stat.st_size,
-                'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                'has_images': bool([k for k, v in enhanced_handbook.images_cache.items() if v.get('file') == file_key])
-            })
-        
-        # 按路径排序
-        files.sort(key=lambda x: x['path'])
-        
-        return jsonify({
+        corpus = request.args.get('corpus') or handbook_corpora.default
+        error = _unknown_corpus(corpus)
+        if error:
+            return error
+        handbook = handbook_corpora.get(corpus)
+        if handbook is None:
+            return jsonify({'error': f'文档库 {corpus} 未加载'})
+        
+        # 文件列表未变化时直接返回304
+        etag = f"{corpus}-{handbook.files_etag()}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        
+        # 文件元数据在建立索引时已经算好，这里只做字典查找
+        files = [{
+            'path': meta['path'],
+            'name': meta['name'],
+            'title': meta['title'],
+            'size': meta['size'],
+            'modified': meta['modified'],
+            'section_count': meta['section_count'],
+            'image_count': meta['image_count'],
+            'has_images': meta['has_images']
+        } for meta in handbook.list_files()]
+        
+        response = jsonify({
             'success': True,
+            'corpus': corpus,
             'files': files,
             'total_files': len(files),
-            'total_images': len(enhanced_handbook.images_cache)
+            'total_images': len(handbook.images_cache)
         })
+        response.set_etag(etag)
+        return response
         
     except Exception as e:
         logger.error(f"获取Markdown文件列表失败: {e}")
@@ -2030,91 +1775,218 @@ def get_markdown_files():
 @app.route('/get_markdown_content/<path:file_path>', methods=['GET'])
 @require_login
 def get_markdown_content(file_path):
-    """获取指定Markdown文件的内容"""
+    """获取指定Markdown文件的内容（默认文档库或?corpus=指定）"""
     try:
-        if enhanced_handbook is None:
+        if handbook_corpora is None:
             return jsonify({'error': '文档处理器未初始化'})
+        corpus = request.args.get('corpus') or handbook_corpora.default
+        error = _unknown_corpus(corpus)
+        if error:
+            return error
+        handbook = handbook_corpora.get(corpus)
+        if handbook is None:
+            return jsonify({'error': f'文档库 {corpus} 未加载'})
+        
+        # 文件未变化时直接返回304
+        meta = handbook.get_file_meta(file_path)
+        if meta and request.if_none_match.contains(meta['etag']):
+            response = Response(status=304)
+            response.set_etag(meta['etag'])
+            return response
         
         # 获取文件内容
-        content = enhanced_handbook.get_file_content(file_path)
+        content = handbook.get_file_content(file_path)
         if content is None:
             return jsonify({'error': '文件不存在或无法读取'})
         
         # 获取文件相关的图片
-        related_images = []
-        for key, img in enhanced_handbook.images_cache.items():
-            if img.get('file') == file_path.replace('\\', '/'):
-                related_images.append(img)
+        related_images = handbook.get_file_images(file_path)
         
-        return jsonify({
+        response = jsonify({
             'success': True,
             'content': content,
+            'corpus': corpus,
             'path': file_path,
             'images': related_images,
             'image_count': len(related_images)
         })
+        if meta:
+            response.set_etag(meta['etag'])
+        return response
         
     except Exception as e:
         logger.error(f"获取Markdown内容失败: {e}")
         return jsonify({'error': f'获取内容失败: {str(e)}'})
 
+def _search_digest(query: str, corpus: str = None) -> str:
+    """查询和文档库范围的摘要，游标只对同一查询范围有效"""
+    return hashlib.md5(f"{corpus or ''}:{query.lower()}".encode('utf-8')).hexdigest()[:8]
+
+def _encode_search_cursor(query: str, offset: int, corpus: str = None) -> str:
+    """分页游标：对客户端不透明，包含查询摘要和下一页的起始位置"""
+    payload = json.dumps({'q': _search_digest(query, corpus), 'o': offset})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def _decode_search_cursor(cursor: str, query: str, corpus: str = None) -> int:
+    """解析分页游标，游标与查询不匹配时抛出ValueError"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        offset = int(payload['o'])
+    except Exception:
+        raise ValueError('游标无效')
+    if payload.get('q') != _search_digest(query, corpus) or offset < 0:
+        raise ValueError('游标与查询不匹配')
+    return offset
+
+def _render_markdown_hit(hit, query, term_pattern):
+    """为单个命中截取上下文并高亮，只对返回给客户端的行执行"""
+    handbook = handbook_corpora.shard(hit)
+    content = handbook.text_cache.get(hit['file']) if handbook else None
+    if content is None:
+        return None
+    
+    if 'section_key' not in hit:
+        # 子串命中：前后各取100字符并高亮搜索词
+        start = max(0, hit['position'] - 100)
+        end = min(len(content), hit['position'] + len(query) + 100)
+        highlighted = re.sub(
+            f'({re.escape(query)})',
+            '<mark>\\1</mark>',
+            content[start:end],
+            flags=re.IGNORECASE
+        )
+    else:
+        # 章节命中：以第一个命中的词为中心截取，并高亮全部查询词
+        if hit['section_key'] not in handbook.sections:
+            return None
+        section_text = handbook.section_text(hit['section_key'])
+        match = term_pattern.search(section_text) if term_pattern else None
+        start = max(0, match.start() - 100) if match else 0
+        end = min(len(section_text), (match.end() if match else 0) + 100)
+        context = section_text[start:end]
+        highlighted = term_pattern.sub(lambda m: f'<mark>{m.group(0)}</mark>', context) if term_pattern else context
+    
+    return {
+        'corpus': hit['corpus'],
+        'file': hit['file'],
+        'context': highlighted,
+        'position': hit['position'],
+        'score': hit['score']
+    }
+
+def _term_pattern(terms):
+    """查询词的高亮正则，长词优先匹配"""
+    if not terms:
+        return None
+    alternatives = sorted(set(terms), key=len, reverse=True)
+    return re.compile('|'.join(re.escape(term) for term in alternatives), re.IGNORECASE)
+
 @app.route('/search_markdown', methods=['POST'])
 @require_login
 def search_markdown():
-    """搜索Markdown内容"""
+    """搜索Markdown内容，按游标分页，只对本页结果截取上下文和高亮"""
     try:
         data = request.get_json()
         query = data.get('query', '').strip()
         
+        corpus = data.get('corpus') or None
+        
         if not query:
             return jsonify({'error': '搜索关键词不能为空'})
         
-        if enhanced_handbook is None:
+        if handbook_corpora is None:
             return jsonify({'error': '文档处理器未初始化'})
+        error = _unknown_corpus(corpus)
+        if error:
+            return error
         
-        results = []
+        page_size = min(max(int(data.get('page_size') or MARKDOWN_SEARCH_PAGE_SIZE), 1), MARKDOWN_SEARCH_MAX_PAGE_SIZE)
+        cursor = data.get('cursor')
+        try:
+            offset = _decode_search_cursor(cursor, query, corpus) if cursor else 0
+        except ValueError as e:
+            return jsonify({'error': str(e)})
         
-        # 在所有文件中搜索
-        for file_key, content in enhanced_handbook.text_cache.items():
-            # 不区分大小写搜索
-            if query.lower() in content.lower():
-                # 提取匹配的上下文
-                pattern = re.compile(re.escape(query), re.IGNORECASE)
-                matches = list(pattern.finditer(content))
-                
-                for match in matches[:3]:  # 每个文件最多取3个匹配
-                    start = max(0, match.start() - 100)
-                    end = min(len(content), match.end() + 100)
-                    context = content[start:end]
-                    
-                    # 高亮显示搜索词
-                    highlighted = re.sub(
-                        f'({re.escape(query)})',
-                        '<mark>\\1</mark>',
-                        context,
-                        flags=re.IGNORECASE
-                    )
-                    
-                    results.append({
-                        'file': file_key,
-                        'context': highlighted,
-                        'position': match.start(),
-                        'score': len(query) / len(context)  # 简单评分
-                    })
+        # 各文档库的命中合并排序后缓存，翻页时不重复检索
+        found = handbook_corpora.markdown_hits(query, corpus=corpus)
+        hits = found['hits']
+        term_pattern = _term_pattern(found['terms'])
         
-        # 按评分排序
-        results.sort(key=lambda x: x['score'], reverse=True)
+        results = []
+        for hit in hits[offset:offset + page_size]:
+            row = _render_markdown_hit(hit, query, term_pattern)
+            if row:
+                results.append(row)
+        next_offset = offset + page_size
         
         return jsonify({
             'success': True,
-            'results': results[:50],  # 最多返回50个结果
-            'total_matches': len(results)
+            'results': results,
+            'total_matches': len(hits),
+            'next_cursor': _encode_search_cursor(query, next_offset, corpus) if next_offset < len(hits) else None,
+            'did_you_mean': found['did_you_mean']
         })
         
     except Exception as e:
         logger.error(f"搜索Markdown失败: {e}")
         return jsonify({'error': f'搜索失败: {str(e)}'})
 
+@app.route('/search_markdown/stream', methods=['POST'])
+@require_login
+def search_markdown_stream():
+    """流式搜索Markdown内容：每行一个JSON（NDJSON），扫描到命中即输出，最后输出汇总"""
+    data = request.get_json() or {}
+    query = data.get('query', '').strip()
+    limit = min(max(int(data.get('limit') or MARKDOWN_SEARCH_STREAM_LIMIT), 1), MARKDOWN_SEARCH_STREAM_LIMIT)
+    corpus = data.get('corpus') or None
+    
+    if not query:
+        return jsonify({'error': '搜索关键词不能为空'})
+    
+    if handbook_corpora is None:
+        return jsonify({'error': '文档处理器未初始化'})
+    error = _unknown_corpus(corpus)
+    if error:
+        return error
+    
+    corpora = handbook_corpora
+    
+    def generate():
+        sent = 0
+        did_you_mean = None
+        # 各文档库并发扫描，子串命中按到达顺序逐个输出，不等全部文件扫描完
+        phrase_hits = corpora.iter_phrase_hits(query, max_per_file=3, corpus=corpus)
+        try:
+            for hit in phrase_hits:
+                row = _render_markdown_hit(hit, query, None)
+                if row:
+                    yield json.dumps(dict(row, type='hit'), ensure_ascii=False) + '\n'
+                    sent += 1
+                if sent >= limit:
+                    break
+            phrase_hits.close()
+            
+            # 没有子串命中时输出章节排序结果
+            if not sent:
+                found = corpora.markdown_hits(query, corpus=corpus)
+                did_you_mean = found['did_you_mean']
+                term_pattern = _term_pattern(found['terms'])
+                for hit in found['hits'][:limit]:
+                    row = _render_markdown_hit(hit, query, term_pattern)
+                    if row:
+                        yield json.dumps(dict(row, type='hit'), ensure_ascii=False) + '\n'
+                        sent += 1
+            
+            yield json.dumps({'type': 'done', 'total': sent, 'did_you_mean': did_you_mean}, ensure_ascii=False) + '\n'
+        except Exception as e:
+            logger.error(f"流式搜索Markdown失败: {e}")
+            yield json.dumps({'type': 'error', 'error': f'搜索失败: {str(e)}'}, ensure_ascii=False) + '\n'
+        finally:
+            # 客户端断开时停止各文档库的扫描
+            phrase_hits.close()
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
 @app.route('/upload_markdown_image', methods=['POST'])
 @require_login
 def upload_markdown_image():
@@ -2126,16 +1998,18 @@ def upload_markdown_image():
         if not image_path:
             return jsonify({'error': '图片路径不能为空'})
         
-        if enhanced_handbook is None:
+        if handbook_corpora is None:
             return jsonify({'error': '文档处理器未初始化'})
         
-        # 查找图片
-        for key, img in enhanced_handbook.images_cache.items():
-            if img.get('path') == image_path:
-                return jsonify({
-                    'success': True,
-                    'image': img
-                })
+        # 在各文档库中查找图片
+        for name, handbook in handbook_corpora.select():
+            for key, img in handbook.images_cache.items():
+                blob = handbook.image_blobs.get(img.get('hash'))
+                if blob and image_path in (blob['path'], img['url']):
+                    return jsonify({
+                        'success': True,
+                        'image': {**img, **blob, 'corpus': name}
+                    })
         
         return jsonify({'error': '图片未找到'})
         
@@ -2314,20 +2188,63 @@ def health_check():
     
     pdf_status = "loaded" if enhanced_handbook is not None else "not_loaded"
     pdf_images = len(enhanced_handbook.images_cache) if enhanced_handbook else 0
+    handbook_stats = enhanced_handbook.get_stats() if enhanced_handbook else None
+    # 各文档库是否已加载，详细统计见 /handbook_corpora
+    corpora_stats = {
+        name: handbook_corpora.get(name) is not None for name in handbook_corpora.names
+    } if handbook_corpora else None
+    answer_cache = getattr(python_agent, 'answer_cache', None)
+    inflight = getattr(python_agent, 'inflight', None)
+    async_inflight = getattr(python_agent, 'async_inflight', None)
 
     return jsonify({
         'status': status,
         'agent_type': agent_type,
         'pdf_status': pdf_status,
         'pdf_images': pdf_images,
+        'handbook': handbook_stats,
+        'corpora': corpora_stats,
+        'answer_cache': answer_cache.stats() if answer_cache else None,
+        # 合并的并发相同提问：sync为WSGI路由，async为ASGI入口
+        'single_flight': {
+            'sync': inflight.stats(),
+            'async': async_inflight.stats()
+        } if inflight and async_inflight else None,
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/handbook_corpora', methods=['GET'])
+@require_login
+def list_handbook_corpora():
+    """列出配置的文档库及各自的索引统计"""
+    if handbook_corpora is None:
+        return jsonify({'error': '文档处理器未初始化'})
+    return jsonify(dict(handbook_corpora.get_stats(), success=True))
+
+@app.route('/handbook_corpora/<name>/reload', methods=['POST'])
+@require_login
+def reload_handbook_corpus(name):
+    """重新加载单个文档库的索引分片，其他文档库不受影响"""
+    if handbook_corpora is None:
+        return jsonify({'error': '文档处理器未初始化'})
+    error = _unknown_corpus(name)
+    if error:
+        return error
+    success = initialize_markdown_handbook(reload=True, corpus=name)
+    handbook = handbook_corpora.get(name) if success else None
+    return jsonify({
+        'success': handbook is not None,
+        'corpus': name,
+        'stats': handbook.get_stats() if handbook else None
+    })
+
 @app.route('/reinitialize', methods=['POST'])
 def reinitialize_agent():
     """重新初始化智能体"""
     global python_agent
     try:
+        # 先刷新手册索引（未变化的文件直接复用快照），再重建智能体
+        initialize_markdown_handbook(reload=True)
         success = initialize_agent()
         return jsonify({
             'success': success,
@@ -0,0 +1,351 @@
+# asgi.py
+"""ASGI入口：提问类接口在事件循环中异步执行，其余接口仍由Flask应用处理。
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5007
+
+/ask、/ask_stream、/ask_with_image、/analyze_code 使用智能体的异步接口（ainvoke/astream），
+等待模型输出时不占用线程，大量进行中的请求共享少量线程；手册检索、工具执行和响应渲染
+在线程池中进行，数据库操作在单独的小线程池中与模型调用并行执行（线程数见ASGI_DB_WORKERS，
+每个线程持有自己的数据库连接，与WSGI请求线程的连接互不共享），都不阻塞事件循环。
+其余接口交给Flask应用，在事件循环的默认线程池中并发执行。asgiref的WsgiToAsgi默认让
+所有WSGI请求在同一个线程中依次执行，这里改为线程池。
+会话沿用Flask的签名Cookie，Cookie的解码、编码和登录检查与app.py共用同一组函数。
+"""
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.cookies import SimpleCookie
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask.sessions import SecureCookieSession
+
+import app as flask_module
+from config import ASGI_DB_WORKERS
+from app import (ASK_STREAM_HEARTBEAT, LOGIN_REQUIRED_ERROR, app as flask_app, attach_handbook_images,
+                 build_image_question, cache_bypassed, create_conversation, decode_session_cookie,
+                 is_logged_in, render_answer_html, save_message, session_cookie_header)
+
+logger = logging.getLogger(__name__)
+
+
+class Request:
+    """一次HTTP请求：方法、查询参数、请求体和Flask会话"""
+
+    def __init__(self, scope: Dict, body: bytes):
+        self.method = scope['method']
+        self.args = {key: values[0] for key, values in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        self.body = body
+        self.session = self._load_session(scope)
+        self.session_modified = False
+
+    def get_json(self) -> Dict:
+        try:
+            data = json.loads(self.body or b'null')
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    @staticmethod
+    def _load_session(scope: Dict) -> SecureCookieSession:
+        """从请求头取出会话Cookie并解码，无效或过期时为空会话"""
+        cookies = SimpleCookie()
+        for name, value in scope.get('headers', []):
+            if name == b'cookie':
+                cookies.load(value.decode('latin-1'))
+        morsel = cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+        return decode_session_cookie(morsel.value if morsel else None)
+
+    def session_headers(self) -> List[Tuple[bytes, bytes]]:
+        """会话被修改时返回Set-Cookie响应头"""
+        if not self.session_modified:
+            return []
+        return [(b'set-cookie', session_cookie_header(self.session).encode('latin-1'))]
+
+
+class _ThreadPoolWsgiInstance(WsgiToAsgiInstance):
+    """WsgiToAsgiInstance的run_wsgi_app以thread_sensitive=True包装，所有请求排队进入同一个线程；
+    这里改为在事件循环的默认线程池中执行，多个WSGI请求可以同时处理"""
+
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    """在线程池中并发运行WSGI应用的WsgiToAsgi"""
+
+    async def __call__(self, scope, receive, send):
+        await _ThreadPoolWsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+class AsyncAssistantApp:
+    """ASGI应用：提问类接口在这里异步处理，其余请求转交Flask（在线程中运行）"""
+
+    def __init__(self, max_body: Optional[int] = None, db_workers: Optional[int] = None):
+        self.wsgi = ThreadPoolWsgiToAsgi(flask_app)
+        self.max_body = max_body or flask_app.config.get('MAX_CONTENT_LENGTH')
+        # 异步接口的数据库操作在有界的线程池中执行，每个线程使用自己的数据库连接，线程数即连接数上限
+        self.db_executor = ThreadPoolExecutor(max_workers=db_workers or ASGI_DB_WORKERS, thread_name_prefix='asgi-db')
+        self.routes = {
+            ('POST', '/ask'): self.ask,
+            ('GET', '/ask_stream'): self.ask_stream,
+            ('POST', '/ask_stream'): self.ask_stream,
+            ('POST', '/ask_with_image'): self.ask_with_image,
+            ('POST', '/analyze_code'): self.analyze_code
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        handler = self.routes.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+        if handler is None:
+            await self.wsgi(scope, receive, send)
+            return
+
+        body = await self._read_body(receive)
+        if body is None:
+            await self._send_json(send, {'error': '请求体过大'}, status=413)
+            return
+        request = Request(scope, body)
+        if not is_logged_in(request.session):
+            await self._send_json(send, {'error': LOGIN_REQUIRED_ERROR}, status=401)
+            return
+        await handler(request, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.db_executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive) -> Optional[bytes]:
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.max_body and size > self.max_body:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    @staticmethod
+    async def _send_json(send, payload: Dict, status: int = 200, headers: List = ()):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json; charset=utf-8'),
+                        (b'content-length', str(len(body)).encode())] + list(headers)
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _in_thread(self, func, *args):
+        """在默认线程池中执行阻塞调用（手册检索、工具、渲染）"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _in_db(self, func, *args):
+        """在数据库线程池中执行（get_db_connection按线程分配连接，不与WSGI请求共用）"""
+        return await asyncio.get_running_loop().run_in_executor(self.db_executor, func, *args)
+
+    async def _conversation_id(self, request: Request) -> Optional[int]:
+        """当前对话ID，会话中没有时新建对话并写回会话（与get_current_conversation_id一致）"""
+        conversation_id = request.session.get('conversation_id')
+        if conversation_id:
+            return conversation_id
+        conversation_id = await self._in_db(create_conversation, request.session['user_id'])
+        if conversation_id:
+            request.session['conversation_id'] = conversation_id
+            request.session_modified = True
+        return conversation_id
+
+    async def _save(self, conversation_id: Optional[int], role: str, message: str, message_type: str = "text"):
+        if conversation_id:
+            await self._in_db(save_message, conversation_id, role, message, message_type)
+
+    @staticmethod
+    def _agent():
+        return flask_module.python_agent
+
+    async def ask(self, request: Request, receive, send):
+        """异步版本的/ask"""
+        try:
+            data = request.get_json()
+            question = data.get('question', '').strip()
+            if not question:
+                await self._send_json(send, {'error': '问题不能为空'})
+                return
+
+            conversation_id = await self._conversation_id(request)
+            await self._save(conversation_id, 'user', question)
+            agent = self._agent()
+            if agent is None:
+                error_msg = "智能体未正确初始化，请刷新页面重试"
+                await self._save(conversation_id, 'assistant', error_msg)
+                await self._send_json(send, {'error': error_msg}, headers=request.session_headers())
+                return
+
+            answer = await agent.aask_question(question, use_cache=not cache_bypassed(data.get('no_cache')))
+            answer_html = await self._in_thread(render_answer_html, answer)
+            await self._save(conversation_id, 'assistant', answer_html, "html")
+            await self._send_json(send, {
+                'success': True,
+                'answer': answer_html,
+                'timestamp': datetime.now().strftime("%H:%M:%S")
+            }, headers=request.session_headers())
+
+        except Exception as e:
+            logger.error(f"异步提问失败: {e}")
+            await self._send_json(send, {'error': f'处理问题时出现错误: {str(e)}'})
+
+    async def ask_stream(self, request: Request, receive, send):
+        """异步版本的/ask_stream：文本增量到达即转发，等待期间发送心跳，客户端断开时取消生成"""
+        data = request.get_json() if request.method == 'POST' else request.args
+        question = data.get('question', '').strip()
+        use_cache = not cache_bypassed(data.get('no_cache'))
+
+        async def send_event(payload: Dict):
+            data = f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            await send({'type': 'http.response.body', 'body': data.encode('utf-8'), 'more_body': True})
+
+        agent = self._agent()
+        conversation_id = await self._conversation_id(request) if question and agent else None
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                        (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')] + request.session_headers()
+        })
+        if not question or agent is None:
+            await send_event({'error': '问题不能为空' if not question else "智能体未正确初始化，请刷新页面重试"})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await self._save(conversation_id, 'user', question)
+
+        events = asyncio.Queue()
+
+        async def produce():
+            try:
+                async for event in agent.astream_question(question, use_cache=use_cache):
+                    await events.put(event)
+            except Exception as e:
+                await events.put(('error', f"获取回答时出错: {str(e)}"))
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        producer = asyncio.ensure_future(produce())
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            while True:
+                getter = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait({getter, watcher}, timeout=ASK_STREAM_HEARTBEAT,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if watcher in done:
+                    # 客户端已断开，取消生成，不再保存回答
+                    getter.cancel()
+                    return
+                if getter not in done:
+                    getter.cancel()
+                    await send({'type': 'http.response.body', 'body': b': heartbeat\n\n', 'more_body': True})
+                    continue
+
+                kind, value = getter.result()
+                if kind == 'delta':
+                    await send_event({'delta': value, 'finished': False})
+                    continue
+                if kind == 'error':
+                    await self._save(conversation_id, 'assistant', value)
+                    await send_event({'error': value})
+                else:
+                    answer_html = await self._in_thread(render_answer_html, value)
+                    await self._save(conversation_id, 'assistant', answer_html, "html")
+                    await send_event({
+                        'finished': True,
+                        'full_answer': answer_html,
+                        'timestamp': datetime.now().strftime("%H:%M:%S")
+                    })
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+        except OSError:
+            # 写入时连接已关闭
+            return
+        finally:
+            producer.cancel()
+            watcher.cancel()
+
+    async def ask_with_image(self, request: Request, receive, send):
+        """异步版本的/ask_with_image"""
+        try:
+            data = request.get_json()
+            question = data.get('question', '').strip()
+            image_base64 = data.get('image', '').strip()
+            if not question and not image_base64:
+                await self._send_json(send, {'error': '问题和图片不能同时为空'})
+                return
+
+            agent = self._agent()
+            if agent is None:
+                await self._send_json(send, {'error': "智能体未正确初始化，请刷新页面重试"})
+                return
+
+            full_question = await self._in_thread(build_image_question, question, bool(image_base64))
+            answer = await agent.aask_question(full_question, use_cache=not cache_bypassed(data.get('no_cache')))
+            answer, images = await self._in_thread(attach_handbook_images, answer, question)
+            answer_html = await self._in_thread(render_answer_html, answer)
+
+            conversation_id = await self._conversation_id(request)
+            await self._save(conversation_id, 'user', question + (" (含图片)" if image_base64 else ""))
+            await self._save(conversation_id, 'assistant', answer_html, "html")
+            await self._send_json(send, {
+                'success': True,
+                'answer': answer_html,
+                'has_images': len(images) > 0,
+                'timestamp': datetime.now().strftime("%H:%M:%S")
+            }, headers=request.session_headers())
+
+        except Exception as e:
+            logger.error(f"带图片提问失败: {e}")
+            await self._send_json(send, {'error': f'处理失败: {str(e)}'})
+
+    async def analyze_code(self, request: Request, receive, send):
+        """异步版本的/analyze_code，分析在线程池中执行"""
+        try:
+            code = request.get_json().get('code', '').strip()
+            if not code:
+                await self._send_json(send, {'error': '代码不能为空'})
+                return
+
+            agent = self._agent()
+            if agent is None:
+                await self._send_json(send, {'error': '智能体未正确初始化'})
+                return
+            if not hasattr(agent, 'code_analyzer'):
+                await self._send_json(send, {'error': '代码分析功能不可用'})
+                return
+
+            result = await self._in_thread(agent.code_analyzer, code)
+            conversation_id = await self._conversation_id(request)
+            await self._save(conversation_id, 'system', f"代码分析结果:\n{result}")
+            await self._send_json(send, {'success': True, 'result': result},
+                                  headers=request.session_headers())
+
+        except Exception as e:
+            await self._send_json(send, {'error': f'代码分析时出现错误: {str(e)}'})
+
+
+application = AsyncAssistantApp()
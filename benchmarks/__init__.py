@@ -0,0 +1,9 @@
+# benchmarks/__init__.py
+"""手册检索性能基准。
+
+在项目根目录运行：
+    python -m benchmarks.corpus OUT_DIR --files 200        生成合成Markdown文档库
+    python -m benchmarks.run --files 200 --output a.json   生成文档库并运行基准，结果写为JSON
+    python -m benchmarks.run --corpus DIR --compare a.json 与之前的结果比较
+    python -m benchmarks.evaluate --output e.json         用标注查询集评估检索质量（recall@k、MRR）和延迟
+"""
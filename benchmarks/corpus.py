@@ -0,0 +1,144 @@
+# benchmarks/corpus.py
+import argparse
+import json
+import random
+import struct
+import zlib
+from pathlib import Path
+from typing import Dict
+
+# 生成正文用的词表：中文技术词、英文技术词和连接词
+CJK_TERMS = (
+    '函数', '闭包', '装饰器', '生成器', '迭代器', '协程', '线程', '进程', '异常', '模块',
+    '字典', '列表', '元组', '集合', '字符串', '正则表达式', '作用域', '继承', '多态', '对象',
+    '文件', '网络', '数据库', '算法', '排序', '变量', '上下文管理器', '元类', '描述符', '垃圾回收'
+)
+ENGLISH_TERMS = (
+    'function', 'closure', 'decorator', 'generator', 'iterator', 'coroutine', 'thread', 'process',
+    'exception', 'module', 'dict', 'list', 'tuple', 'set', 'string', 'regex', 'scope', 'class',
+    'object', 'file', 'socket', 'database', 'algorithm', 'sort', 'variable', 'async', 'await', 'lambda'
+)
+CJK_JOINERS = ('的', '和', '，', '。', '与')
+CODE_TEMPLATES = (
+    'def {a}(items):\n    return [x for x in items if x]\n',
+    'class {A}:\n    def __init__(self):\n        self.{a} = {{}}\n',
+    'with open("{a}.txt") as f:\n    data = f.read()\n',
+    'async def {a}():\n    await asyncio.sleep(1)\n'
+)
+
+
+def png_bytes(width: int, height: int, seed: int) -> bytes:
+    """生成指定尺寸的最小灰度PNG，像素值由seed决定，不同seed内容不同"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    row = b'\x00' + bytes((seed + x) % 256 for x in range(width))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * height))
+            + chunk(b'IEND', b''))
+
+
+class CorpusGenerator:
+    """可复现的合成Markdown文档库：相同参数和seed生成完全相同的文件"""
+
+    def __init__(self, files: int = 200, sections: int = 8, paragraphs: int = 4,
+                 words: int = 60, cjk_ratio: float = 0.7, images: int = 1,
+                 vocab: int = 5000, files_per_dir: int = 10, seed: int = 0):
+        self.files = files
+        self.sections = sections              # 每个文件的二级标题数
+        self.paragraphs = paragraphs          # 每个章节的段落数
+        self.words = words                    # 每段的词数
+        self.cjk_ratio = cjk_ratio            # 中文词占比
+        self.images = images                  # 每个文件引用的本地图片数
+        self.vocab = vocab                    # 长尾标识符的数量，使词典规模接近真实文档
+        self.files_per_dir = files_per_dir
+        self.seed = seed
+
+    def params(self) -> Dict:
+        return {
+            'files': self.files, 'sections': self.sections, 'paragraphs': self.paragraphs,
+            'words': self.words, 'cjk_ratio': self.cjk_ratio, 'images': self.images, 'vocab': self.vocab,
+            'files_per_dir': self.files_per_dir, 'seed': self.seed
+        }
+
+    def _term(self, rng: random.Random) -> str:
+        if rng.random() < 0.1:
+            # 长尾词按幂律分布：少数常见，多数只出现几次
+            return f"{rng.choice(ENGLISH_TERMS)}_{int(rng.paretovariate(1.0)) % self.vocab}"
+        return rng.choice(CJK_TERMS) if rng.random() < self.cjk_ratio else rng.choice(ENGLISH_TERMS)
+
+    def _paragraph(self, rng: random.Random) -> str:
+        parts = []
+        for _ in range(self.words):
+            term = self._term(rng)
+            if parts and '\u4e00' <= term[0] <= '\u9fff' and '\u4e00' <= parts[-1][-1] <= '\u9fff':
+                parts.append(rng.choice(CJK_JOINERS) + term)
+            else:
+                parts.append((' ' if parts else '') + term)
+        return ''.join(parts) + '。'
+
+    def _document(self, rng: random.Random, index: int, image_names) -> str:
+        lines = [f"# {self._term(rng)}{self._term(rng)} {index}", '']
+        for section in range(self.sections):
+            lines += [f"## {self._term(rng)}{section}", '']
+            for paragraph in range(self.paragraphs):
+                lines += [self._paragraph(rng), '']
+                if paragraph == 1 and rng.random() < 0.5:
+                    lines += [f"### {self._term(rng)}的{self._term(rng)}", '']
+            if rng.random() < 0.3:
+                template = rng.choice(CODE_TEMPLATES)
+                name = rng.choice(ENGLISH_TERMS)
+                lines += ['```python', template.format(a=name, A=name.title()), '```', '']
+        for image_name in image_names:
+            caption = f"{self._term(rng)}{self._term(rng)}示意图"
+            lines.insert(rng.randrange(2, len(lines)), f'![{caption}](../images/{image_name} "{caption}")\n')
+        if rng.random() < 0.2:
+            lines += [f'![{self._term(rng)}](https://example.com/{index}.png)', '']
+        return '\n'.join(lines)
+
+    def generate(self, out_dir) -> Dict:
+        """写出文档库，返回参数和规模统计"""
+        rng = random.Random(self.seed)
+        root = Path(out_dir)
+        image_dir = root / 'images'
+        image_dir.mkdir(parents=True, exist_ok=True)
+
+        # 图片池比引用数少，部分图片被多个文件引用
+        pool = max(1, self.files * self.images // 2)
+        image_names = [f"img{i}.png" for i in range(pool)]
+        total_bytes = 0
+        for i, name in enumerate(image_names):
+            data = png_bytes(rng.randint(16, 64), rng.randint(16, 64), i)
+            (image_dir / name).write_bytes(data)
+            total_bytes += len(data)
+
+        for index in range(self.files):
+            directory = root / f"Day{index // self.files_per_dir:02d}"
+            directory.mkdir(parents=True, exist_ok=True)
+            chosen = [rng.choice(image_names) for _ in range(self.images)]
+            text = self._document(rng, index, chosen)
+            (directory / f"{index % self.files_per_dir}.md").write_text(text, encoding='utf-8')
+            total_bytes += len(text.encode('utf-8'))
+
+        return dict(self.params(), path=str(root), images_written=len(image_names), bytes=total_bytes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成Markdown文档库')
+    parser.add_argument('out_dir')
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--sections', type=int, default=8)
+    parser.add_argument('--paragraphs', type=int, default=4)
+    parser.add_argument('--words', type=int, default=60)
+    parser.add_argument('--cjk-ratio', type=float, default=0.7)
+    parser.add_argument('--images', type=int, default=1)
+    parser.add_argument('--vocab', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    summary = CorpusGenerator(args.files, args.sections, args.paragraphs, args.words,
+                              args.cjk_ratio, args.images, args.vocab, seed=args.seed).generate(args.out_dir)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
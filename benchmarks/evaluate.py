@@ -0,0 +1,240 @@
+# benchmarks/evaluate.py
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.run import git_commit, summarize
+from config import HANDBOOK_CORPORA
+from handbook_corpora import HandbookCorpora
+
+GOLDEN_PATH = Path(__file__).resolve().parent / 'golden_queries.json'
+
+# enhanced_handbook_search 输出中文本结果和章节结果的来源行
+TEXT_LINE = re.compile(r'^\d+\. \*\*(.+?)\*\* - ', re.MULTILINE)
+SECTION_LINE = re.compile(r'^\d+\. \*\*.+?\*\* \(来自: (.+?)\)$', re.MULTILINE)
+
+
+def score_ranking(files: List[str], relevant: List[str], ks: List[int]) -> Dict:
+    """按文件排序计算第一个相关结果的名次、倒数名次和recall@k。
+    relevant为路径片段，结果文件路径包含片段即命中；recall按命中的片段数计算"""
+    first = next((rank for rank, file in enumerate(files, 1)
+                  if any(pattern in file for pattern in relevant)), None)
+    recall = {}
+    for k in ks:
+        found = {pattern for pattern in relevant for file in files[:k] if pattern in file}
+        recall[k] = len(found) / len(relevant)
+    return {'rank': first, 'reciprocal_rank': 1.0 / first if first else 0.0, 'recall': recall}
+
+
+def unique(files: List[str]) -> List[str]:
+    return list(dict.fromkeys(files))
+
+
+class Evaluator:
+    """在同一组分片上运行待评估的检索接口，记录排序结果和未命中缓存时的延迟"""
+
+    def __init__(self, corpora: HandbookCorpora, ks: List[int], repeat: int):
+        self.corpora = corpora
+        self.ks = ks
+        self.repeat = repeat
+        self.systems: Dict[str, Callable[[str], List[str]]] = {
+            'search_with_images': self._search_with_images
+        }
+        self.skipped: Dict[str, str] = {}
+        agent = self._load_agent()
+        if agent is not None:
+            self.systems['enhanced_handbook_search'] = lambda query: self._agent_search(agent, query)
+
+    def _load_agent(self):
+        """只评估智能体的手册检索工具，不初始化模型"""
+        try:
+            from python_agent import PythonProgrammingAgent
+        except Exception as e:
+            self.skipped['enhanced_handbook_search'] = f'无法导入python_agent: {e}'
+            return None
+        agent = PythonProgrammingAgent.__new__(PythonProgrammingAgent)
+        agent.handbook_corpora = self.corpora
+        return agent
+
+    def _search_with_images(self, query: str) -> List[str]:
+        results = self.corpora.search_with_images(query, max_results=max(self.ks))
+        return unique([hit['file'] for hit in results['text_results']] +
+                      [section['file'] for section in results['sections']])
+
+    def _agent_search(self, agent, query: str) -> List[str]:
+        """从工具输出的Markdown中按出现顺序取出结果文件"""
+        response = agent.enhanced_handbook_search(query)
+        labels = TEXT_LINE.findall(response) + SECTION_LINE.findall(response)
+        files = []
+        for label in labels:
+            corpus, _, file = label.partition(':')
+            files.append(file if file and corpus in self.corpora.paths else label)
+        return unique(files)
+
+    def _reset(self):
+        """清空合并结果和各分片的结果缓存，计时的是实际检索开销"""
+        self.corpora.query_cache.clear()
+        for _, shard in self.corpora.select():
+            shard.query_cache.clear()
+
+    def run_query(self, search: Callable[[str], List[str]], query: str) -> Tuple[List[str], List[float]]:
+        files, samples = [], []
+        for _ in range(self.repeat):
+            self._reset()
+            start = time.perf_counter()
+            files = search(query)
+            samples.append(time.perf_counter() - start)
+        return files, samples
+
+    def evaluate(self, golden: List[Dict]) -> Dict:
+        report = {}
+        for name, search in self.systems.items():
+            # 预热一轮，排除首次构建纠错词典等一次性开销
+            for item in golden:
+                search(item['query'])
+            rows, all_samples = [], []
+            for item in golden:
+                files, samples = self.run_query(search, item['query'])
+                all_samples.extend(samples)
+                rows.append(dict(score_ranking(files, item['relevant'], self.ks),
+                                 query=item['query'],
+                                 files=files[:max(self.ks)],
+                                 latency_ms=round(statistics.median(samples) * 1000, 4)))
+            report[name] = {
+                'mrr': round(sum(row['reciprocal_rank'] for row in rows) / len(rows), 4),
+                'recall': {k: round(sum(row['recall'][k] for row in rows) / len(rows), 4) for k in self.ks},
+                'latency': summarize(all_samples),
+                'queries': rows
+            }
+        for name, reason in self.skipped.items():
+            report[name] = {'skipped': reason}
+        return report
+
+
+def print_report(report: Dict, ks: List[int]):
+    header = ''.join(f"{'R@' + str(k):>7}" for k in ks)
+    for name, result in report.items():
+        print(f"\n== {name} ==")
+        if 'skipped' in result:
+            print(f"跳过（{result['skipped']}）")
+            continue
+        print(f"{'查询':<24}{'首个相关':>8}{header}{'延迟ms':>10}")
+        for row in result['queries']:
+            recall = ''.join(f"{row['recall'][k]:>7.2f}" for k in ks)
+            rank = row['rank'] if row['rank'] else '-'
+            print(f"{row['query']:<24}{rank:>8}{recall}{row['latency_ms']:>10.2f}")
+        recall = ''.join(f"{result['recall'][k]:>7.2f}" for k in ks)
+        print(f"{'平均 / MRR ' + str(result['mrr']):<32}{recall}"
+              f"{result['latency']['p50_ms']:>10.2f}  (p99 {result['latency']['p99_ms']}ms)")
+
+
+def compare(report: Dict, baseline: Dict, quality_tolerance: float, latency_threshold: float) -> List[str]:
+    """与基线比较：质量（MRR、recall@k）下降超过容差或p50延迟上升超过阈值都视为退化"""
+    regressions = []
+    for name, result in report.items():
+        old = baseline.get(name)
+        if 'skipped' in result or not old or 'skipped' in old:
+            continue
+        checks = [('mrr', old['mrr'], result['mrr'])]
+        checks += [(f'recall@{k}', old['recall'].get(str(k), old['recall'].get(k)), value)
+                   for k, value in result['recall'].items()]
+        for metric, before, after in checks:
+            if before is None:
+                continue
+            print(f"{name}.{metric}: {before} -> {after} ({after - before:+.4f})")
+            if after < before - quality_tolerance:
+                regressions.append(f"{name}.{metric}: {before} -> {after}")
+        before, after = old['latency']['p50_ms'], result['latency']['p50_ms']
+        change = after / before - 1 if before else 0.0
+        print(f"{name}.latency.p50_ms: {before} -> {after} ({change:+.1%})")
+        if change > latency_threshold:
+            regressions.append(f"{name}.latency.p50_ms: {before} -> {after} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='手册检索的相关性与延迟评估')
+    parser.add_argument('--golden', default=str(GOLDEN_PATH), help='标注查询集JSON')
+    parser.add_argument('--corpus', help='Markdown目录；不指定时使用查询集对应的已配置文档库')
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 3, 5])
+    parser.add_argument('--repeat', type=int, default=5, help='每个查询的计时次数（取中位数）')
+    parser.add_argument('--label', default=None)
+    parser.add_argument('--output', help='结果JSON路径')
+    parser.add_argument('--compare', help='基线结果JSON')
+    parser.add_argument('--quality-tolerance', type=float, default=0.0, help='允许的MRR/recall下降')
+    parser.add_argument('--threshold', type=float, default=0.2, help='允许的p50延迟相对上升')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    golden = json.loads(Path(args.golden).read_text(encoding='utf-8'))
+    ks = sorted(set(args.k))
+    output = Path(args.output).resolve() if args.output else None
+    baseline_path = Path(args.compare).resolve() if args.compare else None
+
+    workdir = Path(tempfile.mkdtemp(prefix='handbook-eval-'))
+    original_cwd = os.getcwd()
+    if args.corpus:
+        corpus_dir = Path(args.corpus).resolve()
+        name = 'eval'
+    else:
+        name = golden.get('corpus') or next(iter(HANDBOOK_CORPORA))
+        corpus_dir = Path(HANDBOOK_CORPORA[name]).resolve()
+    corpora = {name: corpus_dir}
+    # 快照和向量文件始终写在临时目录，评估不读写应用的索引快照（其中的图片路径指向应用目录）
+    snapshot_dir = workdir / 'snapshots'
+    snapshot_dir.mkdir()
+    # 手册把图片写入当前目录下的static/images/handbook，评估期间切换到临时目录
+    os.chdir(workdir)
+    try:
+        handbook_corpora = HandbookCorpora(corpora, name, snapshot_dir=snapshot_dir)
+        handbook = handbook_corpora.get()
+        if handbook is None or not handbook.md_files:
+            print(f"文档库 {corpus_dir} 没有可检索的文件")
+            sys.exit(2)
+        handbook.ensure_vectors(background=False)
+        evaluator = Evaluator(handbook_corpora, ks, args.repeat)
+        report = evaluator.evaluate(golden['queries'])
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report, ks)
+    result = {
+        'meta': {
+            'label': args.label,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'corpus': str(corpus_dir),
+            'golden': str(Path(args.golden).resolve()),
+            'tokenizer': handbook.tokenizer.signature,
+            'vectors_ready': handbook.semantic is not None,
+            'repeat': args.repeat
+        },
+        'systems': report
+    }
+    if output:
+        output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"\n结果已写入 {output}")
+
+    if baseline_path:
+        baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+        print()
+        regressions = compare(report, baseline['systems'], args.quality_tolerance, args.threshold)
+        if regressions and args.fail_on_regression:
+            print('退化:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
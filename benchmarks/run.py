@@ -0,0 +1,305 @@
+# benchmarks/run.py
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.corpus import CorpusGenerator
+from handbook_corpora import HandbookCorpora
+from handbook_vectors import NUMPY_AVAILABLE
+from markdown_handbook import MarkdownHandbook
+
+# resource只在类Unix系统上可用
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    resource = None
+    RESOURCE_AVAILABLE = False
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# 各项检索的查询集，覆盖单词、多词、中英文、短语、拼写错误和无结果的情况
+QUERIES = {
+    'search_with_images': ['装饰器', '函数 闭包', 'generator', '正则表达式的作用域',
+                           'async await', '上下文管理器 元类', 'decorator 生成器', '不存在的概念'],
+    'search_exact_content': ['装饰器', '的生成器', 'def ', 'self.', '正则表达式和', '不存在的短语'],
+    '_fuzzy_search': ['decoratr', 'genrator', 'fucntion', 'corutine', '装饰品'],
+    'search_markdown': ['装饰器', '函数 闭包', 'generator', '的迭代器', 'decoratr']
+}
+
+# 比较结果时检查的指标（越小越好）
+COMPARED_METRICS = (
+    ('load', 'cold_seconds'),
+    ('load', 'warm_seconds'),
+    ('load', 'vector_seconds'),
+    ('memory', 'peak_traced_bytes'),
+)
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """最近秩百分位数"""
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(samples: List[float]) -> Dict:
+    """耗时样本（秒）的统计，单位毫秒"""
+    to_ms = lambda seconds: round(seconds * 1000, 4)
+    return {
+        'n': len(samples),
+        'mean_ms': to_ms(sum(samples) / len(samples)),
+        'p50_ms': to_ms(percentile(samples, 50)),
+        'p99_ms': to_ms(percentile(samples, 99)),
+        'min_ms': to_ms(min(samples)),
+        'max_ms': to_ms(max(samples))
+    }
+
+
+def time_queries(call: Callable[[str], object], queries: List[str], repeat: int, warmup: int,
+                 reset: Optional[Callable[[], None]] = None) -> Dict:
+    """对每个查询重复计时；先把全部查询预热warmup轮。reset在每次调用前执行（不计时），用于清空结果缓存"""
+    for _ in range(warmup):
+        for query in queries:
+            call(query)
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            if reset:
+                reset()
+            start = time.perf_counter()
+            call(query)
+            samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def remove_snapshot(snapshot_path: Path):
+    for suffix in ('.pkl', '.npy', '.npz', '.json'):
+        snapshot_path.with_suffix(suffix).unlink(missing_ok=True)
+
+
+def bench_load(corpus_dir: Path, snapshot_path: Path, workers: Optional[int]) -> Dict:
+    """冷启动（无快照）、热启动（复用快照）的索引耗时，以及向量索引构建耗时"""
+    remove_snapshot(snapshot_path)
+    handbook = MarkdownHandbook(str(corpus_dir), str(snapshot_path), workers=workers)
+    vector_start = time.perf_counter()
+    handbook.ensure_vectors(background=False)
+    vector_seconds = time.perf_counter() - vector_start
+    cold = handbook
+
+    warm = MarkdownHandbook(str(corpus_dir), str(snapshot_path), workers=workers)
+    warm.ensure_vectors(background=False)
+    return {
+        'cold_seconds': round(cold.load_seconds, 4),
+        'warm_seconds': round(warm.load_seconds, 4),
+        'vector_seconds': round(vector_seconds, 4),
+        'stage_seconds': cold.stage_seconds,
+        'workers': cold.workers or os.cpu_count() or 1,
+        'files': len(cold.md_files),
+        'sections': len(cold.sections),
+        'terms': len(cold.inverted_index),
+        'images': len(cold.images_cache),
+        'vectors_ready': cold.semantic is not None
+    }
+
+
+def bench_memory(corpus_dir: Path) -> Dict:
+    """单进程建立索引（含向量）时Python分配的峰值内存，以及索引常驻内存估算"""
+    tracemalloc.start()
+    try:
+        handbook = MarkdownHandbook(str(corpus_dir), workers=1)
+        handbook.ensure_vectors(background=False)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    memory = {
+        'peak_traced_bytes': peak,
+        'index_estimate_bytes': handbook.memory_bytes
+    }
+    if RESOURCE_AVAILABLE:
+        # Linux上ru_maxrss单位为KB，macOS上为字节
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory['max_rss_bytes'] = max_rss if sys.platform == 'darwin' else max_rss * 1024
+    return memory
+
+
+def bench_search_markdown(corpora: HandbookCorpora, queries: List[str], repeat: int, warmup: int) -> Dict:
+    """通过Flask测试客户端请求 /search_markdown（包括路由、分页、上下文截取和JSON序列化）"""
+    try:
+        import app as webapp
+    except Exception as e:
+        return {'skipped': f'无法导入app: {e}'}
+
+    webapp.handbook_corpora = corpora
+    webapp.enhanced_handbook = corpora.get()
+    webapp.app.secret_key = webapp.app.secret_key or 'benchmark'
+    client = webapp.app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['user_id'] = 'benchmark'
+
+    def call(query: str):
+        response = client.post('/search_markdown', json={'query': query})
+        payload = response.get_json()
+        if response.status_code != 200 or 'error' in payload:
+            raise RuntimeError(f"/search_markdown 请求失败: {payload}")
+
+    def reset():
+        corpora.query_cache.clear()
+        for _, shard in corpora.select():
+            shard.query_cache.clear()
+
+    return time_queries(call, queries, repeat, warmup, reset)
+
+
+def bench_latency(corpora: HandbookCorpora, repeat: int, warmup: int) -> Dict:
+    """各检索接口的延迟；每次调用前清空结果缓存，测量的是实际检索开销"""
+    handbook = corpora.get()
+    reset = handbook.query_cache.clear
+    return {
+        'search_with_images': time_queries(
+            handbook.search_with_images, QUERIES['search_with_images'], repeat, warmup, reset),
+        'search_with_images_cached': time_queries(
+            handbook.search_with_images, QUERIES['search_with_images'], repeat, warmup),
+        'search_exact_content': time_queries(
+            handbook.search_exact_content, QUERIES['search_exact_content'], repeat, warmup, reset),
+        '_fuzzy_search': time_queries(
+            lambda query: handbook._fuzzy_search(query, 5), QUERIES['_fuzzy_search'], repeat, warmup),
+        'search_markdown': bench_search_markdown(corpora, QUERIES['search_markdown'], repeat, warmup)
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """与基线结果比较，返回超过阈值的退化项并打印对比表"""
+    rows = [(section, metric) for section, metric in COMPARED_METRICS]
+    for operation, stats in current['latency'].items():
+        if 'p50_ms' in stats:
+            rows += [('latency', f'{operation}.p50_ms'), ('latency', f'{operation}.p99_ms')]
+
+    def lookup(result: Dict, section: str, metric: str):
+        value = result.get(section, {})
+        for part in metric.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    regressions = []
+    print(f"{'指标':<48}{'基线':>14}{'当前':>14}{'变化':>10}")
+    for section, metric in rows:
+        old, new = lookup(baseline, section, metric), lookup(current, section, metric)
+        if not old or new is None:
+            continue
+        change = new / old - 1
+        flag = ''
+        if change > threshold:
+            flag = '  退化'
+            regressions.append(f"{section}.{metric}: {old} -> {new} ({change:+.1%})")
+        print(f"{section + '.' + metric:<48}{old:>14}{new:>14}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='手册索引与检索性能基准')
+    parser.add_argument('--corpus', help='已有的Markdown目录；不指定时生成合成文档库')
+    parser.add_argument('--files', type=int, default=200, help='合成文档库的文件数')
+    parser.add_argument('--sections', type=int, default=8)
+    parser.add_argument('--cjk-ratio', type=float, default=0.7)
+    parser.add_argument('--images', type=int, default=1)
+    parser.add_argument('--vocab', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='索引进程数，默认使用配置')
+    parser.add_argument('--repeat', type=int, default=20, help='每个查询的计时次数')
+    parser.add_argument('--warmup', type=int, default=1, help='计时前预热的轮数')
+    parser.add_argument('--label', default=None, help='结果标签，如版本号')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='基线结果JSON，打印对比')
+    parser.add_argument('--threshold', type=float, default=0.1, help='判定退化的相对变化')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--workdir', help='工作目录（快照和图片），默认临时目录并在结束后删除')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    output = Path(args.output).resolve()
+    baseline_path = Path(args.compare).resolve() if args.compare else None
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='handbook-bench-')).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    original_cwd = os.getcwd()
+    # 手册把图片写入当前目录下的static/images/handbook，基准期间切换到工作目录
+    os.chdir(workdir)
+    try:
+        if args.corpus:
+            corpus_dir = Path(original_cwd, args.corpus).resolve()
+            corpus = {'path': str(corpus_dir)}
+        else:
+            corpus_dir = workdir / 'corpus'
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+            corpus = CorpusGenerator(files=args.files, sections=args.sections, cjk_ratio=args.cjk_ratio,
+                                     images=args.images, vocab=args.vocab, seed=args.seed).generate(corpus_dir)
+
+        print(f"文档库: {corpus_dir}")
+        load = bench_load(corpus_dir, workdir / 'snapshots' / 'bench.pkl', args.workers)
+        print(f"索引: 冷启动 {load['cold_seconds']}s，热启动 {load['warm_seconds']}s，向量 {load['vector_seconds']}s")
+        memory = bench_memory(corpus_dir)
+        print(f"内存: 峰值 {memory['peak_traced_bytes'] / 1024 / 1024:.1f}MB")
+
+        corpora = HandbookCorpora({'bench': corpus_dir}, 'bench', snapshot_dir=workdir / 'snapshots')
+        corpora.get().ensure_vectors(background=False)
+        latency = bench_latency(corpora, args.repeat, args.warmup)
+        for operation, stats in latency.items():
+            if 'p50_ms' in stats:
+                print(f"{operation}: p50 {stats['p50_ms']}ms，p99 {stats['p99_ms']}ms")
+            else:
+                print(f"{operation}: 跳过（{stats['skipped']}）")
+    finally:
+        os.chdir(original_cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        'meta': {
+            'label': args.label,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': NUMPY_AVAILABLE,
+            'tokenizer': corpora.get().tokenizer.signature,
+            'repeat': args.repeat,
+            'warmup': args.warmup
+        },
+        'corpus': corpus,
+        'load': load,
+        'memory': memory,
+        'latency': latency
+    }
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(f"结果已写入 {output}")
+
+    if baseline_path:
+        baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+        regressions = compare(result, baseline, args.threshold)
+        if regressions and args.fail_on_regression:
+            print('性能退化:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
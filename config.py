@@ -11,5 +11,51 @@ MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
 # PDF配置
 PDF_HANDBOOK_PATH = BASE_DIR / 'static' / 'Python背记手册.pdf'
 
+# Markdown手册配置
+HANDBOOK_PATH = BASE_DIR / 'static' / 'Python-100-Days-master'
+# 手册索引快照（按文件mtime和大小增量复用）
+HANDBOOK_SNAPSHOT_PATH = BASE_DIR / '.cache' / 'handbook_index.pkl'
+# 命名文档库（名称 -> 目录）。每个文档库是独立的索引分片，有各自的快照和向量文件，
+# 可单独加载、刷新和检索；检索默认并发查询全部文档库并合并结果
+HANDBOOK_CORPORA = {
+    'python100': HANDBOOK_PATH,
+}
+HANDBOOK_DEFAULT_CORPUS = 'python100'  # 默认文档库，使用上面的快照路径
+# 建立手册索引时的并行进程数（0表示按CPU核数，1表示不并行）
+HANDBOOK_INDEX_WORKERS = 0
+# 手册分词器（dictionary：词典分词，bigram：双字切分）及本地词典
+HANDBOOK_TOKENIZER = 'dictionary'
+HANDBOOK_DICT_PATH = BASE_DIR / 'handbook_dict.txt'
+# 按需生成的手册图片base64缓存上限（字节）
+HANDBOOK_IMAGE_CACHE_BYTES = 8 * 1024 * 1024
+# 手册检索结果缓存的条目数上限（0表示不缓存）
+HANDBOOK_QUERY_CACHE_SIZE = 512
+# 章节向量检索（TF-IDF + 截断SVD，需要NumPy），与BM25排序融合；向量文件保存在索引快照旁
+HANDBOOK_VECTORS = True
+HANDBOOK_VECTOR_DIM = 128      # 降维后的维数
+HANDBOOK_VECTOR_VOCAB = 30000  # 参与计算的词数上限（按文档频率）
+# 监视手册目录，文件变化时增量更新索引（优先inotify，否则按间隔轮询mtime）
+HANDBOOK_WATCH = True
+HANDBOOK_WATCH_INTERVAL = 2.0  # 秒
+HANDBOOK_SNAPSHOT_DELAY = 5.0  # 增量更新后延迟写快照的秒数，期间的多次变化合并为一次写入
+
+# LLM回答的磁盘缓存：重复的问题直接返回缓存的回答，不再调用模型
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_PATH = BASE_DIR / '.cache' / 'answer_cache.sqlite3'
+ANSWER_CACHE_TTL = 7 * 24 * 3600              # 秒
+ANSWER_CACHE_MAX_BYTES = 64 * 1024 * 1024     # 回答总大小上限，超出时淘汰最久未使用的回答
+ANSWER_CACHE_NEAR_DUPLICATE = False           # 没有完全相同的问题时匹配相似问题（只用于不含代码的问题）
+ANSWER_CACHE_SIMILARITY = 0.9                 # 相似问题的字符二元组Jaccard相似度阈值，且检索词必须相同
+
+# 提示词的输入token预算：手册上下文去掉图片数据后按预算裁剪
+PROMPT_TOKEN_BUDGET = 6000
+PROMPT_TOKEN_ENCODING = 'cl100k_base'         # 安装tiktoken时使用的编码，未安装时按字符估算
+# tiktoken词表的本地缓存目录，运行时不联网下载；目录中没有词表时按字符估算。
+# 预先缓存：TIKTOKEN_CACHE_DIR=.cache/tiktoken python -c "import tiktoken; tiktoken.get_encoding('cl100k_base')"
+PROMPT_TOKEN_CACHE_DIR = BASE_DIR / '.cache' / 'tiktoken'
+
+# ASGI入口（asgi.py）中执行数据库操作的线程数，每个线程持有自己的数据库连接
+ASGI_DB_WORKERS = 4
+
 # 确保目录存在
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
@@ -0,0 +1,85 @@
+# handbook_cache.py
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+def normalize_query(query: str) -> str:
+    """查询归一化：小写并合并空白，使大小写和空格不同的相同查询共用缓存"""
+    return ' '.join(query.lower().split())
+
+
+class QueryCache:
+    """手册检索结果缓存。
+
+    键包含索引版本，索引重新发布后旧结果自动失效；容量满时按访问频率决定是否
+    接纳新结果：只有比最久未用的条目更常被查询的新结果才会替换它，
+    避免一次性查询把高频查询挤出缓存。缓存的结果由多个请求共享，调用方不应修改。
+    """
+
+    def __init__(self, capacity: int = 512):
+        self.capacity = capacity
+        self._entries = OrderedDict()  # 键 -> 结果，按最近使用排序
+        self._freq = {}                # 键（不含版本）-> 近期查询次数
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    def get_or_compute(self, version: int, key: Tuple[Hashable, ...], compute: Callable[[], Any]) -> Any:
+        """命中则返回缓存结果，否则计算并视访问频率决定是否缓存"""
+        with self._lock:
+            if version != self._version:
+                # 索引已更新，旧版本的结果全部作废
+                self._entries.clear()
+                self._version = version
+            self._touch(key)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        # 计算时不持有锁，并发的不同查询互不阻塞
+        result = compute()
+
+        with self._lock:
+            if version != self._version or self.capacity <= 0:
+                return result
+            if key not in self._entries and len(self._entries) >= self.capacity:
+                victim = next(iter(self._entries))
+                if self._freq.get(key, 0) <= self._freq.get(victim, 0):
+                    self.rejections += 1
+                    return result
+                del self._entries[victim]
+                self.evictions += 1
+            self._entries[key] = result
+        return result
+
+    def _touch(self, key):
+        """记录一次查询；计数总量过大时整体减半，让频率反映近期热度"""
+        self._freq[key] = self._freq.get(key, 0) + 1
+        if len(self._freq) > self.capacity * 10:
+            self._freq = {k: count // 2 for k, count in self._freq.items() if count > 1}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._freq.clear()
+
+    def stats(self) -> Dict:
+        """命中率等统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'rejections': self.rejections,
+                'version': self._version
+            }
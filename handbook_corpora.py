@@ -0,0 +1,258 @@
+# handbook_corpora.py
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import HANDBOOK_CORPORA, HANDBOOK_DEFAULT_CORPUS, HANDBOOK_QUERY_CACHE_SIZE, HANDBOOK_SNAPSHOT_PATH
+from handbook_cache import QueryCache, normalize_query
+from markdown_handbook import MarkdownHandbook
+
+logger = logging.getLogger(__name__)
+
+# 流式扫描时各分片线程的结束标记
+_SCAN_DONE = object()
+
+
+def corpus_snapshot_path(name: str) -> Path:
+    """文档库的索引快照路径；默认文档库沿用原有快照，向量文件保存在快照旁"""
+    if name == HANDBOOK_DEFAULT_CORPUS:
+        return HANDBOOK_SNAPSHOT_PATH
+    return HANDBOOK_SNAPSHOT_PATH.with_name(f"{HANDBOOK_SNAPSHOT_PATH.stem}_{name}{HANDBOOK_SNAPSHOT_PATH.suffix}")
+
+
+def merge_ranked(rankings: List[Tuple[str, List[Dict]]], limit: Optional[int] = None) -> List[Dict]:
+    """合并各分片的有序结果并标注所属文档库。
+    各分片的得分依赖各自语料的IDF，不能直接比较，因此按分片内名次交错合并，同名次按得分"""
+    merged = []
+    for name, hits in rankings:
+        for rank, hit in enumerate(hits):
+            merged.append((rank, -hit.get('score', 0.0), dict(hit, corpus=name)))
+    merged.sort(key=lambda item: (item[0], item[1]))
+    hits = [hit for _, _, hit in merged]
+    return hits[:limit] if limit is not None else hits
+
+
+class HandbookCorpora:
+    """多个命名文档库。每个文档库是一个独立的MarkdownHandbook分片，可单独加载、刷新和检索；
+    检索时并发查询选中的分片，合并后的结果带有corpus字段，用于找回对应的分片"""
+
+    def __init__(self, corpora: Dict[str, Path], default: str, load: bool = True,
+                 snapshot_dir: Optional[Path] = None):
+        if default not in corpora:
+            raise ValueError(f"默认文档库 {default} 未配置")
+        self.paths = {name: Path(path) for name, path in corpora.items()}
+        self.default = default
+        self.snapshot_dir = Path(snapshot_dir) if snapshot_dir else None  # 指定时快照统一放在该目录
+        self._shards: Dict[str, MarkdownHandbook] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(2, len(self.paths) * 2),
+                                            thread_name_prefix='handbook-corpus')
+        self.query_cache = QueryCache(HANDBOOK_QUERY_CACHE_SIZE)  # 合并后结果的缓存
+        if load:
+            self.load()
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.paths)
+
+    def snapshot_path(self, name: str) -> Path:
+        if self.snapshot_dir:
+            return self.snapshot_dir / f"{name}.pkl"
+        return corpus_snapshot_path(name)
+
+    def _build_shard(self, name: str) -> Optional[MarkdownHandbook]:
+        try:
+            return MarkdownHandbook(str(self.paths[name]), str(self.snapshot_path(name)))
+        except Exception as e:
+            logger.error(f"文档库 {name} 加载失败: {e}")
+            return None
+
+    def load(self, names: Optional[List[str]] = None) -> Dict[str, MarkdownHandbook]:
+        """并发加载（或重新加载）指定文档库，默认全部；未变化的文件从各自快照复用。
+        返回本次加载成功的分片"""
+        names = list(names) if names is not None else self.names
+        for name in names:
+            if name not in self.paths:
+                raise ValueError(f"未知的文档库: {name}")
+        shards = dict(zip(names, self._executor.map(self._build_shard, names)))
+        loaded = {name: shard for name, shard in shards.items() if shard is not None}
+        with self._lock:
+            # 新分片建好后整体替换，加载期间检索继续使用旧分片
+            self._shards = dict(self._shards, **loaded)
+        return loaded
+
+    def reload(self, name: Optional[str] = None) -> Dict[str, MarkdownHandbook]:
+        """重新加载单个文档库，name为空时重新加载全部"""
+        return self.load([name] if name else None)
+
+    def get(self, name: Optional[str] = None) -> Optional[MarkdownHandbook]:
+        """按名称取分片，name为空时取默认文档库；未知名称抛出ValueError"""
+        name = name or self.default
+        if name not in self.paths:
+            raise ValueError(f"未知的文档库: {name}")
+        return self._shards.get(name)
+
+    def shard(self, hit: Dict) -> Optional[MarkdownHandbook]:
+        """检索结果所属的分片"""
+        return self._shards.get(hit.get('corpus') or self.default)
+
+    def select(self, corpus: Optional[str] = None) -> List[Tuple[str, MarkdownHandbook]]:
+        """检索要查询的分片：指定文档库时只查询它，否则查询全部已加载的分片"""
+        if corpus:
+            shard = self.get(corpus)
+            return [(corpus, shard)] if shard is not None else []
+        shards = self._shards
+        return [(name, shards[name]) for name in self.paths if name in shards]
+
+    def label(self, hit: Dict) -> str:
+        """结果的文件标签，多个文档库时带上文档库名称"""
+        if len(self.paths) > 1:
+            return f"{hit.get('corpus') or self.default}:{hit.get('file', '')}"
+        return hit.get('file', '')
+
+    def semantic_ready(self, corpus: Optional[str] = None) -> bool:
+        """选中的分片的向量索引是否都已就绪"""
+        shards = self.select(corpus)
+        return bool(shards) and all(shard.semantic is not None for _, shard in shards)
+
+    def _fan_out(self, shards: List[Tuple[str, MarkdownHandbook]],
+                 search: Callable[[MarkdownHandbook], Dict]) -> List[Tuple[str, Dict]]:
+        """在每个分片上执行检索；多个分片时并发执行，单个分片失败不影响其余分片"""
+        if len(shards) == 1:
+            name, shard = shards[0]
+            return [(name, search(shard))]
+        futures = [(name, self._executor.submit(search, shard)) for name, shard in shards]
+        results = []
+        for name, future in futures:
+            try:
+                results.append((name, future.result()))
+            except Exception as e:
+                logger.error(f"文档库 {name} 检索失败: {e}")
+        return results
+
+    def _cache_version(self) -> Tuple:
+        """合并结果的缓存版本：全部分片的索引和向量版本，任一分片变化都会使缓存失效。
+        不随查询范围变化，查询不同文档库时不会互相清空缓存"""
+        return tuple((name, shard._cache_version(shard._state)) for name, shard in self.select())
+
+    def cached_search(self, name: str, query: str, compute, *params, corpus: Optional[str] = None):
+        """通过合并结果缓存执行查询，键为查询类型、归一化查询、参数和文档库"""
+        return self.query_cache.get_or_compute(
+            self._cache_version(), (name, normalize_query(query), corpus) + params, compute)
+
+    def search_with_images(self, query: str, max_results: int = 5, corpus: Optional[str] = None) -> Dict:
+        """在选中的文档库中搜索内容和图片，合并各分片结果（经缓存共享，调用方不应修改）"""
+        shards = self.select(corpus)
+        return self.query_cache.get_or_compute(
+            self._cache_version(), ('search_with_images', normalize_query(query), max_results, corpus),
+            lambda: self._search_with_images(query, max_results, shards))
+
+    def _search_with_images(self, query: str, max_results: int,
+                            shards: List[Tuple[str, MarkdownHandbook]]) -> Dict:
+        found = self._fan_out(shards, lambda shard: shard.search_with_images(query, max_results))
+        results = {
+            'text_results': merge_ranked([(name, result['text_results']) for name, result in found], max_results),
+            'image_results': [dict(image, corpus=name) for name, result in found for image in result['image_results']],
+            'sections': merge_ranked([(name, result['sections']) for name, result in found], max_results)
+        }
+        for name, result in found:
+            if result.get('did_you_mean'):
+                results['did_you_mean'] = result['did_you_mean']
+                results['suggestions'] = result.get('suggestions', {})
+                break
+        return results
+
+    def markdown_hits(self, query: str, corpus: Optional[str] = None) -> Dict:
+        """选中文档库的全部文档搜索命中，各分片命中按名次交错合并（经缓存共享，调用方不应修改）"""
+        shards = self.select(corpus)
+        return self.query_cache.get_or_compute(
+            self._cache_version(), ('markdown_hits', query.lower(), corpus),
+            lambda: self._markdown_hits(query, shards))
+
+    def _markdown_hits(self, query: str, shards: List[Tuple[str, MarkdownHandbook]]) -> Dict:
+        found = self._fan_out(shards, lambda shard: shard.markdown_hits(query))
+        # 有分片找到原词时不采用其他分片的纠错结果，与单个分片的行为一致
+        exact = [(name, result) for name, result in found if result['hits'] and not result['did_you_mean']]
+        if exact:
+            found = exact
+        did_you_mean = next((result['did_you_mean'] for _, result in found if result['did_you_mean']), None)
+        terms = []
+        for _, result in found:
+            terms.extend(term for term in result['terms'] if term not in terms)
+        return {
+            'hits': merge_ranked([(name, result['hits']) for name, result in found]),
+            'did_you_mean': did_you_mean,
+            'terms': terms
+        }
+
+    def iter_phrase_hits(self, query: str, max_per_file: int = 3,
+                         corpus: Optional[str] = None) -> Iterator[Dict]:
+        """流式子串命中：各分片并发扫描，命中按到达顺序产出；调用方停止迭代后各分片随之停止扫描"""
+        shards = self.select(corpus)
+        hits = queue.Queue()
+        stop = threading.Event()
+
+        def scan(name: str, shard: MarkdownHandbook):
+            try:
+                state = shard._state
+                for file_key, positions in shard.iter_phrase(query, max_per_file, state):
+                    if stop.is_set():
+                        break
+                    for position in positions:
+                        hits.put(dict(shard.phrase_hit(file_key, position, query, state), corpus=name))
+            except Exception as e:
+                logger.error(f"文档库 {name} 流式检索失败: {e}")
+            finally:
+                hits.put(_SCAN_DONE)
+
+        for name, shard in shards:
+            self._executor.submit(scan, name, shard)
+        try:
+            remaining = len(shards)
+            while remaining:
+                hit = hits.get()
+                if hit is _SCAN_DONE:
+                    remaining -= 1
+                else:
+                    yield hit
+        finally:
+            stop.set()
+
+    def get_stats(self) -> Dict:
+        """各文档库的路径、加载状态和索引统计"""
+        shards = self._shards
+        return {
+            'default': self.default,
+            'corpora': {
+                name: {
+                    'path': str(path),
+                    'loaded': name in shards,
+                    'stats': shards[name].get_stats() if name in shards else None
+                } for name, path in self.paths.items()
+            },
+            'query_cache': self.query_cache.stats()
+        }
+
+
+# 进程内共享的文档库集合，Flask路由和智能体共用同一组索引分片
+_shared_corpora: Optional[HandbookCorpora] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_corpora(reload: bool = False, corpus: Optional[str] = None) -> HandbookCorpora:
+    """获取共享的文档库集合，首次调用时建立全部索引；reload时重新加载指定文档库（默认全部）"""
+    global _shared_corpora
+    with _shared_lock:
+        if _shared_corpora is None:
+            _shared_corpora = HandbookCorpora(HANDBOOK_CORPORA, HANDBOOK_DEFAULT_CORPUS)
+        elif reload:
+            _shared_corpora.reload(corpus)
+        return _shared_corpora
+
+
+def get_shared_handbook(reload: bool = False) -> Optional[MarkdownHandbook]:
+    """默认文档库的共享手册实例（保持原有接口）"""
+    return get_shared_corpora(reload=reload, corpus=HANDBOOK_DEFAULT_CORPUS if reload else None).get()
@@ -0,0 +1,96 @@
+# handbook_fuzzy.py
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from handbook_tokenizer import is_cjk
+
+# 每个词最多核对编辑距离的候选数，保证纠错耗时有上限
+MAX_CANDIDATES = 200
+
+
+def term_grams(term: str) -> Set[str]:
+    """带边界标记的三元组，短词也至少有一个三元组"""
+    padded = f"$${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_edit_distance(term: str) -> int:
+    """允许的最大编辑距离：词越长容错越多，过短的词不纠错"""
+    if is_cjk(term):
+        return 1 if len(term) >= 3 else 0
+    if len(term) <= 3:
+        return 0
+    return 1 if len(term) <= 5 else 2
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> Optional[int]:
+    """编辑距离，超过limit时提前放弃并返回None"""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+class FuzzyTermIndex:
+    """词典上的三元组索引：用三元组重合数筛选候选词，再核对编辑距离"""
+
+    def __init__(self, terms: Iterable[Tuple[str, int]]):
+        self.doc_freq = {}  # 词 -> 出现的章节数，用于在距离相同时挑选常见词
+        self.grams = {}     # 三元组 -> 词列表
+        for term, doc_freq in terms:
+            self.doc_freq[term] = doc_freq
+            for gram in term_grams(term):
+                self.grams.setdefault(gram, []).append(term)
+
+    def lookup(self, term: str, limit: int = 3) -> List[Tuple[str, int]]:
+        """返回最接近的词及编辑距离，按(距离, 词频降序)排序"""
+        max_distance = max_edit_distance(term)
+        if max_distance == 0:
+            return []
+
+        query_grams = term_grams(term)
+        overlap = {}
+        for gram in query_grams:
+            for candidate in self.grams.get(gram, ()):
+                overlap[candidate] = overlap.get(candidate, 0) + 1
+
+        # q-gram下界：每次编辑最多破坏3个三元组
+        matches = []
+        candidates = sorted(overlap.items(), key=lambda item: item[1], reverse=True)
+        for candidate, common in candidates[:MAX_CANDIDATES]:
+            if candidate == term:
+                continue
+            if common < max(len(query_grams), len(term_grams(candidate))) - 3 * max_distance:
+                continue
+            distance = bounded_levenshtein(term, candidate, max_distance)
+            if distance is not None:
+                matches.append((candidate, distance))
+
+        matches.sort(key=lambda item: (item[1], -self.doc_freq[item[0]]))
+        return matches[:limit]
+
+    def suggest(self, terms: List[str]) -> Tuple[Optional[List[str]], Dict[str, List[str]]]:
+        """把不在词典中的词替换为最接近的词，返回(纠正后的词列表, 每个词的候选)；
+        没有任何词被纠正时第一项为None"""
+        corrected = []
+        suggestions = {}
+        changed = False
+        for term in terms:
+            if term in self.doc_freq:
+                corrected.append(term)
+                continue
+            matches = self.lookup(term)
+            if matches:
+                suggestions[term] = [candidate for candidate, distance in matches]
+                corrected.append(matches[0][0])
+                changed = True
+            else:
+                corrected.append(term)
+        return (corrected if changed else None), suggestions
@@ -0,0 +1,94 @@
+# handbook_matcher.py
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+# pyahocorasick为可选依赖（C实现），不可用时使用纯Python自动机
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    ahocorasick = None
+    AHOCORASICK_AVAILABLE = False
+
+
+class KeywordMatcher:
+    """多模式匹配（Aho-Corasick自动机）：一次扫描文本找出全部关键词，不区分大小写。
+
+    构建一次后可反复使用，适合固定词表对大量文本或每个问题的匹配。
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = list(dict.fromkeys(keywords))
+        patterns = {keyword.lower(): keyword for keyword in self.keywords if keyword}
+
+        if AHOCORASICK_AVAILABLE:
+            self._automaton = ahocorasick.Automaton()
+            for pattern, keyword in patterns.items():
+                self._automaton.add_word(pattern, (len(pattern), keyword))
+            self._automaton.make_automaton()
+            return
+        self._automaton = None
+
+        # 状态0为根；goto[state]: 字符 -> 下一状态，output[state]: 在此结束的(模式长度, 关键词)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, str]]] = [[]]
+        for pattern, keyword in patterns.items():
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append((len(pattern), keyword))
+
+        # 按层次遍历建立失败链接，并把失败状态的输出合并进来
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """按出现顺序产出(起始位置, 关键词)，包括互相重叠的匹配"""
+        text = text.lower()
+        if self._automaton is not None:
+            for end, (length, keyword) in self._automaton.iter(text):
+                yield end - length + 1, keyword
+            return
+
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, keyword in output[state]:
+                yield index - length + 1, keyword
+
+    def first_positions(self, text: str) -> Dict[str, int]:
+        """每个出现过的关键词第一次出现的位置"""
+        positions = {}
+        for position, keyword in self.iter_matches(text):
+            if keyword not in positions or position < positions[keyword]:
+                positions[keyword] = position
+            if len(positions) == len(self.keywords):
+                break
+        return positions
+
+    def find_all(self, text: str) -> Set[str]:
+        """文本中出现过的全部关键词"""
+        return set(self.first_positions(text))
+
+    def contains_any(self, text: str) -> bool:
+        """文本中是否出现任一关键词，找到第一个即停止"""
+        return next(self.iter_matches(text), None) is not None
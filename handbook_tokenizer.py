@@ -0,0 +1,216 @@
+# handbook_tokenizer.py
+import re
+import math
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from config import HANDBOOK_DICT_PATH, HANDBOOK_TOKENIZER
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fff]+|[a-zA-Z0-9_]+')
+
+# 停用词：不进入索引，也不作为查询词
+STOP_WORDS = {
+    '的', '了', '和', '是', '在', '有', '就', '都', '而', '及', '与', '或', '等', '也', '这', '那',
+    '吗', '呢', '吧', '啊', '么', '个', '中', '对', '把', '被', '让', '给',
+    '什么', '怎么', '如何', '怎样', '为什么', '哪些', '一个', '一种', '这个', '那个', '可以',
+    'the', 'a', 'an', 'of', 'to', 'in', 'and', 'or', 'is', 'are', 'for', 'on', 'with'
+}
+
+
+def is_cjk(word: str) -> bool:
+    """判断词是否以中文字符开头"""
+    return '\u4e00' <= word[0] <= '\u9fff'
+
+
+def _bigrams(run: str) -> List[str]:
+    """中文片段按相邻双字切分"""
+    if len(run) < 2:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+class Tokenizer:
+    """分词器基类：英文按单词小写，中文片段交给子类切分"""
+
+    name = 'base'
+
+    @property
+    def signature(self) -> str:
+        """分词结果的标识，用于判断索引快照是否仍然有效"""
+        return self.name
+
+    def cut(self, text: str) -> List[str]:
+        """切分全部词（包含停用词），保持原文顺序"""
+        tokens = []
+        for match in TOKEN_PATTERN.finditer(text.lower()):
+            word = match.group()
+            if is_cjk(word):
+                tokens.extend(self._cut_cjk(word))
+            else:
+                tokens.append(word)
+        return tokens
+
+    def tokenize(self, text: str) -> List[str]:
+        """切分检索词（去掉停用词）"""
+        return [token for token in self.cut(text) if token not in STOP_WORDS]
+
+    def keywords(self, text: str, max_keywords: Optional[int] = None) -> List[str]:
+        """提取关键词，按词频排序"""
+        word_freq = {}
+        for token in self.tokenize(text):
+            word_freq[token] = word_freq.get(token, 0) + 1
+        return self.top_keywords(word_freq, max_keywords)
+
+    @staticmethod
+    def top_keywords(word_freq: Dict[str, int], max_keywords: Optional[int] = None) -> List[str]:
+        """从词频表中挑选关键词：中文至少2字、英文至少3个字母"""
+        candidates = [(word, freq) for word, freq in word_freq.items()
+                      if len(word) >= (2 if is_cjk(word) else 3) and not word.isdigit()]
+        candidates.sort(key=lambda x: x[1], reverse=True)
+        return [word for word, freq in candidates[:max_keywords]]
+
+    def _cut_cjk(self, run: str) -> List[str]:
+        raise NotImplementedError
+
+
+class BigramTokenizer(Tokenizer):
+    """中文按相邻双字切分，无需词典"""
+
+    name = 'bigram'
+
+    def _cut_cjk(self, run: str) -> List[str]:
+        return _bigrams(run)
+
+
+class DictionaryTokenizer(Tokenizer):
+    """基于本地词典的中文分词：构建有向无环图，按最大概率路径切分，
+    未登录的连续单字退化为相邻双字"""
+
+    name = 'dictionary'
+    cache_size = 100000  # 缓存的中文片段切分结果数量上限
+
+    def __init__(self, words: Dict[str, int]):
+        self._cache = {}  # 中文片段 -> 切分结果，正文中大量片段会重复出现
+        self.freq = {}  # 词频，词的前缀记为0以便构建DAG
+        for word, freq in words.items():
+            self.freq[word] = freq
+            for i in range(1, len(word)):
+                self.freq.setdefault(word[:i], 0)
+        self.log_total = math.log(sum(words.values()) or 1)
+        self._signature = hashlib.md5(
+            '\n'.join(f"{w} {f}" for w, f in sorted(words.items())).encode('utf-8')
+        ).hexdigest()[:8]
+
+    @classmethod
+    def from_file(cls, dict_path: Path) -> 'DictionaryTokenizer':
+        """从“词 词频”格式的词典文件加载"""
+        words = {}
+        try:
+            for line in Path(dict_path).read_text(encoding='utf-8').splitlines():
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split()
+                word = parts[0].lower()
+                words[word] = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 1
+        except Exception as e:
+            logger.warning(f"加载分词词典失败 {dict_path}: {e}")
+        return cls(words)
+
+    @property
+    def signature(self) -> str:
+        return f"{self.name}:{self._signature}"
+
+    def __getstate__(self):
+        # 传给索引工作进程时不携带切分缓存
+        state = self.__dict__.copy()
+        state['_cache'] = {}
+        return state
+
+    def _build_dag(self, run: str) -> List[List[int]]:
+        """每个位置可以结束的词的终点下标"""
+        dag = []
+        n = len(run)
+        for k in range(n):
+            ends = []
+            i = k
+            fragment = run[k]
+            while i < n and fragment in self.freq:
+                if self.freq[fragment]:
+                    ends.append(i)
+                i += 1
+                fragment = run[k:i + 1]
+            dag.append(ends or [k])
+        return dag
+
+    def _cut_cjk(self, run: str) -> List[str]:
+        tokens = self._cache.get(run)
+        if tokens is None:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            tokens = self._cache[run] = self._segment(run)
+        return tokens
+
+    def _segment(self, run: str) -> List[str]:
+        n = len(run)
+        dag = self._build_dag(run)
+
+        # 从后往前动态规划，求最大对数概率路径
+        route = [(0.0, 0)] * (n + 1)
+        for idx in range(n - 1, -1, -1):
+            route[idx] = max(
+                (math.log(self.freq.get(run[idx:end + 1]) or 1) - self.log_total + route[end + 1][0], end)
+                for end in dag[idx]
+            )
+
+        tokens = []
+        unknown = ''
+        idx = 0
+        while idx < n:
+            end = route[idx][1] + 1
+            word = run[idx:end]
+            if end - idx == 1 and not self.freq.get(word):
+                unknown += word
+            else:
+                if unknown:
+                    tokens.extend(_bigrams(unknown))
+                    unknown = ''
+                tokens.append(word)
+            idx = end
+        if unknown:
+            tokens.extend(_bigrams(unknown))
+        return tokens
+
+
+# 可插拔的分词器注册表
+_TOKENIZER_FACTORIES: Dict[str, Callable[[], Tokenizer]] = {
+    'bigram': BigramTokenizer,
+    'dictionary': lambda: DictionaryTokenizer.from_file(HANDBOOK_DICT_PATH),
+}
+_tokenizers: Dict[str, Tokenizer] = {}
+_tokenizer_lock = threading.Lock()
+
+
+def register_tokenizer(name: str, factory: Callable[[], Tokenizer]):
+    """注册自定义分词器"""
+    with _tokenizer_lock:
+        _TOKENIZER_FACTORIES[name] = factory
+        _tokenizers.pop(name, None)
+
+
+def get_tokenizer(name: Optional[str] = None) -> Tokenizer:
+    """获取分词器实例（按名称缓存），默认使用 config.HANDBOOK_TOKENIZER"""
+    name = name or HANDBOOK_TOKENIZER
+    with _tokenizer_lock:
+        if name not in _tokenizers:
+            factory = _TOKENIZER_FACTORIES.get(name)
+            if factory is None:
+                logger.warning(f"未知的分词器 {name}，改用双字切分")
+                factory = BigramTokenizer
+            _tokenizers[name] = factory()
+        return _tokenizers[name]
@@ -0,0 +1,169 @@
+# handbook_vectors.py
+import json
+import logging
+import math
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# NumPy为可选依赖，不可用时只使用词法检索
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 稀疏矩阵乘法每批处理的非零元数量，限制临时数组大小
+_CHUNK = 200000
+# 随机SVD的过采样列数和幂迭代次数
+_OVERSAMPLE = 10
+_POWER_ITERATIONS = 2
+
+
+def _sparse_matmul(targets, sources, values, dense, n_out: int):
+    """稀疏矩阵（三元组形式）乘稠密矩阵：out[targets] += values * dense[sources]"""
+    out = np.zeros((n_out, dense.shape[1]), dtype=np.float32)
+    for start in range(0, len(values), _CHUNK):
+        end = start + _CHUNK
+        np.add.at(out, targets[start:end], values[start:end, None] * dense[sources[start:end]])
+    return out
+
+
+class SemanticIndex:
+    """章节的LSA向量：TF-IDF经截断SVD降维并按行归一化，保存为连续的float32矩阵，
+    查询时一次矩阵乘法求出与全部章节的余弦相似度"""
+
+    def __init__(self, section_keys: List[str], vocab: Dict[str, int], idf, components, vectors,
+                 signature: str):
+        self.section_keys = section_keys  # 矩阵行号 -> 章节键
+        self.vocab = vocab                # 词 -> 列号
+        self.idf = idf                    # (词数,) float32
+        self.components = components      # (词数, 维数) float32，TF-IDF到语义空间的投影
+        self.vectors = vectors            # (章节数, 维数) float32，可为内存映射
+        self.signature = signature        # 对应的索引内容签名
+
+    @staticmethod
+    def term_weight(tf: int, idf: float) -> float:
+        return (1.0 + math.log(tf)) * idf
+
+    @classmethod
+    def build(cls, inverted_index: Dict[str, Dict[str, List[int]]], section_keys: List[str],
+              dim: int, max_vocab: int, signature: str) -> Optional['SemanticIndex']:
+        """由倒排表构建向量索引，章节或词太少时返回None"""
+        n_sections = len(section_keys)
+        row_of = {section_key: row for row, section_key in enumerate(section_keys)}
+
+        # 只出现在一个章节中的词对相似度没有贡献，按文档频率保留最常见的max_vocab个
+        terms = [(term, len(postings)) for term, postings in inverted_index.items() if len(postings) >= 2]
+        terms.sort(key=lambda item: item[1], reverse=True)
+        terms = terms[:max_vocab]
+        rank = min(dim, n_sections - 1, len(terms) - 1)
+        if rank < 1:
+            return None
+
+        vocab = {term: col for col, (term, _) in enumerate(terms)}
+        idf = np.array([math.log((n_sections + 1) / (df + 1)) + 1.0 for _, df in terms], dtype=np.float32)
+
+        rows, cols, values = [], [], []
+        for term, col in vocab.items():
+            for section_key, positions in inverted_index[term].items():
+                row = row_of.get(section_key)
+                if row is not None:
+                    rows.append(row)
+                    cols.append(col)
+                    values.append(cls.term_weight(len(positions), float(idf[col])))
+        rows = np.array(rows, dtype=np.int32)
+        cols = np.array(cols, dtype=np.int32)
+        values = np.array(values, dtype=np.float32)
+        # 行归一化，长章节不因词多而占优
+        norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=n_sections)).astype(np.float32)
+        values /= np.maximum(norms[rows], 1e-12)
+
+        # 随机截断SVD（Halko等），只需要稀疏矩阵与稠密矩阵的乘法
+        n_terms = len(vocab)
+        width = min(rank + _OVERSAMPLE, n_sections, n_terms)
+        omega = np.random.default_rng(0).standard_normal((n_terms, width)).astype(np.float32)
+        sample = _sparse_matmul(rows, cols, values, omega, n_sections)
+        for _ in range(_POWER_ITERATIONS):
+            basis, _ = np.linalg.qr(sample)
+            basis, _ = np.linalg.qr(_sparse_matmul(cols, rows, values, basis, n_terms))
+            sample = _sparse_matmul(rows, cols, values, basis, n_sections)
+        basis, _ = np.linalg.qr(sample)
+        projected = _sparse_matmul(cols, rows, values, basis, n_terms).T
+        u, singular, vt = np.linalg.svd(projected, full_matrices=False)
+
+        components = np.ascontiguousarray(vt[:rank].T, dtype=np.float32)
+        vectors = (basis @ u[:, :rank]) * singular[:rank]
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return cls(list(section_keys), vocab, idf, components,
+                   np.ascontiguousarray(vectors, dtype=np.float32), signature)
+
+    def embed(self, queries: Sequence[Sequence[str]]):
+        """把多个查询（各自的词列表）投影到语义空间，返回(查询数, 维数)矩阵"""
+        embedded = np.zeros((len(queries), self.components.shape[1]), dtype=np.float32)
+        for i, terms in enumerate(queries):
+            tf = {}
+            for term in terms:
+                if term in self.vocab:
+                    tf[term] = tf.get(term, 0) + 1
+            for term, count in tf.items():
+                col = self.vocab[term]
+                embedded[i] += self.term_weight(count, float(self.idf[col])) * self.components[col]
+        norms = np.linalg.norm(embedded, axis=1, keepdims=True)
+        return embedded / np.maximum(norms, 1e-12)
+
+    def search(self, queries: Sequence[Sequence[str]], top_k: int = 10) -> List[List[Tuple[str, float]]]:
+        """批量余弦检索：一次矩阵乘法得到全部查询与全部章节的相似度"""
+        embedded = self.embed(queries)
+        scores = np.asarray(self.vectors) @ embedded.T  # (章节数, 查询数)
+        top_k = min(top_k, scores.shape[0])
+        results = []
+        for i in range(scores.shape[1]):
+            column = scores[:, i]
+            if not column.any():
+                results.append([])
+                continue
+            top = np.argpartition(-column, top_k - 1)[:top_k]
+            top = top[np.argsort(-column[top])]
+            results.append([(self.section_keys[row], float(column[row])) for row in top if column[row] > 0])
+        return results
+
+    def save(self, path: Path):
+        """保存为 .npy（章节矩阵，可内存映射）、.npz（投影矩阵和idf）和 .json（元数据）"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        for suffix, write in (
+            ('.npy', lambda f: np.save(f, self.vectors)),
+            ('.npz', lambda f: np.savez(f, components=self.components, idf=self.idf)),
+            ('.json', lambda f: f.write(json.dumps({
+                'signature': self.signature,
+                'section_keys': self.section_keys,
+                'vocab': sorted(self.vocab, key=self.vocab.get)
+            }, ensure_ascii=False).encode('utf-8'))),
+        ):
+            target = path.with_suffix(suffix)
+            tmp_path = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, target)
+
+    @classmethod
+    def load(cls, path: Path, signature: str) -> Optional['SemanticIndex']:
+        """签名一致时加载已保存的向量索引，章节矩阵以只读内存映射方式打开"""
+        path = Path(path)
+        try:
+            meta = json.loads(path.with_suffix('.json').read_text(encoding='utf-8'))
+            if meta.get('signature') != signature:
+                return None
+            arrays = np.load(path.with_suffix('.npz'))
+            vectors = np.load(path.with_suffix('.npy'), mmap_mode='r')
+            vocab = {term: col for col, term in enumerate(meta['vocab'])}
+            return cls(meta['section_keys'], vocab, arrays['idf'], arrays['components'], vectors, signature)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"加载向量索引失败，将重新构建: {e}")
+            return None
@@ -0,0 +1,142 @@
+# handbook_watcher.py
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from config import HANDBOOK_WATCH, HANDBOOK_WATCH_INTERVAL
+
+# inotify为可选依赖，不可用时退化为mtime轮询
+try:
+    from inotify_simple import INotify, flags
+    INOTIFY_AVAILABLE = True
+except ImportError:
+    INotify = None
+    flags = None
+    INOTIFY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class HandbookWatcher(threading.Thread):
+    """后台监视手册目录，Markdown文件新增、修改或删除时增量更新索引"""
+
+    def __init__(self, handbook, interval: float = HANDBOOK_WATCH_INTERVAL, use_inotify: bool = True):
+        super().__init__(name='handbook-watcher', daemon=True)
+        self.handbook = handbook
+        self.interval = interval
+        self.mode = 'inotify' if use_inotify and INOTIFY_AVAILABLE else 'polling'
+        self._stop_event = threading.Event()
+        self._watch_dirs = {}  # inotify watch描述符 -> 目录
+
+    def stop(self):
+        """通知线程退出"""
+        self._stop_event.set()
+
+    def run(self):
+        logger.info(f"手册目录监视已启动（{self.mode}）: {self.handbook.base_path}")
+        if self.mode == 'inotify':
+            try:
+                self._run_inotify()
+                return
+            except Exception as e:
+                logger.warning(f"inotify监视失败，改用轮询: {e}")
+                self.mode = 'polling'
+        self._run_polling()
+
+    def _scan(self) -> Dict[str, Tuple[float, int]]:
+        """扫描目录，返回 文件键 -> (mtime, 大小)"""
+        files = {}
+        for md_file in self.handbook.base_path.rglob("*.md"):
+            try:
+                stat = md_file.stat()
+            except OSError:
+                continue
+            files[self.handbook._file_key(md_file)] = (stat.st_mtime, stat.st_size)
+        return files
+
+    def sync(self):
+        """对比磁盘与索引片段，只重新索引有变化的文件"""
+        current = self._scan()
+        known = {file_key: (fragment['mtime'], fragment['size'])
+                 for file_key, fragment in self.handbook.fragments.items()}
+
+        for file_key, signature in current.items():
+            if known.get(file_key) != signature:
+                self.handbook.refresh_file(self.handbook.base_path / file_key)
+        for file_key in known.keys() - current.keys():
+            self.handbook.remove_file(file_key)
+
+    def _run_polling(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"手册目录轮询失败: {e}")
+
+    def _add_watches(self, inotify, root: Path):
+        """递归为目录添加inotify监视"""
+        mask = (flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM |
+                flags.CREATE | flags.DELETE | flags.DELETE_SELF)
+        for directory in [root] + [p for p in root.rglob('*') if p.is_dir()]:
+            if directory not in self._watch_dirs.values():
+                self._watch_dirs[inotify.add_watch(str(directory), mask)] = directory
+
+    def _run_inotify(self):
+        inotify = INotify()
+        try:
+            self._add_watches(inotify, self.handbook.base_path)
+            # 启动期间可能已有变化，先做一次全量对比
+            self.sync()
+
+            while not self._stop_event.is_set():
+                events = inotify.read(timeout=int(self.interval * 1000))
+                if not events:
+                    continue
+                # 短暂等待合并编辑器连续写入产生的事件
+                self._stop_event.wait(0.2)
+                events += inotify.read(timeout=0)
+
+                changed = set()
+                rescan = False
+                for event in events:
+                    directory = self._watch_dirs.get(event.wd)
+                    if directory is None:
+                        continue
+                    if event.mask & flags.DELETE_SELF:
+                        self._watch_dirs.pop(event.wd, None)
+                        rescan = True
+                    elif event.mask & flags.ISDIR:
+                        rescan = True
+                        if event.mask & (flags.CREATE | flags.MOVED_TO):
+                            self._add_watches(inotify, directory / event.name)
+                    elif event.name.endswith('.md'):
+                        changed.add(directory / event.name)
+
+                if rescan:
+                    self.sync()
+                    continue
+                for md_path in changed:
+                    self.handbook.refresh_file(md_path)
+        finally:
+            inotify.close()
+
+
+# 当前运行的监视线程（每个文档库一个）
+_watchers: Dict[str, HandbookWatcher] = {}
+_watcher_lock = threading.Lock()
+
+
+def watch_handbook(handbook, name: str = 'default') -> Optional[HandbookWatcher]:
+    """为文档库的手册实例启动监视线程，替换该文档库之前的监视线程"""
+    with _watcher_lock:
+        watcher = _watchers.pop(name, None)
+        if watcher is not None:
+            watcher.stop()
+        if not HANDBOOK_WATCH or handbook is None:
+            return None
+        watcher = HandbookWatcher(handbook)
+        watcher.name = f'handbook-watcher-{name}'
+        watcher.start()
+        _watchers[name] = watcher
+        return watcher
@@ -2,107 +2,755 @@
 import re
 import base64
 import hashlib
-from typing import Dict, List, Optional, Tuple, Set
+import heapq
+import math
+import multiprocessing
+from typing import Dict, Iterator, List, Optional, Tuple, Set
 import logging
+import os
 from pathlib import Path
-import shutil
+import pickle
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 import urllib.parse
+from collections import OrderedDict
+
+from config import (HANDBOOK_IMAGE_CACHE_BYTES, HANDBOOK_INDEX_WORKERS, HANDBOOK_QUERY_CACHE_SIZE,
+                    HANDBOOK_SNAPSHOT_DELAY, HANDBOOK_VECTORS, HANDBOOK_VECTOR_DIM, HANDBOOK_VECTOR_VOCAB)
+from handbook_cache import QueryCache, normalize_query
+from handbook_fuzzy import FuzzyTermIndex
+from handbook_vectors import NUMPY_AVAILABLE, SemanticIndex
+from handbook_tokenizer import STOP_WORDS, Tokenizer, get_tokenizer
 
 logger = logging.getLogger(__name__)
 
+# 索引快照格式版本，片段结构变化时需要递增
+SNAPSHOT_VERSION = 12
+
+# BM25参数，章节标题命中的额外权重，以及短语（词序连续）命中的加成
+BM25_K1 = 1.5
+BM25_B = 0.75
+TITLE_BOOST = 2.0
+PHRASE_BOOST = 1.5
+
+# 词法排序与向量检索按倒数排名融合（RRF）时的平滑常数，以及向量排名的权重
+RRF_K = 60
+SEMANTIC_WEIGHT = 0.5
+
+# 待索引文件不少于该数量时才启用进程池
+PARALLEL_MIN_FILES = 16
+
+# 子串索引的n-gram长度；短于该长度的查询按各文件的字符集合筛选候选文件
+NGRAM_SIZE = 3
+
+# 图片扩展名对应的MIME类型
+IMAGE_MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp',
+    '.webp': 'image/webp'
+}
+
+# 全局索引使用的Python主题关键词
+PYTHON_KEYWORDS = (
+    'python', '语法', '函数', '类', '对象', '模块', '包', '异常', '装饰器',
+    '生成器', '迭代器', '列表', '字典', '集合', '元组', '字符串',
+    '文件', '输入输出', '多线程', '异步', '网络', '数据库',
+    '测试', '调试', '性能', '优化', '算法', '数据结构', '爬虫',
+    '数据分析', '机器学习', '深度学习', 'web开发', 'gui'
+)
+
+
+def image_dimensions(data: bytes) -> Tuple[Optional[int], Optional[int]]:
+    """从文件头解析图片宽高（支持PNG/GIF/BMP/JPEG/WEBP），无法识别时返回(None, None)"""
+    try:
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            return struct.unpack('>II', data[16:24])
+        if data[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', data[6:10])
+        if data[:2] == b'BM':
+            width, height = struct.unpack('<ii', data[18:26])
+            return width, abs(height)
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            chunk = data[12:16]
+            if chunk == b'VP8 ':
+                width, height = struct.unpack('<HH', data[26:30])
+                return width & 0x3fff, height & 0x3fff
+            if chunk == b'VP8L':
+                bits = int.from_bytes(data[21:25], 'little')
+                return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+            if chunk == b'VP8X':
+                return int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+        if data[:2] == b'\xff\xd8':
+            # 顺序扫描JPEG段，找到SOF段读取尺寸
+            pos = 2
+            while pos + 9 < len(data):
+                if data[pos] != 0xff:
+                    pos += 1
+                    continue
+                marker = data[pos + 1]
+                if marker in (0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf):
+                    height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+                    return width, height
+                pos += 2 + struct.unpack('>H', data[pos + 2:pos + 4])[0]
+    except struct.error:
+        pass
+    return None, None
+
+
+class SectionSpan:
+    """章节记录：只保存在所属文件文本中的起止偏移，正文按需切片"""
+    
+    __slots__ = ('file', 'title', 'start', 'end', 'level', 'parent')
+    
+    def __init__(self, file: str, title: str, start: int, end: int, level: int, parent: Optional[str]):
+        self.file = file      # 文件键
+        self.title = title    # 章节标题
+        self.start = start    # 正文起始偏移（不含标题行）
+        self.end = end        # 正文结束偏移
+        self.level = level    # 标题级别，文件开头的“简介”为0
+        self.parent = parent  # 上级标题的章节键
+    
+    def __getstate__(self):
+        return (self.file, self.title, self.start, self.end, self.level, self.parent)
+    
+    def __setstate__(self, state):
+        self.file, self.title, self.start, self.end, self.level, self.parent = state
+
+
+def file_metadata(file_key: str, fragment: Dict) -> Dict:
+    """由索引片段得出文件列表所需的元数据，ETag随mtime和大小变化"""
+    return {
+        'path': file_key,
+        'name': file_key.rsplit('/', 1)[-1],
+        'title': fragment['title'],
+        'size': fragment['size'],
+        'mtime': fragment['mtime'],
+        'modified': datetime.fromtimestamp(fragment['mtime']).isoformat(),
+        'section_count': len(fragment['sections']),
+        'image_count': len(fragment['images']),
+        'has_images': bool(fragment['images']),
+        'etag': hashlib.md5(f"{file_key}:{fragment['mtime']}:{fragment['size']}".encode('utf-8')).hexdigest()[:16]
+    }
+
+
+def text_ngrams(text_lower: str, n: int = NGRAM_SIZE) -> Set[str]:
+    """小写文本中出现过的全部n-gram"""
+    return {text_lower[i:i + n] for i in range(len(text_lower) - n + 1)}
+
+
+class _IndexState:
+    """一次发布的全部检索结构。增量更新时复制后修改、整体替换，
+    正在进行的检索始终看到完整的旧索引或完整的新索引"""
+    
+    __slots__ = ('md_files', 'file_meta', 'file_images', 'text_cache', 'lower_cache', 'file_chars',
+                 'ngram_index', 'sections', 'images_cache', 'image_blobs', 'content_index', 'image_index',
+                 'inverted_index', 'title_index', 'section_lengths', 'total_length',
+                 'version', '_cow', '_owned')
+    
+    def __init__(self):
+        self.md_files = []         # 所有Markdown文件路径
+        self.file_meta = {}        # 文件键 -> 标题、大小、修改时间、章节数、图片数和ETag
+        self.file_images = {}      # 文件键 -> 该文件引用的图片（图片键 -> 图片引用）
+        self.text_cache = {}       # 文件文本缓存
+        self.lower_cache = {}      # 小写文本，子串查找时不必每次重新转换
+        self.file_chars = {}       # 文件键 -> 小写文本中出现过的字符集合，筛选短于n-gram的查询
+        self.ngram_index = {}      # n-gram -> 包含它的文件键集合（由文本重建，不写入快照）
+        self.sections = {}         # 章节键 -> SectionSpan
+        self.images_cache = {}     # 图片引用：图片键 -> 标题、所在文件和内容哈希
+        self.image_blobs = {}      # 本地图片内容：哈希 -> 路径、类型、大小、尺寸（全库去重）
+        self.content_index = {}    # 关键词到位置的索引
+        self.image_index = {}      # 图片到内容的映射
+        self.inverted_index = {}   # 倒排索引：词 -> {章节键: 词位置列表}
+        self.title_index = {}      # 章节标题倒排索引：词 -> {章节键: 词频}
+        self.section_lengths = {}  # 章节长度（词数）
+        self.total_length = 0
+        self.version = 0           # 每次发布递增，检索结果缓存据此失效
+        self._cow = False          # 是否与已发布的索引共享内层容器
+        self._owned = set()
+    
+    @property
+    def avg_section_length(self) -> float:
+        return self.total_length / len(self.section_lengths) if self.section_lengths else 0.0
+    
+    def copy(self) -> '_IndexState':
+        """浅拷贝外层容器，内层容器在修改前再复制"""
+        state = _IndexState()
+        for name in ('file_meta', 'file_images', 'text_cache', 'lower_cache', 'file_chars', 'ngram_index', 'sections',
+                     'images_cache',
+                     'image_blobs', 'content_index', 'image_index', 'inverted_index',
+                     'title_index', 'section_lengths'):
+            setattr(state, name, dict(getattr(self, name)))
+        state.md_files = list(self.md_files)
+        state.total_length = self.total_length
+        state.version = self.version + 1
+        state._cow = True
+        return state
+    
+    def _inner(self, container: Dict, key, empty):
+        """取得可修改的内层容器，必要时先复制，避免影响已发布的索引"""
+        inner = container.get(key)
+        marker = (id(container), key)
+        if inner is None:
+            inner = container[key] = empty()
+            self._owned.add(marker)
+        elif self._cow and marker not in self._owned:
+            inner = container[key] = inner.copy()
+            self._owned.add(marker)
+        return inner
+    
+    def add_fragment(self, file_key: str, fragment: Dict):
+        """把单个文件的索引片段并入全局索引"""
+        self.file_meta[file_key] = file_metadata(file_key, fragment)
+        self.file_images[file_key] = fragment['images']
+        self.text_cache[file_key] = fragment['text']
+        text_lower = self.lower_cache[file_key] = fragment['text'].lower()
+        self.file_chars[file_key] = frozenset(text_lower)
+        for gram in text_ngrams(text_lower):
+            self._inner(self.ngram_index, gram, set).add(file_key)
+        self.sections.update(fragment['sections'])
+        self.section_lengths.update(fragment['section_lengths'])
+        self.total_length += sum(fragment['section_lengths'].values())
+        for term, section_postings in fragment['postings'].items():
+            self._inner(self.inverted_index, term, dict).update(section_postings)
+        for term, term_freqs in fragment['title_postings'].items():
+            self._inner(self.title_index, term, dict).update(term_freqs)
+        self.images_cache.update(fragment['images'])
+        self.image_blobs.update(fragment['image_blobs'])
+        for keyword, image_keys in fragment['image_keywords'].items():
+            self._inner(self.image_index, keyword, list).extend(image_keys)
+        for keyword in fragment['keywords']:
+            self._inner(self.content_index, keyword, list).append({
+                'file': file_key,
+                'start': 0,
+                'end': min(len(fragment['text']), 500),  # 文件开头500字符
+                'relevance': 'high'
+            })
+        # 为每个主题关键词建立索引，上下文只记录偏移
+        for keyword, (start, end) in fragment['topics'].items():
+            self._inner(self.content_index, keyword, list).append({
+                'file': file_key,
+                'start': start,
+                'end': end,
+                'type': 'keyword_match'
+            })
+    
+    def remove_fragment(self, file_key: str, fragment: Dict, remaining: Dict[str, Dict]):
+        """从全局索引中移除单个文件的倒排表、章节和图片"""
+        self.file_meta.pop(file_key, None)
+        self.file_images.pop(file_key, None)
+        self.text_cache.pop(file_key, None)
+        self.file_chars.pop(file_key, None)
+        for gram in text_ngrams(self.lower_cache.pop(file_key, None) or fragment['text'].lower()):
+            if gram not in self.ngram_index:
+                continue
+            inner = self._inner(self.ngram_index, gram, set)
+            inner.discard(file_key)
+            if not inner:
+                del self.ngram_index[gram]
+        for section_key in fragment['sections']:
+            self.sections.pop(section_key, None)
+            self.total_length -= self.section_lengths.pop(section_key, 0)
+        
+        for index, postings in ((self.inverted_index, fragment['postings']),
+                                (self.title_index, fragment['title_postings'])):
+            for term, section_postings in postings.items():
+                if term not in index:
+                    continue
+                inner = self._inner(index, term, dict)
+                for section_key in section_postings:
+                    inner.pop(section_key, None)
+                if not inner:
+                    del index[term]
+        
+        for keyword in set(fragment['keywords']) | set(fragment['topics']):
+            if keyword not in self.content_index:
+                continue
+            entries = self._inner(self.content_index, keyword, list)
+            entries[:] = [entry for entry in entries if entry['file'] != file_key]
+            if not entries:
+                del self.content_index[keyword]
+        
+        for keyword, image_keys in fragment['image_keywords'].items():
+            if keyword not in self.image_index:
+                continue
+            keys = self._inner(self.image_index, keyword, list)
+            for image_key in image_keys:
+                if image_key in keys:
+                    keys.remove(image_key)
+            if not keys:
+                del self.image_index[keyword]
+        
+        # 同一张图片可能被多个文件引用，移除后由其他文件的片段补回
+        for image_key in fragment['images']:
+            if self.images_cache.get(image_key, {}).get('file') != file_key:
+                continue
+            del self.images_cache[image_key]
+            for other in remaining.values():
+                if image_key in other['images']:
+                    self.images_cache[image_key] = other['images'][image_key]
+                    break
+        for content_hash in fragment['image_blobs']:
+            if not any(content_hash in other['image_blobs'] for other in remaining.values()):
+                self.image_blobs.pop(content_hash, None)
+
+
 class MarkdownHandbook:
     """Markdown文档处理器，支持搜索Python-100-Days文件夹中的Markdown文件"""
     
-    def __init__(self, base_path: str):
+    def __init__(self, base_path: str, snapshot_path: Optional[str] = None,
+                 tokenizer: Optional[Tokenizer] = None, workers: Optional[int] = None,
+                 load: bool = True):
         self.base_path = Path(base_path)
-        self.md_files = []  # 所有Markdown文件路径
-        self.content_index = {}  # 关键词到位置的索引
-        self.image_index = {}    # 图片到内容的映射
-        self.sections = {}       # 文件章节结构
-        self.text_cache = {}     # 文件文本缓存
-        self.images_cache = {}   # 图片缓存（本地图片）
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.workers = workers if workers is not None else HANDBOOK_INDEX_WORKERS
+        self.fragments = {}      # 单个文件的索引片段（可持久化）
+        self._state = _IndexState()  # 当前发布的检索结构
+        self._update_lock = threading.RLock()
         self.image_mapping = {}  # 图片路径映射
-        self.load_markdown_files()
+        self._blob_memo = {}     # 源图片路径 -> ((mtime, 大小), 图片内容元数据)，同一图片只读一次
+        self.load_seconds = 0.0  # 建立索引耗时
+        self._memory_estimate = None  # (索引版本, 估算的内存字节数)
+        self.reused_files = 0    # 从快照复用的文件数
+        self.indexed_files = 0   # 本次重新索引的文件数
+        self.stage_seconds = {}  # 各阶段耗时（读取/解析/图片为各进程累计）
+        self._image_data = OrderedDict()  # 按需生成的图片base64（LRU，按字节数限制）
+        self._image_data_bytes = 0
+        self._image_lock = threading.Lock()
+        self.query_cache = QueryCache(HANDBOOK_QUERY_CACHE_SIZE)  # 检索结果缓存
+        self._files_etag = None  # (索引版本, 文件列表ETag)
+        self._fuzzy_index = None  # (索引版本, 纠错用的词典三元组索引)
+        self.semantic = None      # 章节向量索引（SemanticIndex），未就绪时只做词法检索
+        self._semantic_signature = None
+        self._semantic_building = False
+        self._semantic_pending = False
+        self._semantic_idle = threading.Event()
+        self._semantic_idle.set()
+        self._semantic_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()  # 增量更新后的快照写入：同一时刻只有一个写入线程
+        self._snapshot_saving = False
+        self._snapshot_dirty = False
+        self._snapshot_idle = threading.Event()
+        self._snapshot_idle.set()
+        if load:
+            self.load_markdown_files()
         
+    # 以下属性均读取当前发布的索引，保持原有访问方式
+    @property
+    def md_files(self) -> List[Path]:
+        return self._state.md_files
+    
+    @property
+    def text_cache(self) -> Dict[str, str]:
+        return self._state.text_cache
+    
+    @property
+    def sections(self) -> Dict[str, SectionSpan]:
+        return self._state.sections
+    
+    def section_text(self, section_key: str, state: Optional[_IndexState] = None) -> str:
+        """按偏移从文件文本中取出章节正文"""
+        state = state or self._state
+        span = state.sections[section_key]
+        return state.text_cache[span.file][span.start:span.end]
+    
+    def entry_text(self, entry: Dict) -> str:
+        """取出content_index条目对应的文本"""
+        return self._state.text_cache[entry['file']][entry['start']:entry['end']]
+    
+    @property
+    def images_cache(self) -> Dict[str, Dict]:
+        return self._state.images_cache
+    
+    @property
+    def image_blobs(self) -> Dict[str, Dict]:
+        return self._state.image_blobs
+    
+    @property
+    def content_index(self) -> Dict[str, List]:
+        return self._state.content_index
+    
+    @property
+    def image_index(self) -> Dict[str, List]:
+        return self._state.image_index
+    
+    @property
+    def inverted_index(self) -> Dict[str, Dict]:
+        return self._state.inverted_index
+    
+    @property
+    def title_index(self) -> Dict[str, Dict]:
+        return self._state.title_index
+    
+    @property
+    def section_lengths(self) -> Dict[str, int]:
+        return self._state.section_lengths
+    
+    @property
+    def avg_section_length(self) -> float:
+        return self._state.avg_section_length
+    
+    @property
+    def index_version(self) -> int:
+        return self._state.version
+    
     def load_markdown_files(self):
-        """加载所有Markdown文件"""
+        """加载所有Markdown文件，未变化的文件直接复用快照中的索引片段"""
+        start_time = time.perf_counter()
         try:
-            # 遍历文件夹，找到所有.md文件
-            for md_file in self.base_path.rglob("*.md"):
-                self.md_files.append(md_file)
-                self._index_file(md_file)
+            snapshot = self._load_snapshot()
             
-            logger.info(f"加载了 {len(self.md_files)} 个Markdown文件")
+            # 遍历文件夹，找到所有.md文件，未变化的直接复用快照
+            pending = []
+            for md_file in sorted(self.base_path.rglob("*.md")):
+                file_key = self._file_key(md_file)
+                stat = md_file.stat()
+                cached = snapshot.get(file_key)
+                if cached and self._fragment_fresh(cached, stat):
+                    self.fragments[file_key] = cached
+                    self.reused_files += 1
+                else:
+                    self.fragments[file_key] = None  # 占位，保持文件顺序
+                    pending.append(md_file)
+            
+            timings = {'read': 0.0, 'parse': 0.0, 'image': 0.0}
+            for md_file, fragment, file_timings in self._index_files(pending):
+                for stage, seconds in file_timings.items():
+                    timings[stage] += seconds
+                if fragment:
+                    self.fragments[fragment['file']] = fragment
+                    self.indexed_files += 1
+            self.fragments = {key: fragment for key, fragment in self.fragments.items() if fragment}
+            
+            logger.info(f"加载了 {len(self.fragments)} 个Markdown文件（复用快照 {self.reused_files} 个，"
+                        f"重新索引 {self.indexed_files} 个）")
+            merge_start = time.perf_counter()
             self._build_global_index()
+            timings['merge'] = time.perf_counter() - merge_start
+            self.stage_seconds = {stage: round(seconds, 3) for stage, seconds in timings.items()}
+            
+            # 有文件新增、修改或删除时更新快照
+            if self.indexed_files or len(snapshot) != self.reused_files:
+                self._save_snapshot()
             
         except Exception as e:
             logger.error(f"加载Markdown文件失败: {e}")
+        finally:
+            self.load_seconds = time.perf_counter() - start_time
+            logger.info(f"手册索引耗时 {self.load_seconds:.2f}s，约占用 {self.memory_bytes / 1024 / 1024:.1f}MB")
+        # 向量索引在后台构建，就绪前检索只使用词法排序
+        self.ensure_vectors()
+    
+    @staticmethod
+    def _source_signature(path: Path) -> Optional[Tuple[float, int]]:
+        """图片源文件的(mtime, 大小)，文件不存在时为None"""
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+    
+    def _fragment_fresh(self, fragment: Dict, stat: os.stat_result) -> bool:
+        """快照中的片段能否直接复用：文件本身、引用的源图片均未变化，且存入静态目录的图片仍然存在"""
+        if fragment['mtime'] != stat.st_mtime or fragment['size'] != stat.st_size:
+            return False
+        for src_path, signature in fragment['image_sources'].items():
+            if self._source_signature(Path(src_path)) != signature:
+                return False
+        return all(Path(blob['path']).exists() for blob in fragment['image_blobs'].values())
+    
+    def _index_files(self, md_files: List[Path]):
+        """索引一批文件，文件较多时由进程池并行解析，逐个产出(路径, 片段, 各阶段耗时)"""
+        workers = self.workers or os.cpu_count() or 1
+        workers = min(workers, len(md_files))
+        if workers > 1 and len(md_files) >= PARALLEL_MIN_FILES:
+            try:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=_index_mp_context(),
+                                         initializer=_init_index_worker,
+                                         initargs=(str(self.base_path), self.tokenizer)) as executor:
+                    chunksize = max(1, len(md_files) // (workers * 4))
+                    results = list(executor.map(_index_in_worker, md_files, chunksize=chunksize))
+                logger.info(f"使用 {workers} 个进程并行索引 {len(md_files)} 个文件")
+                yield from results
+                return
+            except Exception as e:
+                logger.warning(f"并行索引失败，改为逐个索引: {e}")
+        
+        for md_file in md_files:
+            timings = {}
+            yield md_file, self._index_file(md_file, timings), timings
+    
+    def _load_snapshot(self) -> Dict[str, Dict]:
+        """读取磁盘上的索引快照，版本或目录不匹配时忽略"""
+        if not self.snapshot_path or not self.snapshot_path.exists():
+            return {}
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                data = pickle.load(f)
+            if (data.get('version') != SNAPSHOT_VERSION
+                    or data.get('base_path') != str(self.base_path.resolve())
+                    or data.get('tokenizer') != self.tokenizer.signature):
+                logger.info("索引快照版本、文档目录或分词器不匹配，将重新建立索引")
+                return {}
+            return data.get('fragments', {})
+        except Exception as e:
+            logger.warning(f"读取索引快照失败 {self.snapshot_path}: {e}")
+            return {}
+    
+    def _save_snapshot(self):
+        """将所有文件的索引片段写入快照（先写临时文件再替换，避免半写状态）"""
+        if not self.snapshot_path:
+            return
+        try:
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            # 临时文件名带进程号，多个进程同时保存时不会写同一个文件
+            tmp_path = self.snapshot_path.with_name(f"{self.snapshot_path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({
+                    'version': SNAPSHOT_VERSION,
+                    'base_path': str(self.base_path.resolve()),
+                    'tokenizer': self.tokenizer.signature,
+                    'fragments': self.fragments
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            logger.warning(f"保存索引快照失败 {self.snapshot_path}: {e}")
+    
+    def schedule_snapshot(self, delay: float = HANDBOOK_SNAPSHOT_DELAY):
+        """增量更新后在后台延迟写快照，延迟期间的多次变化合并为一次写入；
+        写入期间又有变化时，写完后再写一次。进程在写入前退出时，下次启动按mtime重新索引变化的文件"""
+        if not self.snapshot_path:
+            return
+        with self._snapshot_lock:
+            self._snapshot_dirty = True
+            if self._snapshot_saving:
+                return
+            self._snapshot_saving = True
+            self._snapshot_idle.clear()
+        threading.Thread(target=self._write_snapshots, args=(delay,), name='handbook-snapshot', daemon=True).start()
     
-    def _index_file(self, md_path: Path):
-        """索引单个Markdown文件"""
+    def flush_snapshot(self, timeout: Optional[float] = None) -> bool:
+        """等待已安排的快照写入完成"""
+        return self._snapshot_idle.wait(timeout)
+    
+    def _write_snapshots(self, delay: float):
+        while True:
+            time.sleep(delay)
+            with self._snapshot_lock:
+                self._snapshot_dirty = False
+            # 片段字典在发布变化时整体替换，这里读取的始终是某个完整版本，无需持有更新锁
+            self._save_snapshot()
+            with self._snapshot_lock:
+                if not self._snapshot_dirty:
+                    self._snapshot_saving = False
+                    self._snapshot_idle.set()
+                    return
+    
+    @property
+    def memory_bytes(self) -> int:
+        """索引占用内存（估算）。按索引版本缓存，增量更新后在下次读取时才重新估算"""
+        state = self._state
+        cached = self._memory_estimate
+        if cached is None or cached[0] != state.version:
+            cached = self._memory_estimate = (state.version, self._estimate_memory(state))
+        return cached[1]
+    
+    def _estimate_memory(self, state: _IndexState) -> int:
+        """估算索引结构占用的内存（字节）"""
+        seen = set()
+        
+        def sizeof(obj) -> int:
+            if id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            size = sys.getsizeof(obj)
+            if isinstance(obj, dict):
+                size += sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+            elif isinstance(obj, (list, tuple, set)):
+                size += sum(sizeof(item) for item in obj)
+            return size
+        
+        return sum(sizeof(cache) for cache in (
+            state.text_cache, state.lower_cache, state.file_chars, state.ngram_index, state.sections, state.images_cache, state.image_blobs,
+            state.content_index, state.image_index,
+            state.inverted_index, state.title_index, state.section_lengths
+        ))
+    
+    def get_stats(self) -> Dict:
+        """返回索引规模、内存和启动耗时"""
+        return {
+            'files': len(self.md_files),
+            'sections': len(self.sections),
+            'images': len(self.images_cache),
+            'image_blobs': len(self.image_blobs),
+            'keywords': len(self.content_index),
+            'terms': len(self.inverted_index),
+            'load_seconds': round(self.load_seconds, 3),
+            'memory_bytes': self.memory_bytes,
+            'image_data_cache_bytes': self._image_data_bytes,
+            'snapshot_reused': self.reused_files,
+            'reindexed': self.indexed_files,
+            'workers': self.workers or os.cpu_count() or 1,
+            'stage_seconds': self.stage_seconds,
+            'index_version': self.index_version,
+            'vectors': {
+                'ready': self.semantic is not None,
+                'sections': len(self.semantic.section_keys) if self.semantic else 0,
+                'dim': self.semantic.components.shape[1] if self.semantic else 0
+            },
+            'query_cache': self.query_cache.stats()
+        }
+    
+    def _file_key(self, md_path: Path) -> str:
+        """相对路径作为文件键"""
+        rel_path = str(md_path.relative_to(self.base_path))
+        return rel_path.replace('\\', '/')
+    
+    def _index_file(self, md_path: Path, timings: Optional[Dict[str, float]] = None) -> Optional[Dict]:
+        """索引单个Markdown文件，返回该文件的索引片段；timings用于累计各阶段耗时"""
+        timings = timings if timings is not None else {}
         try:
             # 读取Markdown文件内容
+            stage_start = time.perf_counter()
+            stat = md_path.stat()
             content = md_path.read_text(encoding='utf-8', errors='ignore')
+            file_key = self._file_key(md_path)
+            timings['read'] = timings.get('read', 0.0) + time.perf_counter() - stage_start
             
-            # 相对路径作为键
-            rel_path = str(md_path.relative_to(self.base_path))
-            file_key = rel_path.replace('\\', '/')
+            # 提取图片信息
+            stage_start = time.perf_counter()
+            images, image_blobs, image_keywords, image_sources = self._extract_images(file_key, content, md_path)
+            timings['image'] = timings.get('image', 0.0) + time.perf_counter() - stage_start
             
-            # 缓存文本内容
-            self.text_cache[file_key] = content
+            # 全局主题关键词及其上下文
+            stage_start = time.perf_counter()
+            content_lower = content.lower()
+            topics = {}
+            same_length = len(content_lower) == len(content)
+            for keyword in PYTHON_KEYWORDS:
+                # 一次查找同时得到是否出现和首次位置，不再用正则重新搜索原文
+                pos = content_lower.find(keyword)
+                if pos == -1:
+                    continue
+                if same_length:
+                    topics[keyword] = (max(0, pos - 100), min(len(content), pos + len(keyword) + 100))
+                else:
+                    topics[keyword] = self._context_span(content, keyword, 200)
             
-            # 提取章节结构
-            self._parse_sections(file_key, content)
+            sections = self._parse_sections(file_key, content)
+            title_match = re.search(r'^[ \t]*#[ \t]+(.+)$', content, re.MULTILINE)
+            postings, title_postings, section_lengths = self._build_postings(sections, content)
+            # 关键词直接由倒排表的词频得出，避免再次切分全文
+            word_freq = {term: sum(len(positions) for positions in section_postings.values())
+                         for term, section_postings in postings.items()}
+            for term, term_freqs in title_postings.items():
+                word_freq[term] = word_freq.get(term, 0) + sum(term_freqs.values())
+            keywords = self.tokenizer.top_keywords(word_freq, 10)
+            timings['parse'] = timings.get('parse', 0.0) + time.perf_counter() - stage_start
             
-            # 提取图片信息
-            self._extract_images(file_key, content, md_path)
-            
-            # 提取关键词
-            keywords = self._extract_keywords(content)
-            for keyword in keywords:
-                if keyword not in self.content_index:
-                    self.content_index[keyword] = []
-                self.content_index[keyword].append({
-                    'file': file_key,
-                    'content': content[:500],  # 截取前500字符
-                    'relevance': 'high'
-                })
+            return {
+                'file': file_key,
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'title': title_match.group(1).strip() if title_match else md_path.stem,
+                'text': content,
+                'sections': sections,
+                'postings': postings,
+                'title_postings': title_postings,
+                'section_lengths': section_lengths,
+                'images': images,
+                'image_blobs': image_blobs,
+                'image_keywords': image_keywords,
+                'image_sources': image_sources,
+                'keywords': keywords,
+                'topics': topics
+            }
                 
         except Exception as e:
             logger.error(f"索引文件 {md_path} 失败: {e}")
+            return None
     
-    def _parse_sections(self, file_key: str, content: str):
-        """解析Markdown文件的章节结构"""
-        lines = content.split('\n')
+    def _parse_sections(self, file_key: str, content: str) -> Dict[str, SectionSpan]:
+        """解析Markdown文件的章节结构，章节只记录正文在文件文本中的偏移"""
+        sections = {}
         current_section = "简介"
-        section_lines = []
+        current_level = 0
+        parent = None
+        headings = []  # 当前标题路径上的 (级别, 章节键)
+        start = 0
+        pos = 0
         
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
+        def save(end: int):
+            # 去掉首尾空白后记录偏移，空章节不保存
+            body = content[start:end]
+            stripped = body.strip()
+            if stripped:
+                offset = start + len(body) - len(body.lstrip())
+                section_key = f"{file_key}#{current_section}"
+                sections[section_key] = SectionSpan(file_key, current_section, offset,
+                                                    offset + len(stripped), current_level, parent)
+        
+        for line in content.split('\n'):
+            line_start = pos
+            pos += len(line) + 1
+            stripped = line.strip()
             
             # 检测Markdown标题（# 到 ######）
-            if line.startswith('#'):
+            if stripped.startswith('#'):
                 # 保存上一个章节
-                if section_lines:
-                    section_key = f"{file_key}#{current_section}"
-                    self.sections[section_key] = '\n'.join(section_lines)
+                save(line_start)
                 
-                # 提取新章节标题
-                # 移除#号和空格
-                current_section = line.lstrip('#').strip()
-                section_lines = []
-            else:
-                section_lines.append(line)
+                # 提取新章节标题，移除#号和空格
+                current_section = stripped.lstrip('#').strip()
+                current_level = len(stripped) - len(stripped.lstrip('#'))
+                while headings and headings[-1][0] >= current_level:
+                    headings.pop()
+                parent = headings[-1][1] if headings else None
+                headings.append((current_level, f"{file_key}#{current_section}"))
+                start = min(pos, len(content))
         
         # 保存最后一个章节
-        if section_lines:
-            section_key = f"{file_key}#{current_section}"
-            self.sections[section_key] = '\n'.join(section_lines)
+        save(len(content))
+        
+        return sections
     
-    def _extract_images(self, file_key: str, content: str, md_path: Path):
-        """提取Markdown中的图片信息"""
+    def _build_postings(self, sections: Dict[str, SectionSpan], content: str) -> Tuple[Dict, Dict, Dict]:
+        """为文件的各章节建立带词位置的倒排表"""
+        postings = {}
+        title_postings = {}
+        section_lengths = {}
+        
+        for section_key, span in sections.items():
+            text = content[span.start:span.end]
+            # 词位置按完整切分结果计数，停用词不进入倒排表
+            length = 0
+            for position, term in enumerate(self.tokenizer.cut(text)):
+                if term in STOP_WORDS:
+                    continue
+                postings.setdefault(term, {}).setdefault(section_key, []).append(position)
+                length += 1
+            section_lengths[section_key] = length
+            
+            for term in self.tokenizer.tokenize(span.title):
+                term_freqs = title_postings.setdefault(term, {})
+                term_freqs[section_key] = term_freqs.get(section_key, 0) + 1
+        
+        return postings, title_postings, section_lengths
+    
+    def _extract_images(self, file_key: str, content: str, md_path: Path) -> Tuple[Dict, Dict, Dict, Dict]:
+        """提取Markdown中的图片信息，返回图片引用、引用到的图片内容、图片关键词索引，
+        以及各本地源图片的(mtime, 大小)（不存在的为None），用于判断快照片段是否过期"""
+        images = {}
+        image_blobs = {}
+        image_keywords = {}
+        image_sources = {}
         try:
             # 使用正则表达式匹配Markdown图片语法
             # ![alt text](image_url "title")
@@ -117,61 +765,74 @@ class MarkdownHandbook:
                 if img_url.startswith('http'):
                     # 网络图片，直接使用URL
                     img_key = f"web_{hashlib.md5(img_url.encode()).hexdigest()[:8]}"
-                    self.images_cache[img_key] = {
+                    images[img_key] = {
                         'type': 'web',
                         'url': img_url,
                         'alt': alt_text,
                         'title': title,
-                        'file': file_key,
-                        'base64': None  # 网络图片不转换为base64
+                        'file': file_key
                     }
                 else:
                     # 本地图片，需要处理相对路径
                     img_path = self._resolve_image_path(img_url, md_path)
+                    if img_path:
+                        image_sources[str(img_path.resolve())] = self._source_signature(img_path)
                     if img_path and img_path.exists():
-                        # 复制到静态目录
-                        static_img_path = self._copy_to_static(img_path, file_key)
-                        if static_img_path:
-                            # 转换为base64
-                            try:
-                                img_bytes = img_path.read_bytes()
-                                img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-                                
-                                # 确定MIME类型
-                                ext = img_path.suffix.lower()
-                                mime_types = {
-                                    '.png': 'image/png',
-                                    '.jpg': 'image/jpeg',
-                                    '.jpeg': 'image/jpeg',
-                                    '.gif': 'image/gif',
-                                    '.bmp': 'image/bmp',
-                                    '.webp': 'image/webp'
-                                }
-                                mime_type = mime_types.get(ext, 'image/jpeg')
-                                
-                                img_key = f"local_{hashlib.md5(img_path.read_bytes()).hexdigest()[:8]}"
-                                self.images_cache[img_key] = {
-                                    'type': 'local',
-                                    'path': str(static_img_path),
-                                    'url': f'/static/images/handbook/{static_img_path.name}',
-                                    'alt': alt_text,
-                                    'title': title,
-                                    'file': file_key,
-                                    'base64': f'data:{mime_type};base64,{img_base64}'
-                                }
-                                
-                                # 建立图片索引
-                                keywords = self._extract_keywords(alt_text + ' ' + title)
-                                for keyword in keywords:
-                                    if keyword not in self.image_index:
-                                        self.image_index[keyword] = []
-                                    self.image_index[keyword].append(img_key)
-                                    
-                            except Exception as e:
-                                logger.warning(f"无法读取图片 {img_path}: {e}")
+                        # 按内容哈希存入静态目录，引用只保存指向图片内容的哈希
+                        blob = self._store_image(img_path)
+                        if blob:
+                            img_key = f"local_{blob['hash'][:8]}"
+                            images[img_key] = {
+                                'type': 'local',
+                                'hash': blob['hash'],
+                                'url': blob['url'],
+                                'alt': alt_text,
+                                'title': title,
+                                'file': file_key
+                            }
+                            image_blobs[blob['hash']] = blob
+                            
+                            # 建立图片索引
+                            keywords = self._extract_keywords(alt_text + ' ' + title)
+                            for keyword in keywords:
+                                image_keywords.setdefault(keyword, []).append(img_key)
                     
         except Exception as e:
             logger.error(f"提取图片失败: {e}")
+        
+        return images, image_blobs, image_keywords, image_sources
+    
+    def get_image_base64(self, image_key: str) -> Optional[str]:
+        """按需生成本地图片的data URI，结果放入按字节数限制的LRU缓存"""
+        state = self._state
+        image_info = state.images_cache.get(image_key)
+        if not image_info or image_info['type'] != 'local':
+            return None
+        blob = state.image_blobs.get(image_info['hash'])
+        if blob is None:
+            return None
+        
+        with self._image_lock:
+            data_uri = self._image_data.get(image_key)
+            if data_uri is not None:
+                self._image_data.move_to_end(image_key)
+                return data_uri
+        
+        try:
+            img_bytes = Path(blob['path']).read_bytes()
+        except OSError as e:
+            logger.warning(f"无法读取图片 {blob['path']}: {e}")
+            return None
+        data_uri = f"data:{blob['mime']};base64,{base64.b64encode(img_bytes).decode('utf-8')}"
+        
+        with self._image_lock:
+            if image_key not in self._image_data and len(data_uri) <= HANDBOOK_IMAGE_CACHE_BYTES:
+                self._image_data[image_key] = data_uri
+                self._image_data_bytes += len(data_uri)
+                while self._image_data_bytes > HANDBOOK_IMAGE_CACHE_BYTES:
+                    _, evicted = self._image_data.popitem(last=False)
+                    self._image_data_bytes -= len(evicted)
+        return data_uri
     
     def _resolve_image_path(self, img_url: str, md_path: Path) -> Optional[Path]:
         """解析图片相对路径"""
@@ -200,87 +861,308 @@ class MarkdownHandbook:
             logger.error(f"解析图片路径失败 {img_url}: {e}")
             return None
     
-    def _copy_to_static(self, src_path: Path, file_key: str) -> Optional[Path]:
-        """复制图片到静态目录"""
+    def _store_image(self, src_path: Path) -> Optional[Dict]:
+        """读取并哈希一次源图片，按内容哈希存入静态目录，返回图片内容元数据。
+        多个章节引用同一张图片时只保存一份"""
         try:
+            stat = src_path.stat()
+            signature = (stat.st_mtime, stat.st_size)
+            memo = self._blob_memo.get(str(src_path))
+            if memo and memo[0] == signature:
+                return memo[1]
+            
+            img_bytes = src_path.read_bytes()
+            content_hash = hashlib.md5(img_bytes).hexdigest()
+            ext = src_path.suffix.lower()
+            
             # 创建静态图片目录
-            static_dir = Path("static/images/handbook")
+            # 创建静态图片目录；片段中保存绝对路径，之后切换工作目录也能找到图片
+            static_dir = Path("static/images/handbook").resolve()
             static_dir.mkdir(parents=True, exist_ok=True)
+            dest_path = static_dir / f"{content_hash}{ext}"
             
-            # 生成唯一文件名
-            file_hash = hashlib.md5(src_path.read_bytes()).hexdigest()[:8]
-            ext = src_path.suffix
-            filename = f"{file_key.replace('/', '_').replace('.', '_')}_{file_hash}{ext}"
-            dest_path = static_dir / filename
-            
-            # 如果文件不存在，复制
+            # 内容相同的文件名相同，已存在则无需再写
             if not dest_path.exists():
-                shutil.copy2(src_path, dest_path)
+                tmp_path = dest_path.with_name(f"{dest_path.name}.{os.getpid()}.tmp")
+                tmp_path.write_bytes(img_bytes)
+                os.replace(tmp_path, dest_path)
             
-            return dest_path
+            width, height = image_dimensions(img_bytes)
+            blob = {
+                'hash': content_hash,
+                'path': str(dest_path),
+                'url': f'/static/images/handbook/{dest_path.name}',
+                'mime': IMAGE_MIME_TYPES.get(ext, 'image/jpeg'),
+                'size': len(img_bytes),
+                'width': width,
+                'height': height
+            }
+            self._blob_memo[str(src_path)] = (signature, blob)
+            return blob
             
         except Exception as e:
-            logger.error(f"复制图片失败 {src_path}: {e}")
+            logger.error(f"保存图片失败 {src_path}: {e}")
             return None
     
     def _extract_keywords(self, text: str, max_keywords: int = 10) -> List[str]:
         """从文本中提取关键词"""
-        # 移除停用词
-        stop_words = {'的', '了', '和', '是', '在', '有', '就', '都', '而', '及', '与', '或', '等'}
-        
-        # 提取中英文单词
-        words = re.findall(r'[\u4e00-\u9fff]{2,5}', text) + re.findall(r'\b[a-zA-Z]{3,}\b', text)
-        
-        # 统计词频
-        word_freq = {}
-        for word in words:
-            if word not in stop_words:
-                word_freq[word] = word_freq.get(word, 0) + 1
-        
-        # 按频率排序
-        sorted_words = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)
-        return [word for word, freq in sorted_words[:max_keywords]]
+        return self.tokenizer.keywords(text, max_keywords)
     
     def _build_global_index(self):
-        """构建全局索引"""
-        python_keywords = {
-            'python', '语法', '函数', '类', '对象', '模块', '包', '异常', '装饰器',
-            '生成器', '迭代器', '列表', '字典', '集合', '元组', '字符串',
-            '文件', '输入输出', '多线程', '异步', '网络', '数据库',
-            '测试', '调试', '性能', '优化', '算法', '数据结构', '爬虫',
-            '数据分析', '机器学习', '深度学习', 'web开发', 'gui'
-        }
+        """由各文件的索引片段构建全局索引并整体发布"""
+        state = _IndexState()
+        for file_key, fragment in self.fragments.items():
+            state.add_fragment(file_key, fragment)
+        state.md_files = [self.base_path / file_key for file_key in self.fragments]
+        state.version = self._state.version + 1
+        self._state = state
+    
+    def refresh_file(self, md_path: Path) -> bool:
+        """重新索引单个新增或修改的文件，只替换该文件的倒排表、章节和图片"""
+        md_path = Path(md_path)
+        file_key = self._file_key(md_path)
+        if not md_path.exists():
+            return self.remove_file(file_key)
         
-        for file_key, content in self.text_cache.items():
-            # 为每个关键词建立索引
-            for keyword in python_keywords:
-                if keyword.lower() in content.lower():
-                    if keyword not in self.content_index:
-                        self.content_index[keyword] = []
-                    
-                    # 提取上下文
-                    context = self._get_context(content, keyword, 200)
-                    self.content_index[keyword].append({
-                        'file': file_key,
-                        'context': context,
-                        'type': 'keyword_match'
-                    })
+        fragment = self._index_file(md_path)
+        if fragment is None:
+            return False
+        with self._update_lock:
+            self._publish_change(file_key, fragment)
+        logger.info(f"已增量更新手册文件索引: {file_key}")
+        return True
+    
+    def remove_file(self, file_key: str) -> bool:
+        """从索引中移除已删除的文件"""
+        with self._update_lock:
+            if file_key not in self.fragments:
+                return False
+            self._publish_change(file_key, None)
+        logger.info(f"已从手册索引中移除文件: {file_key}")
+        return True
+    
+    def _publish_change(self, file_key: str, fragment: Optional[Dict]):
+        """在副本上替换单个文件的片段，然后一次性发布新的索引"""
+        fragments = dict(self.fragments)
+        state = self._state.copy()
+        old = fragments.pop(file_key, None)
+        if old:
+            state.remove_fragment(file_key, old, fragments)
+        if fragment:
+            fragments[file_key] = fragment
+            state.add_fragment(file_key, fragment)
+        state.md_files = [self.base_path / key for key in fragments]
+        
+        self.fragments = fragments
+        self._state = state
+        if fragment:
+            self.indexed_files += 1
+        # 内存估算和快照写入都不在更新锁内进行：前者在读取统计时计算，后者在后台合并写入
+        self.schedule_snapshot()
+        self.ensure_vectors()
     
     def _get_context(self, text: str, keyword: str, context_size: int = 200) -> str:
         """获取关键词上下文"""
+        span = self._context_span(text, keyword, context_size)
+        return text[span[0]:span[1]] if span else ""
+    
+    def _context_span(self, text: str, keyword: str, context_size: int = 200) -> Optional[Tuple[int, int]]:
+        """关键词上下文在文本中的起止偏移"""
         # 不区分大小写搜索
         pattern = re.compile(re.escape(keyword), re.IGNORECASE)
         match = pattern.search(text)
         if not match:
-            return ""
+            return None
         
         pos = match.start()
         start = max(0, pos - context_size // 2)
         end = min(len(text), pos + len(keyword) + context_size // 2)
-        return text[start:end]
+        return start, end
+    
+    @staticmethod
+    def _bm25(state: _IndexState, tf: int, df: int, doc_length: float) -> float:
+        """单个词在单个章节上的BM25得分"""
+        total = len(state.section_lengths)
+        idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+        norm = 1 - BM25_B + BM25_B * doc_length / (state.avg_section_length or 1.0)
+        return idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+    
+    def _query_terms(self, query: str) -> List[Tuple[int, str]]:
+        """切分查询，返回(词位置, 词)，停用词只占位置不参与检索"""
+        return [(position, term) for position, term in enumerate(self.tokenizer.cut(query))
+                if term not in STOP_WORDS]
+    
+    @staticmethod
+    def _is_phrase_match(state: _IndexState, query_terms: List[Tuple[int, str]], section_key: str) -> bool:
+        """检查查询词是否在章节中按查询中的相对位置出现"""
+        first_offset = query_terms[0][0]
+        position_sets = []
+        for offset, term in query_terms:
+            positions = state.inverted_index.get(term, {}).get(section_key)
+            if not positions:
+                return False
+            position_sets.append((offset - first_offset, set(positions)))
+        
+        return any(
+            all(start + offset in positions for offset, positions in position_sets[1:])
+            for start in position_sets[0][1]
+        )
+    
+    def rank_sections(self, query: str, top_k: int = 5,
+                      state: Optional[_IndexState] = None) -> List[Tuple[str, float]]:
+        """使用BM25对章节打分，返回得分最高的top_k个(章节键, 得分)"""
+        state = state or self._state
+        query_terms = self._query_terms(query)
+        terms = [term for _, term in query_terms]
+        if not terms or not state.section_lengths:
+            return []
+        
+        scores = {}
+        for term in set(terms):
+            # 正文命中：开销与倒排表长度成正比，而不是与语料规模成正比
+            section_postings = state.inverted_index.get(term)
+            if section_postings:
+                df = len(section_postings)
+                for section_key, positions in section_postings.items():
+                    score = self._bm25(state, len(positions), df, state.section_lengths[section_key])
+                    scores[section_key] = scores.get(section_key, 0.0) + score
+            
+            # 标题命中：标题较短，不做长度归一化
+            title_postings = state.title_index.get(term)
+            if title_postings:
+                df = len(title_postings)
+                for section_key, tf in title_postings.items():
+                    score = TITLE_BOOST * self._bm25(state, tf, df, state.avg_section_length)
+                    scores[section_key] = scores.get(section_key, 0.0) + score
+        
+        if len(query_terms) > 1:
+            for section_key in scores:
+                if self._is_phrase_match(state, query_terms, section_key):
+                    scores[section_key] *= PHRASE_BOOST
+        
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+    
+    def _cache_version(self, state: _IndexState) -> Tuple[int, Optional[str]]:
+        """结果缓存的版本：索引版本加向量索引签名，向量就绪后缓存的纯词法结果随之失效"""
+        return state.version, self._semantic_signature
+    
+    def vector_signature(self, state: Optional[_IndexState] = None) -> str:
+        """向量索引对应的内容签名：文件集合、分词器和向量参数"""
+        state = state or self._state
+        return hashlib.md5(f"{self.files_etag(state)}:{self.tokenizer.signature}:"
+                           f"{HANDBOOK_VECTOR_DIM}:{HANDBOOK_VECTOR_VOCAB}".encode('utf-8')).hexdigest()[:16]
+    
+    def ensure_vectors(self, background: bool = True):
+        """使向量索引与当前索引一致。后台构建期间继续使用旧向量；
+        构建过程中索引又有变化时，构建完成后再更新一次。background为False时等待构建完成"""
+        if not (NUMPY_AVAILABLE and HANDBOOK_VECTORS):
+            return
+        with self._semantic_lock:
+            if self._semantic_building:
+                self._semantic_pending = True
+                building_elsewhere = True
+            else:
+                self._semantic_building = True
+                self._semantic_idle.clear()
+                building_elsewhere = False
+                if background:
+                    threading.Thread(target=self._refresh_vectors, name='handbook-vectors', daemon=True).start()
+                    return
+        if building_elsewhere:
+            if not background:
+                self._semantic_idle.wait()
+            return
+        self._refresh_vectors()
+    
+    def _refresh_vectors(self):
+        while True:
+            state = self._state
+            signature = self.vector_signature(state)
+            if signature != self._semantic_signature:
+                try:
+                    self._build_vectors(state, signature)
+                except Exception as e:
+                    logger.error(f"构建向量索引失败: {e}")
+            with self._semantic_lock:
+                if not self._semantic_pending:
+                    self._semantic_building = False
+                    self._semantic_idle.set()
+                    return
+                self._semantic_pending = False
+    
+    def _build_vectors(self, state: _IndexState, signature: str):
+        """优先加载快照旁保存的向量索引，签名不一致时重新计算"""
+        vector_path = self.snapshot_path.with_suffix('.npy') if self.snapshot_path else None
+        semantic = SemanticIndex.load(vector_path, signature) if vector_path else None
+        if semantic is None:
+            start_time = time.perf_counter()
+            semantic = SemanticIndex.build(state.inverted_index, list(state.sections),
+                                           HANDBOOK_VECTOR_DIM, HANDBOOK_VECTOR_VOCAB, signature)
+            if semantic is not None:
+                logger.info(f"向量索引构建耗时 {time.perf_counter() - start_time:.2f}s"
+                            f"（{len(semantic.section_keys)} 个章节，{semantic.components.shape[1]} 维）")
+                if vector_path:
+                    semantic.save(vector_path)
+        self.semantic = semantic
+        self._semantic_signature = signature
+    
+    def semantic_rank(self, query: str, top_k: int = 5,
+                      state: Optional[_IndexState] = None) -> List[Tuple[str, float]]:
+        """按LSA向量的余弦相似度排序章节；向量未就绪时返回空列表"""
+        semantic = self.semantic
+        if semantic is None:
+            return []
+        state = state or self._state
+        terms = self.tokenizer.tokenize(query)
+        # 多取一些，过滤掉向量构建后已被删除的章节
+        hits = semantic.search([terms], top_k=top_k * 2)[0]
+        return [(section_key, score) for section_key, score in hits if section_key in state.sections][:top_k]
+    
+    def hybrid_rank(self, query: str, top_k: int = 5,
+                    state: Optional[_IndexState] = None) -> List[Tuple[str, float]]:
+        """BM25排序与向量检索按倒数排名融合；向量未就绪时等同于rank_sections"""
+        state = state or self._state
+        lexical = self.rank_sections(query, top_k=top_k * 2, state=state)
+        semantic = self.semantic_rank(query, top_k=top_k * 2, state=state)
+        if not semantic:
+            return lexical[:top_k]
+        
+        fused = {}
+        for ranking, weight in ((lexical, 1.0), (semantic, SEMANTIC_WEIGHT)):
+            for rank, (section_key, _) in enumerate(ranking):
+                fused[section_key] = fused.get(section_key, 0.0) + weight / (RRF_K + rank + 1)
+        return heapq.nlargest(top_k, fused.items(), key=lambda item: item[1])
+    
+    def _section_snippet(self, content: str, query_lower: str, terms: List[str]) -> str:
+        """从章节中挑选与查询最相关的段落"""
+        scored = []
+        for para in content.split('\n'):
+            para_lower = para.lower()
+            if query_lower in para_lower:
+                hits = len(terms) + 1
+            else:
+                hits = sum(1 for term in terms if term in para_lower)
+            if hits:
+                scored.append((hits, re.sub(r'\s+', ' ', para).strip()))
+        
+        best = [para for hits, para in sorted(scored, key=lambda item: item[0], reverse=True)[:2]]
+        return ' '.join(best) if best else content[:200]
+    
+    def cached_search(self, name: str, query: str, compute, *params):
+        """通过检索结果缓存执行查询，键为查询类型、归一化查询、参数和索引版本"""
+        return self.query_cache.get_or_compute(
+            self._cache_version(self._state), (name, normalize_query(query)) + params, compute)
     
     def search_with_images(self, query: str, max_results: int = 5) -> Dict:
-        """搜索内容并返回相关图片"""
+        """搜索内容并返回相关图片（结果经缓存共享，调用方不应修改）"""
+        state = self._state
+        return self.query_cache.get_or_compute(
+            self._cache_version(state), ('search_with_images', normalize_query(query), max_results),
+            lambda: self._search_with_images(query, max_results, state))
+    
+    def _search_with_images(self, query: str, max_results: int, state: _IndexState,
+                            fuzzy: bool = True) -> Dict:
+        """搜索内容并返回相关图片，文本和章节结果按BM25得分排序"""
         results = {
             'text_results': [],
             'image_results': [],
@@ -288,115 +1170,255 @@ class MarkdownHandbook:
         }
         
         query_lower = query.lower()
+        terms = self.tokenizer.tokenize(query)
+        ranked = self.hybrid_rank(query, top_k=max_results * 3, state=state)
+        top_score = ranked[0][1] if ranked else 0.0
         
-        # 1. 搜索章节
-        for section_key, content in self.sections.items():
-            if query_lower in section_key.lower() or query_lower in content.lower():
-                # 提取文件名和章节名
-                if '#' in section_key:
-                    file_part, section_part = section_key.split('#', 1)
-                    # 提取相关段落
-                    paragraphs = content.split('\n')
-                    relevant_content = []
-                    
-                    for para in paragraphs:
-                        if query_lower in para.lower():
-                            clean_para = re.sub(r'\s+', ' ', para).strip()
-                            if len(clean_para) > 30:
-                                relevant_content.append(clean_para)
-                    
-                    if relevant_content:
-                        results['sections'].append({
-                            'file': file_part,
-                            'title': section_part,
-                            'content': ' '.join(relevant_content[:2]),
-                            'full_content': content[:1000]
-                        })
+        # 1. 章节结果
+        for section_key, score in ranked[:max_results]:
+            span = state.sections[section_key]
+            content = self.section_text(section_key, state)
+            results['sections'].append({
+                'file': span.file,
+                'title': span.title,
+                'content': self._section_snippet(content, query_lower, terms),
+                'full_content': content[:1000],
+                'score': round(score, 4),
+                'start': span.start,
+                'line': self._line_number(span.file, span.start, state)
+            })
         
-        # 2. 搜索关键词索引
-        for keyword in query_lower.split():
-            if keyword in self.content_index:
-                for item in self.content_index[keyword][:max_results]:
-                    results['text_results'].append({
-                        'type': 'keyword',
-                        'keyword': keyword,
-                        'content': item.get('context', item.get('content', '')),
-                        'file': item.get('file', ''),
-                        'relevance': item.get('relevance', 'medium')
-                    })
+        # 2. 文本结果：每个文件取得分最高的章节
+        seen_files = set()
+        for section_key, score in ranked:
+            span = state.sections[section_key]
+            if span.file in seen_files:
+                continue
+            seen_files.add(span.file)
+            
+            content = self.section_text(section_key, state)
+            content_lower = content.lower()
+            anchor = query if query_lower in content_lower else next(
+                (term for term in terms if term in content_lower), query)
+            context_start, context_end = self._context_span(content, anchor, 300) or (0, 300)
+            # 命中位置换算为文件内偏移和行号，引用时无需再扫描全文
+            start = span.start + context_start
+            results['text_results'].append({
+                'type': 'keyword',
+                'keyword': query,
+                'content': content[context_start:context_end],
+                'file': span.file,
+                'section': span.title,
+                'relevance': 'high' if score >= top_score / 2 else 'medium',
+                'score': round(score, 4),
+                'start': start,
+                'end': span.start + min(context_end, len(content)),
+                'line': self._line_number(span.file, start, state)
+            })
+            if len(results['text_results']) >= max_results:
+                break
         
         # 3. 搜索相关图片
-        for keyword in query_lower.split():
-            if keyword in self.image_index:
-                for image_key in self.image_index[keyword][:3]:
-                    if image_key in self.images_cache:
-                        image_info = self.images_cache[image_key]
+        for keyword in dict.fromkeys(terms):
+            if keyword in state.image_index:
+                for image_key in state.image_index[keyword][:3]:
+                    if image_key in state.images_cache:
+                        image_info = state.images_cache[image_key]
+                        blob = state.image_blobs.get(image_info.get('hash'), {})
                         results['image_results'].append({
                             'key': image_key,
                             'caption': image_info['title'],
-                            'base64': image_info.get('base64'),
                             'url': image_info.get('url'),
                             'file': image_info['file'],
                             'related_keyword': keyword,
-                            'type': image_info['type']
+                            'type': image_info['type'],
+                            'width': blob.get('width'),
+                            'height': blob.get('height')
                         })
         
         # 如果没有直接结果，尝试模糊匹配
-        if not results['text_results'] and not results['image_results']:
-            results = self._fuzzy_search(query)
+        if fuzzy and not results['text_results'] and not results['image_results']:
+            results = self._fuzzy_search(query, max_results, state)
         
         return results
     
-    def _fuzzy_search(self, query: str) -> Dict:
-        """模糊搜索"""
+    def _get_fuzzy_index(self, state: _IndexState) -> FuzzyTermIndex:
+        """按索引版本惰性构建纠错词典"""
+        cached = self._fuzzy_index
+        if cached and cached[0] == state.version:
+            return cached[1]
+        terms = {term: len(section_postings) for term, section_postings in state.inverted_index.items()}
+        for term, term_freqs in state.title_index.items():
+            terms.setdefault(term, len(term_freqs))
+        fuzzy_index = FuzzyTermIndex(terms.items())
+        self._fuzzy_index = (state.version, fuzzy_index)
+        return fuzzy_index
+    
+    def suggest(self, query: str, state: Optional[_IndexState] = None) -> Tuple[Optional[str], Dict[str, List[str]]]:
+        """拼写纠错：返回(“您是不是要找”的查询, 每个未知词的候选词)"""
+        state = state or self._state
+        terms = self.tokenizer.tokenize(query)
+        if not terms:
+            return None, {}
+        corrected, suggestions = self._get_fuzzy_index(state).suggest(terms)
+        return (' '.join(corrected) if corrected else None), suggestions
+    
+    def _fuzzy_search(self, query: str, max_results: int = 5, state: Optional[_IndexState] = None) -> Dict:
+        """模糊搜索：先按纠错后的查询检索，仍无结果时查找原样出现的子串"""
+        state = state or self._state
+        did_you_mean, suggestions = self.suggest(query, state)
+        if did_you_mean:
+            results = self._search_with_images(did_you_mean, max_results, state, fuzzy=False)
+            if results['text_results'] or results['image_results']:
+                for result in results['text_results']:
+                    result['type'] = 'fuzzy'
+                results['did_you_mean'] = did_you_mean
+                results['suggestions'] = suggestions
+                return results
+        
         results = {
             'text_results': [],
             'image_results': [],
             'sections': []
         }
         
-        # 在所有文本中搜索
-        for file_key, text in self.text_cache.items():
-            if query.lower() in text.lower():
-                context = self._get_context(text, query, 300)
-                results['text_results'].append({
-                    'type': 'full_text',
-                    'content': context,
-                    'file': file_key,
-                    'relevance': 'medium'
-                })
+        # 子串查找（由n-gram索引筛选候选文件）
+        for file_key, positions in self.find_phrase(query, max_per_file=1, state=state)[:max_results]:
+            context = self._get_context(state.text_cache[file_key], query, 300)
+            results['text_results'].append({
+                'type': 'full_text',
+                'content': context,
+                'file': file_key,
+                'relevance': 'medium'
+            })
         
         return results
     
     def get_relevant_images(self, topic: str, limit: int = 3) -> List[Dict]:
         """获取特定主题的相关图片"""
+        state = self._state
         images = []
         
         # 从图片索引中查找
-        for keyword in topic.lower().split():
-            if keyword in self.image_index:
-                for image_key in self.image_index[keyword][:limit]:
-                    if image_key in self.images_cache:
-                        images.append(self.images_cache[image_key])
+        for keyword in dict.fromkeys(self.tokenizer.tokenize(topic)):
+            if keyword in state.image_index:
+                for image_key in state.image_index[keyword][:limit]:
+                    if image_key in state.images_cache:
+                        images.append(state.images_cache[image_key])
         
         # 如果没有找到，返回README文件中的图片
         if not images:
-            for key, img in self.images_cache.items():
-                if 'README' in img['file']:
-                    images.append(img)
-                    if len(images) >= limit:
-                        break
+            for file_key, file_images in state.file_images.items():
+                if 'README' not in file_key:
+                    continue
+                images.extend(list(file_images.values())[:limit - len(images)])
+                if len(images) >= limit:
+                    break
         
         return images
     
+    def get_page_images(self, page_num: int) -> List[Dict]:
+        """获取指定页面的所有图片（为兼容性保留）"""
+        return []
+    
+    def find_phrase(self, phrase: str, max_per_file: int = 3,
+                    state: Optional[_IndexState] = None) -> List[Tuple[str, List[int]]]:
+        """不区分大小写的子串查找，返回 (文件键, 命中位置列表)"""
+        return list(self.iter_phrase(phrase, max_per_file, state))
+    
+    def iter_phrase(self, phrase: str, max_per_file: int = 3,
+                    state: Optional[_IndexState] = None) -> Iterator[Tuple[str, List[int]]]:
+        """逐个文件产出子串命中。先用n-gram索引求出同时包含查询全部n-gram的候选文件
+        （短于n-gram的查询取字符集合中含有查询全部字符的文件），再在小写文本上核实"""
+        state = state or self._state
+        phrase_lower = phrase.lower()
+        if not phrase_lower:
+            return
+        
+        if len(phrase_lower) >= NGRAM_SIZE:
+            # 从最少见的n-gram开始求交集，候选集合很快缩小
+            grams = sorted(text_ngrams(phrase_lower),
+                           key=lambda gram: len(state.ngram_index.get(gram, ())))
+            candidates = set(state.ngram_index.get(grams[0], ()))
+            for gram in grams[1:]:
+                if not candidates:
+                    break
+                candidates &= state.ngram_index.get(gram, set())
+            file_keys = sorted(candidates)
+        else:
+            file_keys = [file_key for file_key, chars in state.file_chars.items()
+                         if all(ch in chars for ch in phrase_lower)]
+        
+        for file_key in file_keys:
+            text_lower = state.lower_cache[file_key]
+            if len(text_lower) != len(state.text_cache[file_key]):
+                # 小写后长度变化的文本位置无法对应原文，改用正则在原文上查找
+                positions = [m.start() for m in re.finditer(
+                    re.escape(phrase), state.text_cache[file_key], re.IGNORECASE)][:max_per_file]
+            else:
+                positions = []
+                pos = text_lower.find(phrase_lower)
+                while pos != -1 and len(positions) < max_per_file:
+                    positions.append(pos)
+                    pos = text_lower.find(phrase_lower, pos + len(phrase_lower))
+            if positions:
+                yield file_key, positions
+    
+    def markdown_hits(self, query: str) -> Dict:
+        """文档搜索的全部命中（不含上下文和高亮），按得分排序并经结果缓存共享。
+        子串命中记录位置；没有子串命中时改用章节排序，必要时先做拼写纠错"""
+        state = self._state
+        return self.query_cache.get_or_compute(
+            self._cache_version(state), ('markdown_hits', query.lower()),
+            lambda: self._markdown_hits(query, state))
+    
+    def _markdown_hits(self, query: str, state: _IndexState) -> Dict:
+        hits = [self.phrase_hit(file_key, position, query, state)
+                for file_key, positions in self.iter_phrase(query, max_per_file=3, state=state)
+                for position in positions]
+        
+        did_you_mean = None
+        if not hits:
+            ranked = self.rank_sections(query, top_k=50, state=state)
+            if not ranked:
+                did_you_mean, _ = self.suggest(query, state)
+                if did_you_mean:
+                    ranked = self.rank_sections(did_you_mean, top_k=50, state=state)
+            hits = [self.section_hit(section_key, score, state) for section_key, score in ranked]
+        
+        hits.sort(key=lambda hit: hit['score'], reverse=True)
+        return {
+            'hits': hits,
+            'did_you_mean': did_you_mean,
+            'terms': self.tokenizer.tokenize(did_you_mean or query)
+        }
+    
+    @staticmethod
+    def phrase_hit(file_key: str, position: int, query: str, state: _IndexState) -> Dict:
+        """子串命中；得分为查询长度占上下文窗口（前后各100字符）的比例"""
+        text_length = len(state.text_cache[file_key])
+        window = min(text_length, position + len(query) + 100) - max(0, position - 100)
+        return {'file': file_key, 'position': position, 'score': len(query) / window}
+    
+    @staticmethod
+    def section_hit(section_key: str, score: float, state: _IndexState) -> Dict:
+        """章节排序命中"""
+        span = state.sections[section_key]
+        return {'file': span.file, 'section_key': section_key, 'position': span.start, 'score': score}
+    
     def search_exact_content(self, exact_phrase: str) -> List[Dict]:
-        """精确短语搜索"""
+        """精确短语搜索（结果经缓存共享，调用方不应修改）"""
+        state = self._state
+        return self.query_cache.get_or_compute(
+            self._cache_version(state), ('search_exact_content', exact_phrase),
+            lambda: self._search_exact_content(exact_phrase, state))
+    
+    def _search_exact_content(self, exact_phrase: str, state: _IndexState) -> List[Dict]:
         results = []
         
-        for file_key, text in self.text_cache.items():
-            positions = [m.start() for m in re.finditer(re.escape(exact_phrase), text, re.IGNORECASE)]
-            
-            for pos in positions[:3]:
+        for file_key, positions in self.find_phrase(exact_phrase, state=state):
+            text = state.text_cache[file_key]
+            for pos in positions:
                 start = max(0, pos - 100)
                 end = min(len(text), pos + len(exact_phrase) + 100)
                 context = text[start:end]
@@ -410,11 +1432,29 @@ class MarkdownHandbook:
         
         return results
     
-    def generate_citation(self, content: str, max_length: int = 500) -> str:
-        """生成引用格式的内容"""
+    def _line_number(self, file_key: str, offset: int, state: Optional[_IndexState] = None) -> int:
+        """文件内偏移对应的行号（从1开始）"""
+        state = state or self._state
+        return state.text_cache[file_key].count('\n', 0, offset) + 1
+    
+    @staticmethod
+    def citation_anchor(hit: Dict) -> str:
+        """检索结果的定位锚点：文件#L行号"""
+        return f"{hit['file']}#L{hit['line']}" if hit.get('line') else hit.get('file', '')
+    
+    def generate_citation(self, content: str, max_length: int = 500, hit: Optional[Dict] = None) -> str:
+        """生成引用格式的内容；传入检索结果时直接使用其中的文件、章节和行号"""
         if not content:
             return ""
         
+        if hit and hit.get('file'):
+            location = hit['file']
+            if hit.get('section'):
+                location += f" · {hit['section']}"
+            if hit.get('line'):
+                location += f" (第{hit['line']}行)"
+            return f"《Python-100-Days》{location}: {content[:max_length]}..."
+        
         # 在所有文件中查找
         for file_key, text in self.text_cache.items():
             if content[:100] in text:
@@ -425,12 +1465,65 @@ class MarkdownHandbook:
         # 如果没找到，返回原始内容
         return content[:max_length] + "..."
     
+    def list_files(self) -> List[Dict]:
+        """按路径排序的文件元数据列表"""
+        state = self._state
+        return [state.file_meta[file_key] for file_key in sorted(state.file_meta)]
+    
+    def get_file_meta(self, file_key: str) -> Optional[Dict]:
+        return self._state.file_meta.get(file_key.replace('\\', '/'))
+    
+    def get_file_images(self, file_key: str) -> List[Dict]:
+        """指定文件引用的图片"""
+        file_images = self._state.file_images.get(file_key.replace('\\', '/'), {})
+        return [dict(image_info, key=image_key) for image_key, image_info in file_images.items()]
+    
+    def files_etag(self, state: Optional[_IndexState] = None) -> str:
+        """文件列表的ETag，由各文件的ETag组合而成，每个索引版本只计算一次"""
+        state = state or self._state
+        cached = self._files_etag
+        if cached and cached[0] == state.version:
+            return cached[1]
+        digest = hashlib.md5()
+        for file_key in sorted(state.file_meta):
+            digest.update(state.file_meta[file_key]['etag'].encode('utf-8'))
+        etag = digest.hexdigest()[:16]
+        self._files_etag = (state.version, etag)
+        return etag
+    
     def get_file_content(self, file_path: str) -> Optional[str]:
-        """获取指定文件的内容"""
+        """获取指定文件的内容，已索引的文件直接返回缓存文本"""
+        text = self._state.text_cache.get(file_path.replace('\\', '/'))
+        if text is not None:
+            return text
         try:
             full_path = self.base_path / file_path
             if full_path.exists():
                 return full_path.read_text(encoding='utf-8', errors='ignore')
         except:
             pass
-        return None
\ No newline at end of file
+        return None
+
+
+# 并行索引：每个工作进程持有一个不加载文件的手册实例，只负责把文件解析成索引片段
+_worker_handbook: Optional[MarkdownHandbook] = None
+
+
+def _index_mp_context():
+    """索引进程池的启动方式。索引可能在监视线程、向量构建线程和Flask线程运行时启动，
+    fork会复制其他线程持有的锁（包括logging的锁）导致子进程死锁，因此使用forkserver（不支持时用spawn）。
+    这两种方式会在子进程中以 __mp_main__ 重新导入主模块，主模块的初始化代码需要跳过这种情况"""
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def _init_index_worker(base_path: str, tokenizer: Tokenizer):
+    global _worker_handbook
+    _worker_handbook = MarkdownHandbook(base_path, tokenizer=tokenizer, load=False)
+
+
+def _index_in_worker(md_path: Path) -> Tuple[Path, Optional[Dict], Dict[str, float]]:
+    timings = {}
+    fragment = _worker_handbook._index_file(md_path, timings)
+    return md_path, fragment, timings
+
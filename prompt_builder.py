@@ -0,0 +1,203 @@
+# prompt_builder.py
+import hashlib
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from handbook_tokenizer import Tokenizer, get_tokenizer
+
+logger = logging.getLogger(__name__)
+
+# 可选：tiktoken按模型的BPE词表计数，未安装时按字符类别估算
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+# 手册检索结果中的图片：图像标记块、Markdown图片和裸露的data URI
+IMAGE_BLOCK = re.compile(r'\[IMAGE:([^\]]*)\]\s*(\S*?)\s*\[/IMAGE\]', re.DOTALL)
+MARKDOWN_IMAGE = re.compile(r'!\[([^\]]*)\]\(([^)\s]*)(?:\s+"[^"]*")?\)')
+DATA_URI = re.compile(r'data:image/[\w.+-]+;base64,[A-Za-z0-9+/=\s]+')
+# 估算token数：中文每字一个，英文单词和数字约每4个字符一个，其余符号各一个
+ESTIMATE_PATTERN = re.compile(r'[\u4e00-\u9fff]|[A-Za-z]+|\d+|\S')
+# 片段截断时优先在句末断开
+SENTENCE_END = re.compile(r'[。！？.!?\n]')
+# tiktoken词表的下载地址；tiktoken按地址的SHA-1在缓存目录中查找已下载的词表
+TIKTOKEN_BLOB_URL = 'https://openaipublic.blob.core.windows.net/encodings/{encoding}.tiktoken'
+# 工具输出截断后追加的说明
+OUTPUT_TRUNCATED = '\n…（输出过长，以下内容已省略）'
+
+
+def image_reference(caption: str, url: str) -> str:
+    """图片的简短文字引用：标题加地址，内嵌的base64数据只保留标题"""
+    caption = caption.strip() or '图片'
+    if not url or url.startswith('data:'):
+        return f"[图片: {caption}]"
+    return f"[图片: {caption}（{url}）]"
+
+
+def strip_images(text: str) -> str:
+    """把图像标记、Markdown图片和base64数据替换为简短的文字引用"""
+    text = IMAGE_BLOCK.sub(lambda m: image_reference(m.group(1), m.group(2)), text)
+    text = MARKDOWN_IMAGE.sub(lambda m: image_reference(m.group(1), m.group(2)), text)
+    return DATA_URI.sub('[图片数据已省略]', text)
+
+
+def tiktoken_cache_file(cache_dir, encoding: str) -> Path:
+    """tiktoken缓存目录中该编码词表的文件路径（与tiktoken的缓存命名一致）"""
+    url = TIKTOKEN_BLOB_URL.format(encoding=encoding)
+    return Path(cache_dir) / hashlib.sha1(url.encode()).hexdigest()
+
+
+class TokenCounter:
+    """本地计算token数。安装tiktoken且词表已在本地缓存目录中时精确计数，否则估算（偏保守）。
+    不会联网下载词表：缓存目录中没有词表时直接使用估算"""
+
+    def __init__(self, encoding: str = 'cl100k_base', cache_dir=None):
+        self._encoding = None
+        if not TIKTOKEN_AVAILABLE:
+            return
+        # 环境变量TIKTOKEN_CACHE_DIR优先，与tiktoken自身的约定一致
+        cache_dir = os.environ.get('TIKTOKEN_CACHE_DIR') or cache_dir
+        if not cache_dir or not tiktoken_cache_file(cache_dir, encoding).exists():
+            logger.info(f"本地没有tiktoken编码 {encoding} 的词表缓存（{cache_dir}），token数按字符估算")
+            return
+        os.environ['TIKTOKEN_CACHE_DIR'] = str(cache_dir)
+        try:
+            self._encoding = tiktoken.get_encoding(encoding)
+        except Exception as e:
+            logger.warning(f"tiktoken编码 {encoding} 加载失败，改用估算: {e}")
+
+    @property
+    def exact(self) -> bool:
+        return self._encoding is not None
+
+    def count(self, text: Optional[str]) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return sum(len(piece) // 4 + 1 if piece[0].isalnum() and piece.isascii() else 1
+                   for piece in ESTIMATE_PATTERN.findall(text))
+
+
+class PromptBuilder:
+    """按token预算组装提示词中的手册上下文。
+
+    图片替换为文字引用后，把上下文按段落切成片段，按与问题的关键词重合度排序，
+    在预算内依次选入，放不下的片段截断；选中的片段保持原文顺序。
+    工具输出不参与排序，超出预算时只截去末尾（fit_output）。
+    """
+
+    def __init__(self, budget: int = 6000, counter: Optional[TokenCounter] = None,
+                 tokenizer: Optional[Tokenizer] = None):
+        self.budget = budget
+        self.counter = counter or TokenCounter()
+        self.tokenizer = tokenizer or get_tokenizer()
+
+    def count(self, text: Optional[str]) -> int:
+        return self.counter.count(text)
+
+    def _snippets(self, text: str) -> List[str]:
+        """按空行切分片段，标题与其后的第一段合并，避免只选入标题"""
+        snippets, heading = [], ''
+        for block in re.split(r'\n\s*\n', text):
+            block = block.strip()
+            if not block:
+                continue
+            if block.startswith('#') and '\n' not in block:
+                heading = f"{heading}\n{block}" if heading else block
+                continue
+            snippets.append(f"{heading}\n{block}" if heading else block)
+            heading = ''
+        if heading:
+            snippets.append(heading)
+        return snippets
+
+    def _truncate(self, snippet: str, budget: int) -> str:
+        """把片段截到预算以内，尽量在句末断开"""
+        if budget <= 0:
+            return ''
+        low, high = 0, len(snippet)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count(snippet[:middle]) + 1 <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        text = snippet[:low]
+        ends = list(SENTENCE_END.finditer(text))
+        if ends and ends[-1].end() > len(text) // 2:
+            text = text[:ends[-1].end()]
+        return text.rstrip() + '…' if text.strip() else ''
+
+    def fit_context(self, question: str, context: Optional[str], reserved: int = 0) -> Tuple[Optional[str], Dict]:
+        """把上下文压缩到预算内：预算扣除reserved（系统提示词和问题等固定部分）后留给上下文。
+        返回(压缩后的上下文, 统计)"""
+        if not context:
+            return context, {'before': 0, 'after': 0, 'available': max(self.budget - reserved, 0)}
+        available = max(self.budget - reserved, 0)
+        before = self.count(context)
+        stripped = strip_images(context)
+        snippets = self._snippets(stripped)
+        costs = [self.count(snippet) for snippet in snippets]
+
+        if sum(costs) + len(snippets) <= available:
+            chosen = dict(enumerate(snippets))
+        else:
+            # 按与问题的关键词重合度排序，重合度相同时靠前的片段优先
+            terms = set(self.tokenizer.tokenize(question))
+            scores = [len(terms & set(self.tokenizer.tokenize(snippet))) for snippet in snippets]
+            order = sorted(range(len(snippets)), key=lambda i: (-scores[i], i))
+            chosen, remaining = {}, available
+            for i in order:
+                if costs[i] + 1 <= remaining:
+                    chosen[i] = snippets[i]
+                    remaining -= costs[i] + 1
+                elif scores[i] and remaining > 32:
+                    # 相关但放不下的片段截断后选入
+                    truncated = self._truncate(snippets[i], remaining - 1)
+                    if truncated:
+                        chosen[i] = truncated
+                        remaining -= self.count(truncated) + 1
+
+        fitted = '\n\n'.join(chosen[i] for i in sorted(chosen))
+        after = self.count(fitted)
+        stats = {
+            'before': before,
+            'after': after,
+            'available': available,
+            'snippets': len(snippets),
+            'kept': len(chosen),
+            'exact': self.counter.exact
+        }
+        return fitted or None, stats
+
+    def fit_output(self, output: Optional[str], reserved: int = 0) -> Tuple[Optional[str], Dict]:
+        """把工具输出压缩到预算内：不重新排序，按原文顺序保留开头部分，尽量在行末断开。
+        返回(压缩后的输出, 统计)"""
+        available = max(self.budget - reserved, 0)
+        before = self.count(output)
+        stats = {'before': before, 'after': before, 'available': available,
+                 'truncated': False, 'exact': self.counter.exact}
+        if not output or before <= available:
+            return output, stats
+        budget = available - self.count(OUTPUT_TRUNCATED)
+        low, high = 0, len(output)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count(output[:middle]) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        kept = output[:low]
+        line_end = kept.rfind('\n')
+        if line_end > len(kept) // 2:
+            kept = kept[:line_end]
+        fitted = kept.rstrip() + OUTPUT_TRUNCATED
+        stats.update(after=self.count(fitted), truncated=True)
+        return fitted, stats
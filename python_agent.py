@@ -3,21 +3,55 @@ from langchain.tools import tool
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
+from answer_cache import AnswerCache, content_hash, normalize_question
+from config import (ANSWER_CACHE_ENABLED, ANSWER_CACHE_MAX_BYTES, ANSWER_CACHE_NEAR_DUPLICATE, ANSWER_CACHE_PATH,
+                    ANSWER_CACHE_SIMILARITY, ANSWER_CACHE_TTL, PROMPT_TOKEN_BUDGET, PROMPT_TOKEN_CACHE_DIR,
+                    PROMPT_TOKEN_ENCODING)
+from handbook_corpora import get_shared_corpora
+from handbook_matcher import KeywordMatcher
+from prompt_builder import PromptBuilder, TokenCounter
+from single_flight import AsyncSingleFlight, SingleFlight
 import ast
+import asyncio
 import subprocess
 import sys
 import re
 import os
-from typing import Optional, List, Dict, Set
+from typing import Optional, List, Dict, Set, Tuple, Generator, AsyncIterator
 import logging
 from itertools import chain
-import base64
-import hashlib
-from pathlib import Path
 
 CODE_FENCE_BLOCK = re.compile(r'```(?:python)?\s*([\s\S]+?)\s*```', re.IGNORECASE)
 BUILTIN_SYMBOLS = set(dir(__builtins__)) | {"self", "cls"}
 
+# 解释工具执行结果时使用的系统提示词
+TOOL_SYSTEM_PROMPT = "你是一个Python编程助手，请基于工具执行结果和《Python-100-Days》给用户提供专业、完整的回答。"
+# 提示词模板中除系统提示词、问题和上下文之外的固定文字（约数）
+PROMPT_TEMPLATE_TOKENS = 64
+
+# 需要查阅手册的问题：基础概念问法和具体技术术语
+BASIC_CONCEPTS = (
+    '是什么', '什么是', '定义', '概念', '介绍', '讲解', '说明', '含义',
+    '怎么理解', '如何理解', '什么意思', '有什么区别', '有什么不同',
+    '优点', '缺点', '特点', '特征', '特性'
+)
+TECHNICAL_TERMS = (
+    '装饰器', '生成器', '迭代器', '上下文管理器', '元类', '描述符',
+    'GIL', '垃圾回收', '内存管理', '多线程', '多进程', '协程',
+    '异步', 'await', 'async', '列表推导', '字典推导', '集合推导',
+    'lambda', '闭包', '作用域', '命名空间', '模块', '包'
+)
+HANDBOOK_QUESTION_MATCHER = KeywordMatcher(BASIC_CONCEPTS + TECHNICAL_TERMS)
+
+# 工具意图的触发词，按优先级排列
+TOOL_INTENT_WORDS = {
+    'enhanced_handbook_search': ('是什么', '什么是', '定义', '概念', '介绍', '讲解', '说明', '含义'),
+    'code_executor': ('执行', '运行', '运行代码', '执行代码', 'test', 'run'),
+    'syntax_checker': ('语法', '语法检查', '语法错误', 'syntax'),
+    'code_analyzer': ('分析', '优化', '改进', '代码分析', 'analyze'),
+}
+TOOL_INTENT_MATCHER = KeywordMatcher(chain.from_iterable(TOOL_INTENT_WORDS.values()))
+
 def _extract_code_snippet(code: str) -> str:
     """Normalize incoming code by stripping Markdown fences and whitespace."""
     if not code:
@@ -283,411 +317,6 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-# Markdown处理器类
-class MarkdownHandbook:
-    """Markdown文档处理器，支持搜索Python-100-Days文件夹中的Markdown文件"""
-    
-    def __init__(self, base_path: str):
-        self.base_path = Path(base_path)
-        self.md_files = []  # 所有Markdown文件路径
-        self.content_index = {}  # 关键词到位置的索引
-        self.image_index = {}    # 图片到内容的映射
-        self.sections = {}       # 文件章节结构
-        self.text_cache = {}     # 文件文本缓存
-        self.images_cache = {}   # 图片缓存（本地图片）
-        self.load_markdown_files()
-        
-    def load_markdown_files(self):
-        """加载所有Markdown文件"""
-        try:
-            # 遍历文件夹，找到所有.md文件
-            for md_file in self.base_path.rglob("*.md"):
-                self.md_files.append(md_file)
-                self._index_file(md_file)
-            
-            logger.info(f"加载了 {len(self.md_files)} 个Markdown文件")
-            self._build_global_index()
-            
-        except Exception as e:
-            logger.error(f"加载Markdown文件失败: {e}")
-    
-    def _index_file(self, md_path: Path):
-        """索引单个Markdown文件"""
-        try:
-            # 读取Markdown文件内容
-            content = md_path.read_text(encoding='utf-8', errors='ignore')
-            
-            # 相对路径作为键
-            rel_path = str(md_path.relative_to(self.base_path))
-            file_key = rel_path.replace('\\', '/')
-            
-            # 缓存文本内容
-            self.text_cache[file_key] = content
-            
-            # 提取章节结构
-            self._parse_sections(file_key, content)
-            
-            # 提取图片信息
-            self._extract_images(file_key, content, md_path)
-            
-            # 提取关键词
-            keywords = self._extract_keywords(content)
-            for keyword in keywords:
-                if keyword not in self.content_index:
-                    self.content_index[keyword] = []
-                self.content_index[keyword].append({
-                    'file': file_key,
-                    'content': content[:500],  # 截取前500字符
-                    'relevance': 'high'
-                })
-                
-        except Exception as e:
-            logger.error(f"索引文件 {md_path} 失败: {e}")
-    
-    def _parse_sections(self, file_key: str, content: str):
-        """解析Markdown文件的章节结构"""
-        lines = content.split('\n')
-        current_section = "简介"
-        section_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            
-            # 检测Markdown标题（# 到 ######）
-            if line.startswith('#'):
-                # 保存上一个章节
-                if section_lines:
-                    section_key = f"{file_key}#{current_section}"
-                    self.sections[section_key] = '\n'.join(section_lines)
-                
-                # 提取新章节标题
-                # 移除#号和空格
-                current_section = line.lstrip('#').strip()
-                section_lines = []
-            else:
-                section_lines.append(line)
-        
-        # 保存最后一个章节
-        if section_lines:
-            section_key = f"{file_key}#{current_section}"
-            self.sections[section_key] = '\n'.join(section_lines)
-    
-    def _extract_images(self, file_key: str, content: str, md_path: Path):
-        """提取Markdown中的图片信息"""
-        try:
-            # 使用正则表达式匹配Markdown图片语法
-            # ![alt text](image_url "title")
-            img_pattern = r'!\[(.*?)\]\((.*?)(?:\s+"(.*?)")?\)'
-            
-            for match in re.finditer(img_pattern, content, re.IGNORECASE):
-                alt_text = match.group(1) or "图片"
-                img_url = match.group(2)
-                title = match.group(3) or alt_text
-                
-                # 处理图片路径
-                if img_url.startswith('http'):
-                    # 网络图片，直接使用URL
-                    img_key = f"web_{hashlib.md5(img_url.encode()).hexdigest()[:8]}"
-                    self.images_cache[img_key] = {
-                        'type': 'web',
-                        'url': img_url,
-                        'alt': alt_text,
-                        'title': title,
-                        'file': file_key,
-                        'base64': None  # 网络图片不转换为base64
-                    }
-                else:
-                    # 本地图片，需要处理相对路径
-                    img_path = self._resolve_image_path(img_url, md_path)
-                    if img_path and img_path.exists():
-                        # 转换为base64
-                        try:
-                            img_bytes = img_path.read_bytes()
-                            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-                            
-                            # 确定MIME类型
-                            ext = img_path.suffix.lower()
-                            mime_types = {
-                                '.png': 'image/png',
-                                '.jpg': 'image/jpeg',
-                                '.jpeg': 'image/jpeg',
-                                '.gif': 'image/gif',
-                                '.bmp': 'image/bmp',
-                                '.webp': 'image/webp'
-                            }
-                            mime_type = mime_types.get(ext, 'image/jpeg')
-                            
-                            img_key = f"local_{hashlib.md5(img_path.read_bytes()).hexdigest()[:8]}"
-                            self.images_cache[img_key] = {
-                                'type': 'local',
-                                'path': str(img_path),
-                                'url': img_url,
-                                'alt': alt_text,
-                                'title': title,
-                                'file': file_key,
-                                'base64': f'data:{mime_type};base64,{img_base64}'
-                            }
-                            
-                            # 建立图片索引
-                            keywords = self._extract_keywords(alt_text + ' ' + title)
-                            for keyword in keywords:
-                                if keyword not in self.image_index:
-                                    self.image_index[keyword] = []
-                                self.image_index[keyword].append(img_key)
-                                
-                        except Exception as e:
-                            logger.warning(f"无法读取图片 {img_path}: {e}")
-                    
-        except Exception as e:
-            logger.error(f"提取图片失败: {e}")
-    
-    def _resolve_image_path(self, img_url: str, md_path: Path):
-        """解析图片相对路径"""
-        try:
-            # 解码URL编码
-            import urllib.parse
-            img_url = urllib.parse.unquote(img_url)
-            
-            # 移除可能的查询参数
-            img_url = img_url.split('?')[0]
-            
-            # 处理不同的路径格式
-            if img_url.startswith('/'):
-                # 相对于项目根目录
-                return self.base_path / img_url.lstrip('/')
-            elif img_url.startswith('./'):
-                # 相对于当前文件
-                return md_path.parent / img_url[2:]
-            elif img_url.startswith('../'):
-                # 相对于上级目录
-                return md_path.parent / img_url
-            else:
-                # 假设相对于当前文件
-                return md_path.parent / img_url
-                
-        except Exception as e:
-            logger.error(f"解析图片路径失败 {img_url}: {e}")
-            return None
-    
-    def _extract_keywords(self, text: str, max_keywords: int = 10):
-        """从文本中提取关键词"""
-        # 移除停用词
-        stop_words = {'的', '了', '和', '是', '在', '有', '就', '都', '而', '及', '与', '或', '等'}
-        
-        # 提取中英文单词
-        words = re.findall(r'[\u4e00-\u9fff]{2,5}', text) + re.findall(r'\b[a-zA-Z]{3,}\b', text)
-        
-        # 统计词频
-        word_freq = {}
-        for word in words:
-            if word not in stop_words:
-                word_freq[word] = word_freq.get(word, 0) + 1
-        
-        # 按频率排序
-        sorted_words = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)
-        return [word for word, freq in sorted_words[:max_keywords]]
-    
-    def _build_global_index(self):
-        """构建全局索引"""
-        python_keywords = {
-            'python', '语法', '函数', '类', '对象', '模块', '包', '异常', '装饰器',
-            '生成器', '迭代器', '列表', '字典', '集合', '元组', '字符串',
-            '文件', '输入输出', '多线程', '异步', '网络', '数据库',
-            '测试', '调试', '性能', '优化', '算法', '数据结构', '爬虫',
-            '数据分析', '机器学习', '深度学习', 'web开发', 'gui'
-        }
-        
-        for file_key, content in self.text_cache.items():
-            # 为每个关键词建立索引
-            for keyword in python_keywords:
-                if keyword.lower() in content.lower():
-                    if keyword not in self.content_index:
-                        self.content_index[keyword] = []
-                    
-                    # 提取上下文
-                    context = self._get_context(content, keyword, 200)
-                    self.content_index[keyword].append({
-                        'file': file_key,
-                        'context': context,
-                        'type': 'keyword_match'
-                    })
-    
-    def _get_context(self, text: str, keyword: str, context_size: int = 200):
-        """获取关键词上下文"""
-        # 不区分大小写搜索
-        pattern = re.compile(re.escape(keyword), re.IGNORECASE)
-        match = pattern.search(text)
-        if not match:
-            return ""
-        
-        pos = match.start()
-        start = max(0, pos - context_size // 2)
-        end = min(len(text), pos + len(keyword) + context_size // 2)
-        return text[start:end]
-    
-    def search_with_images(self, query: str, max_results: int = 5):
-        """搜索内容并返回相关图片"""
-        results = {
-            'text_results': [],
-            'image_results': [],
-            'sections': []
-        }
-        
-        query_lower = query.lower()
-        
-        # 1. 搜索章节
-        for section_key, content in self.sections.items():
-            if query_lower in section_key.lower() or query_lower in content.lower():
-                # 提取文件名和章节名
-                if '#' in section_key:
-                    file_part, section_part = section_key.split('#', 1)
-                    # 提取相关段落
-                    paragraphs = content.split('\n')
-                    relevant_content = []
-                    
-                    for para in paragraphs:
-                        if query_lower in para.lower():
-                            clean_para = re.sub(r'\s+', ' ', para).strip()
-                            if len(clean_para) > 30:
-                                relevant_content.append(clean_para)
-                    
-                    if relevant_content:
-                        results['sections'].append({
-                            'file': file_part,
-                            'title': section_part,
-                            'content': ' '.join(relevant_content[:2]),
-                            'full_content': content[:1000]
-                        })
-        
-        # 2. 搜索关键词索引
-        for keyword in query_lower.split():
-            if keyword in self.content_index:
-                for item in self.content_index[keyword][:max_results]:
-                    results['text_results'].append({
-                        'type': 'keyword',
-                        'keyword': keyword,
-                        'content': item.get('context', item.get('content', '')),
-                        'file': item.get('file', ''),
-                        'relevance': item.get('relevance', 'medium')
-                    })
-        
-        # 3. 搜索相关图片
-        for keyword in query_lower.split():
-            if keyword in self.image_index:
-                for image_key in self.image_index[keyword][:3]:
-                    if image_key in self.images_cache:
-                        image_info = self.images_cache[image_key]
-                        results['image_results'].append({
-                            'key': image_key,
-                            'caption': image_info['title'],
-                            'base64': image_info.get('base64'),
-                            'url': image_info.get('url'),
-                            'file': image_info['file'],
-                            'related_keyword': keyword,
-                            'type': image_info['type']
-                        })
-        
-        # 如果没有直接结果，尝试模糊匹配
-        if not results['text_results'] and not results['image_results']:
-            results = self._fuzzy_search(query)
-        
-        return results
-    
-    def _fuzzy_search(self, query: str):
-        """模糊搜索"""
-        results = {
-            'text_results': [],
-            'image_results': [],
-            'sections': []
-        }
-        
-        # 在所有文本中搜索
-        for file_key, text in self.text_cache.items():
-            if query.lower() in text.lower():
-                context = self._get_context(text, query, 300)
-                results['text_results'].append({
-                    'type': 'full_text',
-                    'content': context,
-                    'file': file_key,
-                    'relevance': 'medium'
-                })
-        
-        return results
-    
-    def get_relevant_images(self, topic: str, limit: int = 3):
-        """获取特定主题的相关图片"""
-        images = []
-        
-        # 从图片索引中查找
-        for keyword in topic.lower().split():
-            if keyword in self.image_index:
-                for image_key in self.image_index[keyword][:limit]:
-                    if image_key in self.images_cache:
-                        images.append(self.images_cache[image_key])
-        
-        # 如果没有找到，返回README文件中的图片
-        if not images:
-            for key, img in self.images_cache.items():
-                if 'README' in img['file']:
-                    images.append(img)
-                    if len(images) >= limit:
-                        break
-        
-        return images
-    
-    def get_page_images(self, page_num: int):
-        """获取指定页面的所有图片（为兼容性保留）"""
-        images = []
-        return images
-    
-    def search_exact_content(self, exact_phrase: str):
-        """精确短语搜索"""
-        results = []
-        
-        for file_key, text in self.text_cache.items():
-            positions = [m.start() for m in re.finditer(re.escape(exact_phrase), text, re.IGNORECASE)]
-            
-            for pos in positions[:3]:  # 最多3个匹配
-                start = max(0, pos - 100)
-                end = min(len(text), pos + len(exact_phrase) + 100)
-                context = text[start:end]
-                
-                results.append({
-                    'file': file_key,
-                    'position': pos,
-                    'context': context,
-                    'exact_match': exact_phrase
-                })
-        
-        return results
-    
-    def generate_citation(self, content: str, max_length: int = 500):
-        """生成引用格式的内容"""
-        if not content:
-            return ""
-        
-        # 在所有文件中查找
-        for file_key, text in self.text_cache.items():
-            if content[:100] in text:
-                start_pos = text.find(content[:100])
-                if start_pos != -1:
-                    return f"《Python-100-Days》{file_key}: {content[:max_length]}..."
-        
-        # 如果没找到，返回原始内容
-        return content[:max_length] + "..."
-    
-    def get_file_content(self, file_path: str):
-        """获取指定文件的内容"""
-        try:
-            full_path = self.base_path / file_path
-            if full_path.exists():
-                return full_path.read_text(encoding='utf-8', errors='ignore')
-        except:
-            pass
-        return None
-
 class PythonProgrammingAgent:
     def __init__(self):
         self.tools = {
@@ -700,14 +329,37 @@ class PythonProgrammingAgent:
 
         # 初始化Markdown手册
         try:
-            base_path = os.path.join(os.path.dirname(__file__), 'static', 'Python-100-Days-master')
-            self.enhanced_handbook = MarkdownHandbook(base_path)
-            self.handbook = self.enhanced_handbook  # 保持向后兼容
-            print(f"✅ Markdown手册加载成功: {len(self.enhanced_handbook.md_files)} 个文件")
+            # 使用进程内共享的文档库分片，避免重复读取和编码整个文档目录
+            self.handbook_corpora = get_shared_corpora()
+            shards = self.handbook_corpora.select()
+            print(f"✅ Markdown手册加载成功: {len(shards)} 个文档库，"
+                  f"{sum(len(shard.md_files) for _, shard in shards)} 个文件")
         except Exception as e:
             print(f"❌ Markdown手册初始化失败: {e}")
-            self.enhanced_handbook = None
-            self.handbook = None
+            self.handbook_corpora = None
+
+        # 进行中的提问登记表，相同问题的并发提问合并为一次计算
+        self.inflight = SingleFlight()
+        self.async_inflight = AsyncSingleFlight()
+
+        # 提示词构建：本地计算token数，手册上下文按预算裁剪
+        try:
+            self.prompt_builder = PromptBuilder(PROMPT_TOKEN_BUDGET,
+                                                TokenCounter(PROMPT_TOKEN_ENCODING, PROMPT_TOKEN_CACHE_DIR))
+        except Exception as e:
+            print(f"⚠️ 提示词构建器初始化失败: {e}")
+            self.prompt_builder = None
+
+        # 回答缓存，重复的问题不再调用模型
+        self.answer_cache = None
+        if ANSWER_CACHE_ENABLED:
+            try:
+                self.answer_cache = AnswerCache(ANSWER_CACHE_PATH, ttl=ANSWER_CACHE_TTL,
+                                                max_bytes=ANSWER_CACHE_MAX_BYTES,
+                                                near_duplicate=ANSWER_CACHE_NEAR_DUPLICATE,
+                                                threshold=ANSWER_CACHE_SIMILARITY)
+            except Exception as e:
+                print(f"⚠️ 回答缓存初始化失败: {e}")
 
         # 初始化模型
         self.llm = None
@@ -754,13 +406,26 @@ class PythonProgrammingAgent:
 - 如果手册中有相关图表，请说明"手册中的图表展示了..."
 - 对于复杂概念，建议用户查看手册中的图示"""
 
+    @property
+    def enhanced_handbook(self):
+        """默认文档库的手册分片（单独重新加载后自动指向新分片）"""
+        return self.handbook_corpora.get() if self.handbook_corpora else None
+
+    @property
+    def handbook(self):
+        return self.enhanced_handbook  # 保持向后兼容
+
     def enhanced_handbook_search(self, query: str) -> str:
-        """增强版手册搜索，包含图片"""
+        """增强版手册搜索，包含图片（相同查询在索引未变化时直接复用结果）"""
+        if self.enhanced_handbook is None:
+            return f"《Python-100-Days》手册未正确初始化。"
+        return self.handbook_corpora.cached_search(
+            'enhanced_handbook_search', query, lambda: self._enhanced_handbook_search(query))
+
+    def _enhanced_handbook_search(self, query: str) -> str:
+        """增强版手册搜索，包含图片（并发检索全部文档库）"""
         try:
-            if self.enhanced_handbook is None:
-                return f"《Python-100-Days》手册未正确初始化。"
-            
-            results = self.enhanced_handbook.search_with_images(query)
+            results = self.handbook_corpora.search_with_images(query)
             
             if not results['text_results'] and not results['image_results']:
                 return f"在《Python-100-Days》中未找到与'{query}'直接相关的内容。"
@@ -771,14 +436,14 @@ class PythonProgrammingAgent:
             if results.get('text_results'):
                 response += "### 📖 相关文本内容\n\n"
                 for i, result in enumerate(results['text_results'][:3], 1):
-                    citation = self.enhanced_handbook.generate_citation(result['content'])
-                    response += f"{i}. **{result.get('file', '未知文件')}** - {citation}\n\n"
+                    citation = self.handbook_corpora.shard(result).generate_citation(result['content'], hit=result)
+                    response += f"{i}. **{self.handbook_corpora.label(result) or '未知文件'}** - {citation}\n\n"
             
             # 章节内容
             if results.get('sections'):
                 response += "### 📑 相关章节\n\n"
                 for i, section in enumerate(results['sections'][:2], 1):
-                    response += f"{i}. **{section['title']}** (来自: {section['file']})\n"
+                    response += f"{i}. **{section['title']}** (来自: {self.handbook_corpora.label(section)})\n"
                     response += f"   {section['content'][:200]}...\n\n"
             
             # 相关图片
@@ -786,12 +451,12 @@ class PythonProgrammingAgent:
                 response += "### 🖼️ 相关图表和示例\n\n"
                 response += "手册中包含以下相关图示：\n\n"
                 for img in results['image_results'][:2]:
-                    response += f"- **{img['caption']}** (来自: {img['file']})\n"
+                    response += f"- **{img['caption']}** (来自: {self.handbook_corpora.label(img)})\n"
                     
                     # 根据图片类型处理
-                    if img['type'] == 'local' and img.get('base64'):
-                        # 本地图片，使用base64
-                        response += f"[IMAGE:{img['caption']}]\n{img['base64']}\n[/IMAGE]\n\n"
+                    if img['type'] == 'local' and img.get('url'):
+                        # 本地图片，使用静态文件URL，避免把base64写进回答
+                        response += f"[IMAGE:{img['caption']}]\n{img['url']}\n[/IMAGE]\n\n"
                     elif img['type'] == 'web' and img.get('url'):
                         # 网络图片，使用URL
                         response += f"![{img['caption']}]({img['url']})\n\n"
@@ -1209,9 +874,12 @@ class PythonProgrammingAgent:
             "tool_input": None
         }
 
+        # 一次扫描找出问题中的全部触发词，再按优先级判断意图
+        found = TOOL_INTENT_MATCHER.find_all(question)
+        intents = {tool for tool, words in TOOL_INTENT_WORDS.items() if found.intersection(words)}
+
         # 检测基础概念问题，优先使用手册搜索
-        basic_concepts = ['是什么', '什么是', '定义', '概念', '介绍', '讲解', '说明', '含义']
-        if any(concept in question_lower for concept in basic_concepts):
+        if 'enhanced_handbook_search' in intents:
             # 提取关键词
             words = question_lower.split()
             keywords = [word for word in words if len(word) > 2 and word not in ['python', '什么', '如何', '怎样']]
@@ -1223,7 +891,7 @@ class PythonProgrammingAgent:
                 })
 
         # 检测代码执行
-        elif any(word in question_lower for word in ['执行', '运行', '运行代码', '执行代码', 'test', 'run']):
+        elif 'code_executor' in intents:
             code_match = re.search(r'```python\s*(.*?)\s*```', question, re.DOTALL)
             if code_match:
                 tool_usage.update({
@@ -1233,7 +901,7 @@ class PythonProgrammingAgent:
                 })
 
         # 检测语法检查
-        elif any(word in question_lower for word in ['语法', '语法检查', '语法错误', 'syntax']):
+        elif 'syntax_checker' in intents:
             code_match = re.search(r'```python\s*(.*?)\s*```', question, re.DOTALL)
             if code_match:
                 tool_usage.update({
@@ -1243,7 +911,7 @@ class PythonProgrammingAgent:
                 })
 
         # 检测代码分析
-        elif any(word in question_lower for word in ['分析', '优化', '改进', '代码分析', 'analyze']):
+        elif 'code_analyzer' in intents:
             code_match = re.search(r'```python\s*(.*?)\s*```', question, re.DOTALL)
             if code_match:
                 tool_usage.update({
@@ -1255,47 +923,26 @@ class PythonProgrammingAgent:
         return tool_usage
 
     def _should_search_handbook(self, question: str) -> bool:
-        """判断问题是否需要搜索手册"""
-        question_lower = question.lower()
-        
-        # 基础概念问题
-        basic_concepts = [
-            '是什么', '什么是', '定义', '概念', '介绍', '讲解', '说明', '含义',
-            '怎么理解', '如何理解', '什么意思', '有什么区别', '有什么不同',
-            '优点', '缺点', '特点', '特征', '特性'
-        ]
-        
-        # 具体技术问题
-        technical_terms = [
-            '装饰器', '生成器', '迭代器', '上下文管理器', '元类', '描述符',
-            'GIL', '垃圾回收', '内存管理', '多线程', '多进程', '协程',
-            '异步', 'await', 'async', '列表推导', '字典推导', '集合推导',
-            'lambda', '闭包', '作用域', '命名空间', '模块', '包'
-        ]
-        
-        # 检查是否是基础概念问题
-        for concept in basic_concepts:
-            if concept in question_lower:
-                return True
-        
-        # 检查是否包含具体技术术语
-        for term in technical_terms:
-            if term in question_lower:
-                return True
-        
-        return False
+        """判断问题是否需要搜索手册：包含基础概念问法或具体技术术语"""
+        return HANDBOOK_QUESTION_MATCHER.contains_any(question)
 
     def _get_relevant_handbook_content(self, question: str) -> Optional[str]:
         """获取相关的手册内容"""
         try:
-            # 提取问题中的关键词
-            keywords = re.findall(r'[\u4e00-\u9fff]{2,5}|[a-zA-Z]{3,}', question)
+            # 使用手册分词器提取问题中的关键词（与索引切分方式一致）
+            keywords = self.enhanced_handbook.tokenizer.keywords(question)
+            if not keywords:
+                return None
             
-            for keyword in keywords:
-                if len(keyword) >= 2:  # 至少2个字符
-                    result = self.enhanced_handbook_search(keyword)
-                    if "未找到" not in result:
-                        return result
+            # 向量索引就绪时，全部关键词的一次混合检索即可找到概念相关的章节；
+            # 否则先整体检索，没有结果再逐个关键词尝试
+            queries = [' '.join(keywords)]
+            if not self.handbook_corpora.semantic_ready():
+                queries += keywords
+            for query in dict.fromkeys(queries):
+                result = self.enhanced_handbook_search(query)
+                if "未找到" not in result:
+                    return result
             
             return None
         except:
@@ -1319,83 +966,259 @@ class PythonProgrammingAgent:
 """
         return integration
 
-    def ask_question(self, question: str) -> str:
-        """向智能体提问关于Python编程的问题"""
+    def _fit_prompt_context(self, question: str, context: Optional[str], system_prompt: str,
+                            tool_output: bool = False) -> Optional[str]:
+        """按输入token预算压缩提示词中的上下文，记录压缩前后的token数。
+        手册内容按与问题的相关度选取片段；工具结果保持原样顺序，只截去超出预算的末尾"""
+        if not context or self.prompt_builder is None:
+            return context
         try:
-            # 检测是否为需要手册引用的问题
-            should_search_handbook = self._should_search_handbook(question)
-            
-            # 先获取手册内容（如果需要）
-            handbook_content = None
-            if should_search_handbook and self.enhanced_handbook:
-                handbook_content = self._get_relevant_handbook_content(question)
-            
-            # 准备提问内容
-            enhanced_question = question
-            if handbook_content:
-                # 将手册内容作为上下文添加到问题中
-                enhanced_question = f"""
+            reserved = (self.prompt_builder.count(system_prompt) + self.prompt_builder.count(question)
+                        + PROMPT_TEMPLATE_TOKENS)
+            if tool_output:
+                fitted, stats = self.prompt_builder.fit_output(context, reserved)
+            else:
+                fitted, stats = self.prompt_builder.fit_context(question, context, reserved)
+        except Exception as e:
+            logger.error(f"裁剪提示词上下文失败: {e}")
+            return context
+        detail = (f"截断: {'是' if stats['truncated'] else '否'}" if tool_output
+                  else f"保留片段 {stats['kept']}/{stats['snippets']}")
+        logger.info(f"提示词token: {reserved + stats['before']} -> {reserved + stats['after']}"
+                    f"（上下文 {stats['before']} -> {stats['after']}，预算 {self.prompt_builder.budget}，{detail}）")
+        return fitted
+
+    def _prepare_messages(self, question: str) -> Tuple[Optional[List], Optional[str], Optional[str]]:
+        """准备提问：返回(发给LLM的消息, 手册内容, 直接回答)。
+        无需调用LLM时（无LLM可用）消息为None，直接回答即最终结果"""
+        # 检测是否为需要手册引用的问题
+        should_search_handbook = self._should_search_handbook(question)
+        
+        # 先获取手册内容（如果需要）
+        handbook_content = None
+        if should_search_handbook and self.enhanced_handbook:
+            handbook_content = self._get_relevant_handbook_content(question)
+        
+        # 准备提问内容：手册内容去掉图片数据并按token预算裁剪后作为上下文
+        enhanced_question = question
+        prompt_context = self._fit_prompt_context(question, handbook_content, self.system_prompt)
+        if prompt_context:
+            # 将手册内容作为上下文添加到问题中
+            enhanced_question = f"""
 用户问题: {question}
 
 根据《Python-100-Days》相关内容:
-{handbook_content}
+{prompt_context}
 
 请基于以上信息回答用户问题，确保回答准确且引用手册中的权威解释。
 """
-            
-            # 检测是否需要使用工具
-            tool_info = self._detect_tool_usage(question)
+        
+        # 检测是否需要使用工具
+        tool_info = self._detect_tool_usage(question)
 
-            if tool_info["use_tool"]:
-                tool_name = tool_info["tool_name"]
-                tool_input = tool_info["tool_input"]
+        if tool_info["use_tool"]:
+            tool_name = tool_info["tool_name"]
+            tool_input = tool_info["tool_input"]
 
-                if tool_name in self.tools:
-                    print(f"🔧 使用工具: {tool_name}")
-                    tool_result = self.tools[tool_name](tool_input)
+            if tool_name in self.tools:
+                print(f"🔧 使用工具: {tool_name}")
+                tool_result = self.tools[tool_name](tool_input)
 
-                    # 如果有LLM，让LLM来解释工具结果
-                    if self.llm:
-                        enhanced_prompt = f"""用户的问题: {question}
+                # 如果有LLM，让LLM来解释工具结果
+                if self.llm:
+                    tool_context = self._fit_prompt_context(question, tool_result, TOOL_SYSTEM_PROMPT,
+                                                           tool_output=True)
+                    enhanced_prompt = f"""用户的问题: {question}
 
 工具执行结果:
-{tool_result}
+{tool_context}
 
 请基于工具执行结果，给用户一个完整、专业的回答。用中文回答，使用Markdown格式。如果可能，引用《Python-100-Days》中的相关内容。"""
 
-                        messages = [
-                            SystemMessage(
-                                content="你是一个Python编程助手，请基于工具执行结果和《Python-100-Days》给用户提供专业、完整的回答。"),
-                            HumanMessage(content=enhanced_prompt)
-                        ]
-                        response = self.llm.invoke(messages)
-                        return response.content
-                    else:
-                        # 无LLM时直接返回工具结果
-                        return f"**工具执行结果**:\n\n{tool_result}"
-
-            # 如果没有使用工具或者工具使用失败，直接使用LLM
-            if self.llm:
-                messages = [
-                    SystemMessage(content=self.system_prompt),
-                    HumanMessage(content=enhanced_question)
-                ]
-                response = self.llm.invoke(messages)
-                answer = response.content
-                
-                # 如果手册有相关内容且没包含在回答中，添加引用
-                if handbook_content and "《Python-100-Days》" not in answer:
-                    answer = self._integrate_handbook_content(answer, handbook_content)
-                
+                    messages = [
+                        SystemMessage(content=TOOL_SYSTEM_PROMPT),
+                        HumanMessage(content=enhanced_prompt)
+                    ]
+                    # 工具解释的回答不再追加手册引用
+                    return messages, None, None
+                else:
+                    # 无LLM时直接返回工具结果
+                    return None, None, f"**工具执行结果**:\n\n{tool_result}"
+
+        # 如果没有使用工具或者工具使用失败，直接使用LLM
+        if self.llm:
+            messages = [
+                SystemMessage(content=self.system_prompt),
+                HumanMessage(content=enhanced_question)
+            ]
+            return messages, handbook_content, None
+        return None, None, self._local_answer(question)
+
+    def _finish_answer(self, answer: str, handbook_content: Optional[str]) -> str:
+        """如果手册有相关内容且没包含在回答中，添加引用"""
+        if handbook_content and "《Python-100-Days》" not in answer:
+            answer = self._integrate_handbook_content(answer, handbook_content)
+        return answer
+
+    def _cache_scope(self, messages: List) -> Optional[Tuple[str, str]]:
+        """回答缓存的(提示词版本, 模型)；只缓存使用主系统提示词的回答，
+        工具解释依赖工具的执行结果（如代码运行输出），不缓存"""
+        if self.answer_cache is None or messages[0].content != self.system_prompt:
+            return None
+        model = getattr(self.llm, 'model_name', None) or getattr(self.llm, 'model', '')
+        return content_hash(self.system_prompt), str(model)
+
+    def _prepare(self, question: str, use_cache: bool = True) -> Tuple[Optional[List], Optional[str], Optional[str]]:
+        """准备提问并查找回答缓存，命中时与无需调用LLM的情况相同：消息为None，直接回答为缓存的回答。
+        use_cache为False时跳过查找，新回答仍会写入缓存"""
+        messages, handbook_content, answer = self._prepare_messages(question)
+        if messages is None or not use_cache:
+            return messages, handbook_content, answer
+        scope = self._cache_scope(messages)
+        if scope:
+            try:
+                cached = self.answer_cache.get(question, *scope, handbook_content)
+            except Exception as e:
+                logger.error(f"读取回答缓存失败: {e}")
+                cached = None
+            if cached is not None:
+                return None, None, cached
+        return messages, handbook_content, answer
+
+    def _store_answer(self, question: str, messages: List, handbook_content: Optional[str], answer: str):
+        """把LLM的完整回答写入缓存"""
+        scope = self._cache_scope(messages)
+        if scope and answer:
+            try:
+                self.answer_cache.put(question, *scope, handbook_content, answer)
+            except Exception as e:
+                logger.error(f"写入回答缓存失败: {e}")
+
+    @staticmethod
+    def _flight_key(question: str, use_cache: bool) -> Tuple[str, bool]:
+        """合并并发提问的键，与回答缓存的键一致：含代码的问题按原文（只去掉首尾空白），
+        其余问题做小写和空白合并，相同的问题才共享一次检索和模型调用"""
+        return normalize_question(question), use_cache
+
+    def ask_question(self, question: str, use_cache: bool = True) -> str:
+        """向智能体提问关于Python编程的问题；use_cache为False时不使用缓存的回答。
+        相同问题的并发提问只调用一次模型，共享同一个回答"""
+        return self.inflight.do(self._flight_key(question, use_cache),
+                                lambda: self._ask_question(question, use_cache))
+
+    def _ask_question(self, question: str, use_cache: bool) -> str:
+        try:
+            messages, handbook_content, answer = self._prepare(question, use_cache)
+            if messages is None:
                 return answer
-            else:
-                return self._local_answer(question)
+            response = self.llm.invoke(messages)
+            answer = self._finish_answer(response.content, handbook_content)
+            self._store_answer(question, messages, handbook_content, answer)
+            return answer
 
         except Exception as e:
             error_msg = f"提问错误: {str(e)}"
             print(f"Error: {error_msg}")
             return f"⚠️ {error_msg}\n请检查API密钥或网络连接"
 
+    def stream_question(self, question: str, use_cache: bool = True) -> Generator[str, None, str]:
+        """流式提问：逐个产出LLM生成的文本增量，生成器的返回值为完整回答（含手册引用）。
+        无LLM或命中缓存时整段产出直接回答。相同问题的并发流共享一次模型输出，
+        后加入的调用方先收到已生成的部分；全部调用方关闭生成器后关闭LLM的流，停止接收后续输出"""
+        return (yield from self.inflight.stream(self._flight_key(question, use_cache),
+                                                lambda: self._stream_question(question, use_cache)))
+
+    def _stream_question(self, question: str, use_cache: bool) -> Generator[str, None, str]:
+        try:
+            messages, handbook_content, answer = self._prepare(question, use_cache)
+            if messages is None:
+                yield answer
+                return answer
+
+            parts = []
+            chunks = self.llm.stream(messages)
+            try:
+                for chunk in chunks:
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        yield chunk.content
+            finally:
+                close = getattr(chunks, 'close', None)
+                if close:
+                    close()
+            answer = self._finish_answer(''.join(parts), handbook_content)
+            self._store_answer(question, messages, handbook_content, answer)
+            return answer
+
+        except Exception as e:
+            error_msg = f"提问错误: {str(e)}"
+            print(f"Error: {error_msg}")
+            answer = f"⚠️ {error_msg}\n请检查API密钥或网络连接"
+            yield answer
+            return answer
+
+    async def aask_question(self, question: str, use_cache: bool = True) -> str:
+        """ask_question的异步版本：手册检索和工具执行在线程池中进行，LLM调用使用ainvoke，
+        等待模型输出期间不占用线程，大量请求可以共享少量线程"""
+        return await self.async_inflight.do(self._flight_key(question, use_cache),
+                                            lambda: self._aask_question(question, use_cache))
+
+    async def _aask_question(self, question: str, use_cache: bool) -> str:
+        loop = asyncio.get_running_loop()
+        try:
+            messages, handbook_content, answer = await loop.run_in_executor(
+                None, self._prepare, question, use_cache)
+            if messages is None:
+                return answer
+            response = await self.llm.ainvoke(messages)
+            answer = self._finish_answer(response.content, handbook_content)
+            await loop.run_in_executor(None, self._store_answer, question, messages, handbook_content, answer)
+            return answer
+
+        except Exception as e:
+            error_msg = f"提问错误: {str(e)}"
+            print(f"Error: {error_msg}")
+            return f"⚠️ {error_msg}\n请检查API密钥或网络连接"
+
+    async def astream_question(self, question: str, use_cache: bool = True) -> AsyncIterator[Tuple[str, str]]:
+        """stream_question的异步版本，使用astream。异步生成器不能返回值，
+        因此逐个产出('delta', 文本增量)，最后产出('answer', 完整回答)"""
+        async for event in self.async_inflight.stream(self._flight_key(question, use_cache),
+                                                      lambda: self._astream_question(question, use_cache)):
+            yield event
+
+    async def _astream_question(self, question: str, use_cache: bool) -> AsyncIterator[Tuple[str, str]]:
+        loop = asyncio.get_running_loop()
+        try:
+            messages, handbook_content, answer = await loop.run_in_executor(
+                None, self._prepare, question, use_cache)
+            if messages is None:
+                yield 'delta', answer
+                yield 'answer', answer
+                return
+
+            parts = []
+            chunks = self.llm.astream(messages)
+            try:
+                async for chunk in chunks:
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        yield 'delta', chunk.content
+            finally:
+                aclose = getattr(chunks, 'aclose', None)
+                if aclose:
+                    await aclose()
+            answer = self._finish_answer(''.join(parts), handbook_content)
+            await loop.run_in_executor(None, self._store_answer, question, messages, handbook_content, answer)
+            yield 'answer', answer
+
+        except Exception as e:
+            error_msg = f"提问错误: {str(e)}"
+            print(f"Error: {error_msg}")
+            answer = f"⚠️ {error_msg}\n请检查API密钥或网络连接"
+            yield 'delta', answer
+            yield 'answer', answer
+
     def _local_answer(self, question: str) -> str:
         """无API时的本地回答"""
         q = question.lower()
@@ -2302,23 +2302,48 @@ function searchMarkdown() {
     docPath.textContent = `搜索结果: ${query}`;
     docBackBtn.style.display = 'inline-block';
     
-    fetch('/search_markdown', {
+    // 流式读取搜索结果（每行一个JSON），先到的结果先显示
+    const results = [];
+    fetch('/search_markdown/stream', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
         },
         body: JSON.stringify({ query: query })
     })
-    .then(response => response.json())
-    .then(data => {
-        if (data.success) {
-            renderSearchResults(data.results, query, data.total_matches);
-        } else {
-            docViewer.innerHTML = `<div class="error-message">搜索失败: ${data.error}</div>`;
+    .then(async response => {
+        if (!response.body || !(response.headers.get('Content-Type') || '').includes('ndjson')) {
+            const data = await response.json();
+            throw new Error(data.error || '搜索失败');
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            let received = false;
+            for (const line of lines) {
+                if (!line.trim()) continue;
+                const item = JSON.parse(line);
+                if (item.type === 'hit') {
+                    results.push(item);
+                    received = true;
+                } else if (item.type === 'error') {
+                    throw new Error(item.error);
+                }
+            }
+            if (received) {
+                renderSearchResults(results, query, results.length);
+            }
         }
+        renderSearchResults(results, query, results.length);
     })
     .catch(error => {
-        docViewer.innerHTML = `<div class="error-message">网络错误: ${error.message}</div>`;
+        docViewer.innerHTML = `<div class="error-message">搜索失败: ${error.message}</div>`;
     });
 }
 
@@ -2518,7 +2543,8 @@ function sendMessageStream() {
     showTypingIndicator();
 
     const eventSource = new EventSource(`/ask_stream?question=${encodeURIComponent(message)}`);
-    let fullAnswer = '';
+    let streamText = null;
+    let streamedAnswer = '';
 
     eventSource.onmessage = function(event) {
         const data = JSON.parse(event.data);
@@ -2531,18 +2557,35 @@ function sendMessageStream() {
         }
 
         if (data.finished) {
-            removeTypingIndicator();
-            fullAnswer = data.full_answer;
+            // 完成后用服务端渲染的HTML替换流式文本
             eventSource.close();
-        } else {
-            updateLastMessage(data.chunk);
+            removeTypingIndicator();
+            if (!streamText) {
+                addMessage('assistant', '', 'html');
+            }
+            updateLastMessage(data.full_answer);
+            return;
+        }
+
+        if (data.delta) {
+            // 收到第一个增量时创建回答消息，之后逐段追加纯文本
+            if (!streamText) {
+                removeTypingIndicator();
+                addMessage('assistant', '', 'html');
+                streamText = document.querySelector('.message.assistant:last-child .message-text');
+                streamText.style.whiteSpace = 'pre-wrap';
+            }
+            streamedAnswer += data.delta;
+            streamText.textContent = streamedAnswer;
+            chatMessages.scrollTop = chatMessages.scrollHeight;
         }
     };
 
     eventSource.onerror = function(event) {
+        // 关闭连接，避免EventSource自动重连后重复提问
+        eventSource.close();
         removeTypingIndicator();
         addMessage('system', '连接错误，请重试', 'text');
-        eventSource.close();
     };
 }
 
@@ -2550,6 +2593,7 @@ function updateLastMessage(content) {
     const lastMessage = document.querySelector('.message.assistant:last-child .message-text');
     if (lastMessage) {
         const decodedContent = decodeHtmlEntities(content);
+        lastMessage.style.whiteSpace = '';
         lastMessage.innerHTML = decodedContent;
 
         setTimeout(() => {
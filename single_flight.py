@@ -0,0 +1,269 @@
+# single_flight.py
+import asyncio
+import logging
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Generator, Hashable, List
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """一次进行中的计算，等待者共享其结果或异常"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _StreamFlight:
+    """一次进行中的流式计算：已产出的项目保存在items中，后加入的订阅者先补齐已有项目再等待新项目"""
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.cond = threading.Condition()
+        self.done = False
+        self.cancelled = False
+        self.result = None
+        self.error = None
+        self.subscribers = 0
+
+
+class SingleFlight:
+    """合并相同键的并发调用：同一时刻只执行一次，其余调用等待并共享结果（线程版本）。
+
+    计算结束后立即从登记表移除，之后的调用重新计算，结果的复用交给缓存负责。
+    流式调用由后台线程驱动上游生成器，各订阅者独立读取；全部订阅者离开后停止上游。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._streams: Dict[Hashable, _StreamFlight] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.collapsed = 0
+        self.stream_leaders = 0
+        self.stream_collapsed = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """执行fn；相同键的计算正在进行时等待它的结果"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.collapsed += 1
+        if not leader:
+            logger.debug(f"合并进行中的调用: {key}")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stream(self, key: Hashable, factory: Callable[[], Generator]) -> Generator[Any, None, Any]:
+        """订阅factory()产出的流；相同键的流正在进行时从头重放已有项目并继续接收。
+        生成器的返回值为上游生成器的返回值"""
+        flight = self._join_stream(key, factory)
+        index = 0
+        try:
+            while True:
+                with flight.cond:
+                    while index >= len(flight.items) and not flight.done:
+                        flight.cond.wait()
+                    items = flight.items[index:]
+                    done = flight.done
+                index += len(items)
+                for item in items:
+                    yield item
+                if done:
+                    break
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        finally:
+            self._leave_stream(key, flight)
+
+    def _join_stream(self, key: Hashable, factory: Callable[[], Generator]) -> _StreamFlight:
+        with self._lock:
+            flight = self._streams.get(key)
+            if flight is None:
+                flight = self._streams[key] = _StreamFlight()
+                self.stream_leaders += 1
+                threading.Thread(target=self._drive, args=(key, flight, factory),
+                                 name='single-flight-stream', daemon=True).start()
+            else:
+                self.stream_collapsed += 1
+                logger.debug(f"合并进行中的流: {key}")
+            flight.subscribers += 1
+        return flight
+
+    def _leave_stream(self, key: Hashable, flight: _StreamFlight):
+        """订阅者离开；最后一个订阅者在流结束前离开时停止上游，之后的调用重新开始"""
+        with self._lock:
+            flight.subscribers -= 1
+            if flight.subscribers or flight.done:
+                return
+            flight.cancelled = True
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+
+    def _drive(self, key: Hashable, flight: _StreamFlight, factory: Callable[[], Generator]):
+        """后台线程：消费上游生成器并通知订阅者；被取消时在下一个项目到达后关闭上游"""
+        generator = None
+        try:
+            generator = factory()
+            while not flight.cancelled:
+                try:
+                    item = next(generator)
+                except StopIteration as stop:
+                    flight.result = stop.value
+                    break
+                with flight.cond:
+                    flight.items.append(item)
+                    flight.cond.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            if generator is not None:
+                generator.close()
+            with self._lock:
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def stats(self) -> Dict:
+        """发起的计算数、被合并的调用数和正在进行的数量"""
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'collapsed': self.collapsed,
+                'in_flight': len(self._calls),
+                'stream_leaders': self.stream_leaders,
+                'stream_collapsed': self.stream_collapsed,
+                'streams_in_flight': len(self._streams)
+            }
+
+
+class _AsyncFlight:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class _AsyncStreamFlight:
+    def __init__(self):
+        self.items: List[Any] = []
+        self.cond = asyncio.Condition()
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+
+
+class AsyncSingleFlight:
+    """SingleFlight的异步版本，在同一个事件循环中使用；全部等待者取消后同时取消上游任务"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _AsyncFlight] = {}
+        self._streams: Dict[Hashable, _AsyncStreamFlight] = {}
+        self.leaders = 0
+        self.collapsed = 0
+        self.stream_leaders = 0
+        self.stream_collapsed = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """等待factory()协程的结果；相同键的协程正在运行时共享它的结果"""
+        flight = self._calls.get(key)
+        if flight is None:
+            flight = self._calls[key] = _AsyncFlight(asyncio.ensure_future(factory()))
+            flight.task.add_done_callback(lambda _: self._forget(self._calls, key, flight))
+            self.leaders += 1
+        else:
+            self.collapsed += 1
+            logger.debug(f"合并进行中的调用: {key}")
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                flight.task.cancel()
+
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator]) -> AsyncIterator[Any]:
+        """订阅factory()产出的异步流；相同键的流正在进行时从头重放已有项目并继续接收"""
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = self._streams[key] = _AsyncStreamFlight()
+            flight.task = asyncio.ensure_future(self._drive(key, flight, factory))
+            self.stream_leaders += 1
+        else:
+            self.stream_collapsed += 1
+            logger.debug(f"合并进行中的流: {key}")
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                async with flight.cond:
+                    await flight.cond.wait_for(lambda: index < len(flight.items) or flight.done)
+                    items = flight.items[index:]
+                    done = flight.done
+                index += len(items)
+                for item in items:
+                    yield item
+                if done:
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if not flight.subscribers and not flight.done:
+                flight.task.cancel()
+                self._forget(self._streams, key, flight)
+
+    async def _drive(self, key: Hashable, flight: _AsyncStreamFlight, factory: Callable[[], AsyncIterator]):
+        iterator = factory()
+        try:
+            async for item in iterator:
+                async with flight.cond:
+                    flight.items.append(item)
+                    flight.cond.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._forget(self._streams, key, flight)
+            flight.done = True
+            aclose = getattr(iterator, 'aclose', None)
+            if aclose:
+                await aclose()
+            async with flight.cond:
+                flight.cond.notify_all()
+
+    @staticmethod
+    def _forget(registry: Dict, key: Hashable, flight):
+        if registry.get(key) is flight:
+            del registry[key]
+
+    def stats(self) -> Dict:
+        return {
+            'leaders': self.leaders,
+            'collapsed': self.collapsed,
+            'in_flight': len(self._calls),
+            'stream_leaders': self.stream_leaders,
+            'stream_collapsed': self.stream_collapsed,
+            'streams_in_flight': len(self._streams)
+        }